@@ -0,0 +1,339 @@
+"""
+Admission control for Image Music Looper
+ประมาณหน่วยความจำและ CPU สูงสุดของงานจากขนาดภาพ ความยาวเพลง และ backend
+รับงานเข้าทำพร้อมกันเฉพาะเมื่อผลรวมยังไม่เกินขีดจำกัดของเครื่อง
+และบันทึก peak RSS จริงเทียบกับค่าประมาณ เพื่อปรับตัวคูณของแต่ละ backend ให้แม่นขึ้นเรื่อยๆ
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from cache_utils import get_cache_dir, make_temp_path
+
+# สัดส่วนของหน่วยความจำเครื่องที่ให้งาน render ใช้ได้ (ที่เหลือเผื่อระบบและโปรแกรมอื่น)
+MEMORY_BUDGET_FRACTION = 0.8
+
+# ค่าพื้นฐานของ model (MB) วัดจาก FFmpeg/libx264 ที่ 1 fps บนภาพ 720p
+ENCODER_BASE_MB = 50
+ENCODER_MB_PER_MEGAPIXEL = 160
+# ภาพต้นฉบับที่ decode แล้ว (RGB/RGBA และสำเนาระหว่าง resize) ต่อล้านพิกเซล
+DECODED_MB_PER_MEGAPIXEL = 4
+# Python + NumPy + MoviePy และสำเนาภาพที่ MoviePy เก็บเป็น array
+MOVIEPY_BASE_MB = 150
+MOVIEPY_MB_PER_SOURCE_MEGAPIXEL = 9
+# process ที่วาด overlay ของ visualizer และ encoder ที่ 10 fps (lookahead มากกว่า)
+VISUALIZER_WORKER_MB = 80
+VISUALIZER_ENCODER_FACTOR = 1.5
+# ชุด STFT ของ visualizer (MB) และเสียง mono หนึ่งรอบ (ไบต์ต่อ sample, 44.1 kHz)
+VISUALIZER_STFT_MB = 32
+VISUALIZER_BYTES_PER_SECOND = 4 * 44100
+
+# ความยาวเพลงที่ใช้ประมาณเมื่ออ่านความยาวจริงไม่ได้ (วินาที)
+FALLBACK_AUDIO_SECONDS = 600
+
+# ความถี่ในการวัด RSS ระหว่างทำงาน (วินาที)
+RSS_SAMPLE_SECONDS = 0.5
+
+# น้ำหนักของค่าวัดล่าสุดเมื่อปรับตัวคูณ (exponential moving average)
+CORRECTION_SMOOTHING = 0.3
+
+# จำนวนผลวัดล่าสุดที่เก็บไว้ในไฟล์
+MAX_RECORDED_JOBS = 200
+
+FOOTPRINTS_FILE_NAME = "footprints.json"
+
+_footprints_lock = threading.Lock()
+_shared_scheduler = None
+_shared_scheduler_lock = threading.Lock()
+
+
+class AdmissionCancelled(Exception):
+    """งานถูกยกเลิกระหว่างรอคิว"""
+
+
+class JobFootprint:
+    """ค่าประมาณทรัพยากรสูงสุดของงานหนึ่งงาน"""
+
+    def __init__(self, backend, memory_mb, cpus, raw_memory_mb=None):
+        self.backend = backend
+        self.memory_mb = memory_mb
+        self.cpus = cpus
+        # ค่าจาก model ก่อนคูณตัวปรับ ใช้คำนวณตัวปรับใหม่เมื่อวัดได้
+        self.raw_memory_mb = raw_memory_mb if raw_memory_mb is not None else memory_mb
+
+    def __repr__(self):
+        return f"JobFootprint({self.backend}, {self.memory_mb:.0f} MB, {self.cpus} CPU)"
+
+
+def estimate_footprint(backend, image_size, target_size, audio_seconds=0.0, workers=None):
+    """ประมาณ peak memory (MB) และจำนวน CPU ของงาน
+
+    backend: "ffmpeg", "moviepy" หรือ "visualizer"
+    image_size: ขนาดภาพต้นฉบับ, target_size: ขนาดวิดีโอ, audio_seconds: ความยาวเพลงหนึ่งรอบ
+    """
+    source_mpx = image_size[0] * image_size[1] / 1e6
+    output_mpx = target_size[0] * target_size[1] / 1e6
+    encoder_mb = ENCODER_BASE_MB + ENCODER_MB_PER_MEGAPIXEL * output_mpx
+    decode_mb = DECODED_MB_PER_MEGAPIXEL * source_mpx
+
+    if backend == "moviepy":
+        memory_mb, cpus = MOVIEPY_BASE_MB + MOVIEPY_MB_PER_SOURCE_MEGAPIXEL * source_mpx + encoder_mb, 1
+    elif backend == "visualizer":
+        workers = workers or os.cpu_count() or 1
+        per_worker = VISUALIZER_WORKER_MB + decode_mb + encoder_mb * VISUALIZER_ENCODER_FACTOR
+        loop_mb = audio_seconds * VISUALIZER_BYTES_PER_SECOND / 1e6
+        memory_mb, cpus = decode_mb + VISUALIZER_STFT_MB + loop_mb + workers * per_worker, workers
+    else:
+        memory_mb, cpus = decode_mb + encoder_mb, 1
+
+    correction = load_corrections().get(backend, 1.0)
+    return JobFootprint(backend, memory_mb * correction, cpus, raw_memory_mb=memory_mb)
+
+
+def machine_limits():
+    """(หน่วยความจำทั้งหมด MB, หน่วยความจำที่ว่างอยู่ MB, จำนวน CPU) ของเครื่อง"""
+    total_mb = available_mb = None
+    try:
+        import psutil
+        memory = psutil.virtual_memory()
+        total_mb, available_mb = memory.total / 2 ** 20, memory.available / 2 ** 20
+    except ImportError:
+        if sys.platform.startswith('linux'):
+            total_mb, available_mb = _read_linux_meminfo()
+        elif os.name == 'nt':
+            total_mb, available_mb = _read_windows_memory()
+        elif hasattr(os, 'sysconf'):
+            try:
+                total_mb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2 ** 20
+            except (ValueError, OSError):
+                pass
+
+    total_mb = total_mb or 4096
+    return total_mb, available_mb or total_mb, os.cpu_count() or 1
+
+
+class AdmissionScheduler:
+    """คลาสสำหรับรับงานเข้าทำพร้อมกันตามหน่วยความจำและ CPU ที่เหลือ (ใช้ร่วมกันหลาย thread)"""
+
+    def __init__(self, memory_mb=None, cpus=None):
+        total_mb, _available_mb, cpu_count = machine_limits()
+        self.memory_mb = memory_mb or total_mb * MEMORY_BUDGET_FRACTION
+        self.cpus = cpus or cpu_count
+        self.reserved_memory_mb = 0.0
+        self.reserved_cpus = 0
+        self.running = 0
+        self.condition = threading.Condition()
+
+    def free_memory_mb(self):
+        """หน่วยความจำที่ยังไม่ได้จองให้งานใด (ไม่เกินที่ว่างจริงของเครื่อง)"""
+        _total_mb, available_mb, _cpus = machine_limits()
+        with self.condition:
+            return min(self.memory_mb - self.reserved_memory_mb, available_mb * MEMORY_BUDGET_FRACTION)
+
+    def fits(self, footprint):
+        """งานนี้เริ่มได้ทันทีหรือไม่ (งานแรกเริ่มได้เสมอ แม้จะใหญ่กว่าขีดจำกัด)"""
+        with self.condition:
+            return self._fits(footprint)
+
+    def _fits(self, footprint):
+        if self.running == 0:
+            return True
+        return (self.reserved_memory_mb + footprint.memory_mb <= self.memory_mb
+                and self.reserved_cpus + footprint.cpus <= self.cpus)
+
+    @contextmanager
+    def reserve(self, footprint, should_stop=None):
+        """รอจนงานเริ่มได้ แล้วจองทรัพยากรไว้จนจบ block with"""
+        with self.condition:
+            while not self._fits(footprint):
+                if should_stop and should_stop():
+                    raise AdmissionCancelled()
+                self.condition.wait(timeout=RSS_SAMPLE_SECONDS)
+            self.reserved_memory_mb += footprint.memory_mb
+            self.reserved_cpus += footprint.cpus
+            self.running += 1
+        try:
+            yield footprint
+        finally:
+            with self.condition:
+                self.reserved_memory_mb -= footprint.memory_mb
+                self.reserved_cpus -= footprint.cpus
+                self.running -= 1
+                self.condition.notify_all()
+
+
+def shared_scheduler():
+    """scheduler เดียวของทั้ง process (งานที่ไม่ได้ระบุ scheduler ใช้ร่วมกัน)"""
+    global _shared_scheduler
+    with _shared_scheduler_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = AdmissionScheduler()
+        return _shared_scheduler
+
+
+class PeakRssMonitor:
+    """วัด peak RSS ของงาน: RSS ที่เพิ่มขึ้นของ process นี้ + RSS ของ process ลูกทั้งหมด (FFmpeg, worker)
+
+    is_shared: ฟังก์ชันที่บอกว่ามีงานอื่นทำงานใน process เดียวกันอยู่หรือไม่
+    ถ้าเคยมี ค่าที่วัดได้รวมงานอื่นด้วย (shared=True) ไม่ควรใช้ปรับ model
+    stop() ส่งคืน None ถ้าวัด RSS บนระบบนี้ไม่ได้ (ไม่มี psutil และไม่ใช่ Linux)
+    """
+
+    def __init__(self, is_shared=None):
+        self.is_shared = is_shared or (lambda: False)
+        self.shared = False
+        self.peak_mb = None
+        self._baseline_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._baseline_mb = process_rss_mb(os.getpid())
+        if self._baseline_mb is None:
+            return self
+        self.peak_mb = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+        return self.peak_mb
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self._sample()
+
+    def _sample(self):
+        own_mb = (process_rss_mb(os.getpid()) or 0.0) - self._baseline_mb
+        children_mb = sum(process_rss_mb(pid) or 0.0 for pid in child_pids(os.getpid()))
+        self.peak_mb = max(self.peak_mb, max(own_mb, 0.0) + children_mb)
+        self.shared = self.shared or self.is_shared()
+
+
+def process_rss_mb(pid):
+    """RSS ปัจจุบันของ process (MB) หรือ None ถ้าอ่านไม่ได้"""
+    try:
+        import psutil
+        try:
+            return psutil.Process(pid).memory_info().rss / 2 ** 20
+        except psutil.Error:
+            return None
+    except ImportError:
+        pass
+
+    try:
+        with open(f"/proc/{pid}/statm", 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def child_pids(pid):
+    """pid ของ process ลูกทุกระดับ (ว่างถ้าอ่านไม่ได้)"""
+    try:
+        import psutil
+        try:
+            return [child.pid for child in psutil.Process(pid).children(recursive=True)]
+        except psutil.Error:
+            return []
+    except ImportError:
+        pass
+
+    found = []
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            tasks = os.listdir(f"/proc/{current}/task")
+        except OSError:
+            continue
+        for task in tasks:
+            try:
+                with open(f"/proc/{current}/task/{task}/children", 'r') as f:
+                    children = [int(value) for value in f.read().split()]
+            except (OSError, ValueError):
+                continue
+            found.extend(children)
+            pending.extend(children)
+    return found
+
+
+def record_peak_rss(footprint, peak_mb, details=None):
+    """บันทึก peak RSS ที่วัดได้เทียบกับค่าประมาณ และปรับตัวคูณของ backend นั้น"""
+    if not peak_mb or not footprint.raw_memory_mb:
+        return
+    path = _footprints_path()
+    with _footprints_lock:
+        data = _read_json(path) or {}
+        corrections = data.setdefault('corrections', {})
+        ratio = peak_mb / footprint.raw_memory_mb
+        previous = corrections.get(footprint.backend)
+        corrections[footprint.backend] = ratio if previous is None else \
+            previous + CORRECTION_SMOOTHING * (ratio - previous)
+
+        jobs = data.setdefault('jobs', [])
+        jobs.append(dict(details or {}, backend=footprint.backend, estimated_mb=round(footprint.memory_mb, 1),
+                         model_mb=round(footprint.raw_memory_mb, 1), peak_mb=round(peak_mb, 1),
+                         recorded_at=time.time()))
+        del jobs[:-MAX_RECORDED_JOBS]
+
+        temp_path = make_temp_path(path)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+        os.replace(temp_path, path)
+
+
+def load_corrections():
+    """ตัวคูณที่ได้จากผลวัดจริงของแต่ละ backend"""
+    data = _read_json(_footprints_path()) or {}
+    return data.get('corrections', {})
+
+
+def _footprints_path():
+    return os.path.join(get_cache_dir("admission"), FOOTPRINTS_FILE_NAME)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _read_linux_meminfo():
+    values = {}
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                values[name] = int(value.split()[0]) / 1024
+    except (OSError, ValueError):
+        return None, None
+    return values.get('MemTotal'), values.get('MemAvailable')
+
+
+def _read_windows_memory():
+    import ctypes
+
+    class MemoryStatus(ctypes.Structure):
+        _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                    ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                    ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                    ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                    ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+    status = MemoryStatus()
+    status.dwLength = ctypes.sizeof(MemoryStatus)
+    if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+        return None, None
+    return status.ullTotalPhys / 2 ** 20, status.ullAvailPhys / 2 ** 20
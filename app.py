@@ -1,25 +1,28 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
+import queue
+import multiprocessing
 import threading
 from PIL import Image, ImageTk
 import subprocess
-import shutil
 from pathlib import Path
+from mp4_inspector import verify_library
+from waveform import WaveformPeaks
+from library_index import LibraryIndex
+from crop_plan import CropPlan
+from looper_engine import CustomImageMusicLooper, VIDEO_QUALITY, DEFAULT_DURATION_HOURS, DEFAULT_ASPECT_RATIO
 
 # Constants
-DEFAULT_WINDOW_SIZE = "850x950"
-DEFAULT_DURATION_HOURS = 4.0
+DEFAULT_WINDOW_GEOMETRY = "850x950"
 DEFAULT_CROSSFADE_DURATION = 3000
-DEFAULT_ASPECT_RATIO = "16:9"
 
-# Video quality settings
-VIDEO_QUALITY = {
-    "16:9": (1280, 720),
-    "4:3": (960, 720),
-    "1:1": (720, 720),
-    "21:9": (1680, 720)
-}
+# ความถี่ในการตรวจคิวอัปเดต UI (มิลลิวินาที)
+UI_POLL_INTERVAL_MS = 100
+
+# ขนาดและการซูมของรูปคลื่นเสียงในแท็บตัวอย่าง
+WAVEFORM_SIZE = (620, 120)
+WAVEFORM_MAX_ZOOM = 1024
 
 # Font settings
 FONTS = {
@@ -67,172 +70,11 @@ class UIConfig:
         }
 
 
-class VideoProcessor:
-    """คลาสสำหรับประมวลผลวิดีโอ"""
-    
-    def __init__(self, progress_callback=None):
-        self.progress_callback = progress_callback
-    
-    def create_video(self, image_path, audio_path, output_path, duration_seconds, aspect_ratio):
-        """สร้างวิดีโอด้วยวิธีที่เหมาะสม"""
-        try:
-            return self._create_video_with_moviepy(image_path, audio_path, output_path, duration_seconds, aspect_ratio)
-        except ImportError:
-            return self._create_video_with_ffmpeg(image_path, audio_path, output_path, duration_seconds, aspect_ratio)
-        except Exception as e:
-            print(f"Error with MoviePy, trying FFmpeg: {e}")
-            return self._create_video_with_ffmpeg(image_path, audio_path, output_path, duration_seconds, aspect_ratio)
-    
-    def _create_video_with_moviepy(self, image_path, audio_path, output_path, duration_seconds, aspect_ratio):
-        """สร้างวิดีโอด้วย MoviePy"""
-        from moviepy.editor import ImageClip, AudioFileClip, concatenate_audioclips
-        
-        if self.progress_callback:
-            self.progress_callback(45, "กำลังใช้ MoviePy สร้างวิดีโอ...")
-        
-        # โหลดไฟล์เสียง
-        audio = AudioFileClip(audio_path)
-        
-        # คำนวณจำนวนรอบที่ต้องลูป
-        audio_duration = audio.duration
-        loops_needed = int(duration_seconds / audio_duration) + 1
-        
-        # สร้างเสียงลูป
-        audio_loops = [audio for _ in range(loops_needed)]
-        final_audio = concatenate_audioclips(audio_loops).subclip(0, duration_seconds)
-        
-        # สร้างวิดีโอจากภาพ
-        image_clip = ImageClip(image_path, duration=duration_seconds)
-        image_clip = self._resize_image_clip_moviepy(image_clip, aspect_ratio)
-        
-        # รวมภาพและเสียง
-        video = image_clip.set_audio(final_audio)
-        video.write_videofile(output_path, fps=1, codec='libx264', audio_codec='aac', verbose=False, logger=None)
-        
-        # ปิดไฟล์
-        audio.close()
-        video.close()
-        
-        return True
-    
-    def _create_video_with_ffmpeg(self, image_path, audio_path, output_path, duration_seconds, aspect_ratio):
-        """สร้างวิดีโอด้วย FFmpeg"""
-        if self.progress_callback:
-            self.progress_callback(45, "กำลังใช้ FFmpeg สร้างวิดีโอ...")
-        
-        try:
-            resized_image = self._resize_image_for_ffmpeg(image_path, aspect_ratio)
-            
-            ffmpeg_cmd = [
-                'ffmpeg', '-y', '-loop', '1',
-                '-i', resized_image, '-i', audio_path,
-                '-c:v', 'libx264', '-c:a', 'aac',
-                '-t', str(duration_seconds), '-pix_fmt', 'yuv420p',
-                '-r', '1', output_path
-            ]
-            
-            result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                if resized_image != image_path:
-                    os.remove(resized_image)
-                return True
-            else:
-                print(f"FFmpeg error: {result.stderr}")
-                return False
-                
-        except FileNotFoundError:
-            return self._create_fallback_instructions(output_path, image_path, audio_path, duration_seconds, aspect_ratio)
-        except Exception as e:
-            print(f"Error with FFmpeg: {e}")
-            return self._create_fallback_instructions(output_path, image_path, audio_path, duration_seconds, aspect_ratio)
-    
-    def _resize_image_clip_moviepy(self, clip, aspect_ratio):
-        """ปรับขนาดภาพสำหรับ MoviePy"""
-        width, height = VIDEO_QUALITY.get(aspect_ratio, VIDEO_QUALITY["16:9"])
-        return clip.resize(height=height).crop(width=width, height=height, x_center=clip.w/2, y_center=clip.h/2)
-    
-    def _resize_image_for_ffmpeg(self, image_path, aspect_ratio):
-        """ปรับขนาดภาพสำหรับ FFmpeg"""
-        img = Image.open(image_path)
-        target_size = VIDEO_QUALITY.get(aspect_ratio, VIDEO_QUALITY["16:9"])
-        img_resized = self._crop_and_resize_image(img, target_size)
-        
-        temp_image_path = image_path.replace('.jpg', '_resized.jpg').replace('.png', '_resized.jpg')
-        img_resized.save(temp_image_path, 'JPEG')
-        return temp_image_path
-    
-    def _crop_and_resize_image(self, img, target_size):
-        """Crop และ resize ภาพ"""
-        target_width, target_height = target_size
-        img_width, img_height = img.size
-        
-        target_ratio = target_width / target_height
-        img_ratio = img_width / img_height
-        
-        if img_ratio > target_ratio:
-            new_width = int(img_height * target_ratio)
-            left = (img_width - new_width) // 2
-            img = img.crop((left, 0, left + new_width, img_height))
-        else:
-            new_height = int(img_width / target_ratio)
-            top = (img_height - new_height) // 2
-            img = img.crop((0, top, img_width, top + new_height))
-        
-        return img.resize(target_size, Image.Resampling.LANCZOS)
-    
-    def _create_fallback_instructions(self, output_path, image_path, audio_path, duration_seconds, aspect_ratio):
-        """สร้างไฟล์คำแนะนำ"""
-        instructions_file = output_path.replace('.mp4', '_instructions.txt')
-        duration_hours = duration_seconds / 3600
-        
-        instructions = f"""🎬 วิธีสร้างวิดีโอด้วยตัวเอง
-
-เนื่องจากไม่สามารถสร้างวิดีโออัตโนมัติได้ กรุณาทำตามขั้นตอนต่อไปนี้:
-
-📁 ไฟล์ที่ต้องใช้:
-• ภาพ: {image_path}
-• เสียง: {audio_path}
-• ความยาววิดีโอ: {duration_hours:.1f} ชั่วโมง
-• อัตราส่วน: {aspect_ratio}
-
-🛠️ วิธีที่ 1: ใช้ FFmpeg (แนะนำ)
-1. ดาวน์โหลด FFmpeg จาก https://ffmpeg.org/download.html
-2. เปิด Command Prompt
-3. รันคำสั่ง:
-   ffmpeg -loop 1 -i "{image_path}" -i "{audio_path}" -c:v libx264 -c:a aac -t {duration_seconds} -pix_fmt yuv420p -r 1 "{output_path}"
-
-🎥 วิธีที่ 2: ใช้โปรแกรม Video Editor
-• DaVinci Resolve (ฟรี)
-• OpenShot (ฟรี)
-• Adobe Premiere Pro
-• Canva (ออนไลน์)
-
-📋 ขั้นตอน:
-1. นำเข้าภาพและเสียง
-2. ตั้งความยาวภาพเป็น {duration_hours:.1f} ชั่วโมง
-3. วางเสียงซ้ำจนครบเวลา
-4. Export เป็น MP4
-"""
-        
-        try:
-            with open(instructions_file, 'w', encoding='utf-8') as f:
-                f.write(instructions)
-            
-            if self.progress_callback:
-                self.progress_callback(100, f"สร้างไฟล์คำแนะนำ: {os.path.basename(instructions_file)}")
-            
-            return True
-        except Exception as e:
-            print(f"Error creating instructions: {e}")
-            return False
-
-
 class ImageMusicLooperUI:
     def __init__(self, root):
         self.root = root
         self.root.title("🎵 Image Music Looper - สร้างวิดีโอเพลงแบบลูป")
-        self.root.geometry(DEFAULT_WINDOW_SIZE)
+        self.root.geometry(DEFAULT_WINDOW_GEOMETRY)
         self.root.configure(bg="#f0f0f0")
         
         # Initialize variables
@@ -248,6 +90,18 @@ class ImageMusicLooperUI:
         # Preview variables
         self.image_preview = None
         self.cropped_preview = None
+        self.preview_thumbnail = None
+        self.waveform_peaks = None
+        self.waveform_bounds = None
+        self.waveform_zoom = 1
+        
+        # งานที่กำลังทำ และคิวสำหรับอัปเดต UI จาก worker thread
+        self.current_looper = None
+        self.processing_thread = None
+        self.verifying_library = False
+        self.ui_queue = queue.Queue()
+        self.root.after(UI_POLL_INTERVAL_MS, self._poll_ui_queue)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
     def _init_variables(self):
         """Initialize all tkinter variables"""
@@ -259,6 +113,10 @@ class ImageMusicLooperUI:
         self.auto_crossfade = tk.BooleanVar(value=True)
         self.aspect_ratio = tk.StringVar(value=DEFAULT_ASPECT_RATIO)
         self.keep_original = tk.BooleanVar(value=False)
+        self.trim_silence = tk.BooleanVar(value=True)
+        self.output_format = tk.StringVar(value="mp4")
+        self.endless_stream = tk.BooleanVar(value=False)
+        self.visualizer = tk.StringVar(value="none")
         
     def create_ui(self):
         """สร้าง UI ทั้งหมด"""
@@ -354,6 +212,9 @@ class ImageMusicLooperUI:
             duration_label.config(text=f"{self.duration_hours.get():.1f} ชั่วโมง", font=FONTS["label"])
         self.duration_hours.trace('w', update_duration_label)
         
+        ttk.Checkbutton(time_section, text="♾️ สตรีมไม่สิ้นสุด (HLS live, ไม่จำกัดความยาว)", 
+                       variable=self.endless_stream).pack(anchor="w", pady=(10, 0))
+        
     def create_advanced_tab(self, notebook):
         """สร้างแท็บสำหรับการตั้งค่าขั้นสูง"""
         advanced_frame = ttk.Frame(notebook)
@@ -373,6 +234,28 @@ class ImageMusicLooperUI:
         ratio_combo.pack(side="left", padx=10)
         ratio_combo.current(0)
         
+        # ส่วนรูปแบบไฟล์ผลลัพธ์
+        format_section = ttk.LabelFrame(advanced_frame, text="🎞️ รูปแบบไฟล์ผลลัพธ์", padding=15)
+        format_section.pack(fill="x", padx=20, pady=10)
+        
+        ttk.Radiobutton(format_section, text="MP4 ปกติ", 
+                       variable=self.output_format, value="mp4").pack(anchor="w")
+        ttk.Radiobutton(format_section, text="Fragmented MP4 (เริ่มอัปโหลดได้ระหว่างสร้าง)", 
+                       variable=self.output_format, value="fmp4").pack(anchor="w")
+        ttk.Radiobutton(format_section, text="MPEG-TS (.ts)", 
+                       variable=self.output_format, value="mpegts").pack(anchor="w")
+        
+        # ส่วนภาพเคลื่อนไหวตามเสียง
+        visualizer_section = ttk.LabelFrame(advanced_frame, text="🎵 ภาพเคลื่อนไหวตามเสียง", padding=15)
+        visualizer_section.pack(fill="x", padx=20, pady=10)
+        
+        ttk.Radiobutton(visualizer_section, text="ไม่มี (ภาพนิ่ง)", 
+                       variable=self.visualizer, value="none").pack(anchor="w")
+        ttk.Radiobutton(visualizer_section, text="แถบสเปกตรัมด้านล่างภาพ", 
+                       variable=self.visualizer, value="bars").pack(anchor="w")
+        ttk.Radiobutton(visualizer_section, text="วงแหวนแสดงตำแหน่งในเพลง", 
+                       variable=self.visualizer, value="ring").pack(anchor="w")
+        
         # ส่วนการตั้งค่า Crossfade
         crossfade_section = ttk.LabelFrame(advanced_frame, text="🎭 การผสมเสียง (Crossfade)", padding=15)
         crossfade_section.pack(fill="x", padx=20, pady=10)
@@ -414,17 +297,28 @@ class ImageMusicLooperUI:
         ttk.Checkbutton(other_section, text="💾 เก็บไฟล์ต้นฉบับไว้ (ไม่ลบหลังประมวลผล)", 
                        variable=self.keep_original).pack(anchor="w", pady=5)
         
+        ttk.Checkbutton(other_section, text="✂️ ตัดช่วงเงียบหัว-ท้ายเพลงก่อนลูป", 
+                       variable=self.trim_silence).pack(anchor="w", pady=5)
+        
     def create_preview_tab(self, notebook):
         """สร้างแท็บสำหรับแสดงตัวอย่าง"""
         preview_frame = ttk.Frame(notebook)
         notebook.add(preview_frame, text="👁️ ตัวอย่าง")
         
+        # ส่วนแสดงรูปคลื่นเสียง (อยู่ด้านล่างของแท็บ)
+        self._create_waveform_section(preview_frame)
+        
         # ส่วนแสดงภาพต้นฉบับ
         original_section = ttk.LabelFrame(preview_frame, text="🖼️ ภาพต้นฉบับ", padding=10)
         original_section.pack(side="left", fill="both", expand=True, padx=10, pady=10)
         
-        self.original_canvas = tk.Canvas(original_section, width=300, height=200, bg="white")
+        self.original_canvas = tk.Canvas(original_section, width=300, height=200, bg="white", cursor="crosshair")
         self.original_canvas.pack(pady=10)
+        # คลิกที่ภาพต้นฉบับเพื่อเลือกจุดกึ่งกลางของกรอบ crop เอง
+        self.original_canvas.bind("<Button-1>", self.on_original_preview_click)
+        
+        ttk.Label(original_section, text="คลิกที่ภาพเพื่อเลือกจุดกึ่งกลางของกรอบ crop",
+                  foreground="gray", font=FONTS["small"]).pack()
         
         # ส่วนแสดงภาพหลัง crop
         cropped_section = ttk.LabelFrame(preview_frame, text="✂️ ภาพหลัง Crop", padding=10)
@@ -438,7 +332,32 @@ class ImageMusicLooperUI:
         preview_btn_frame.pack(fill="x", padx=20, pady=10)
         
         ttk.Button(preview_btn_frame, text="🔄 อัปเดตตัวอย่าง", 
-                  command=self.update_preview, style="Custom.TButton").pack()
+                  command=self.update_preview, style="Custom.TButton").pack(side="left", expand=True)
+        
+        ttk.Button(preview_btn_frame, text="🎯 ใช้จุดสนใจอัตโนมัติ", 
+                  command=self.reset_crop_focus, style="Custom.TButton").pack(side="left", expand=True)
+        
+    def _create_waveform_section(self, preview_frame):
+        """สร้างส่วนแสดงรูปคลื่นเสียงพร้อมจุดต่อของลูป"""
+        waveform_section = ttk.LabelFrame(preview_frame, text="🌊 รูปคลื่นเสียง (เส้นแดง = จุดต่อลูป)", padding=10)
+        waveform_section.pack(side="bottom", fill="x", padx=10, pady=10)
+        
+        width, height = WAVEFORM_SIZE
+        self.waveform_canvas = tk.Canvas(waveform_section, width=width, height=height, bg="white")
+        self.waveform_canvas.pack(pady=5)
+        
+        controls = tk.Frame(waveform_section)
+        controls.pack(fill="x")
+        
+        ttk.Button(controls, text="🌊 โหลดรูปคลื่นเสียง", 
+                  command=self.load_waveform, style="Custom.TButton").pack(side="left", padx=5)
+        ttk.Button(controls, text="🔍 ซูมเข้า", 
+                  command=lambda: self.zoom_waveform(2), style="Custom.TButton").pack(side="left", padx=5)
+        ttk.Button(controls, text="🔎 ซูมออก", 
+                  command=lambda: self.zoom_waveform(0.5), style="Custom.TButton").pack(side="left", padx=5)
+        
+        self.waveform_label = ttk.Label(controls, text="", font=FONTS["small"])
+        self.waveform_label.pack(side="left", padx=10)
         
     def create_action_buttons(self):
         """สร้างปุ่มสำหรับการดำเนินการ"""
@@ -472,9 +391,16 @@ class ImageMusicLooperUI:
                                       command=self.start_processing, style="Custom.TButton")
         self.start_button.pack(side="left", padx=5)
         
+        self.cancel_button = ttk.Button(button_frame, text="⏹️ ยกเลิก", state="disabled",
+                                       command=self.cancel_processing, style="Custom.TButton")
+        self.cancel_button.pack(side="left", padx=5)
+        
         ttk.Button(button_frame, text="📁 เปิดโฟลเดอร์ผลลัพธ์", 
                   command=self.open_output_folder, style="Custom.TButton").pack(side="left", padx=5)
         
+        ttk.Button(button_frame, text="🧪 ตรวจสอบไลบรารี", 
+                  command=self.verify_output_library, style="Custom.TButton").pack(side="left", padx=5)
+        
     def select_image(self):
         """เลือกไฟล์ภาพ"""
         filters = UIConfig.get_file_filters()['image']
@@ -490,6 +416,7 @@ class ImageMusicLooperUI:
         if file_path:
             self.audio_path.set(file_path)
             self.update_status(f"เลือกเสียง: {os.path.basename(file_path)}")
+            self.load_waveform()
             
     def select_output(self):
         """เลือกโฟลเดอร์ผลลัพธ์"""
@@ -512,6 +439,7 @@ class ImageMusicLooperUI:
             
             self.original_canvas.delete("all")
             self.original_canvas.create_image(150, 100, image=self.image_preview)
+            self.preview_thumbnail = original_img
             
             # สร้างภาพหลัง crop ตัวอย่าง
             self.create_crop_preview(original_img)
@@ -522,40 +450,125 @@ class ImageMusicLooperUI:
             messagebox.showerror("ข้อผิดพลาด", f"ไม่สามารถแสดงตัวอย่างได้: {str(e)}")
             
     def create_crop_preview(self, img):
-        """สร้างตัวอย่างภาพหลัง crop"""
-        ratio = self.aspect_ratio.get()
-        width, height = img.size
-        
-        if ratio == "16:9":
-            target_ratio = 16/9
-        elif ratio == "4:3":
-            target_ratio = 4/3
-        elif ratio == "1:1":
-            target_ratio = 1/1
-        elif ratio == "21:9":
-            target_ratio = 21/9
-        else:
-            target_ratio = 16/9
-            
-        current_ratio = width / height
+        """สร้างตัวอย่างภาพหลัง crop (กรอบเดียวกับที่ใช้ตอนสร้างวิดีโอ)"""
+        target_size = VIDEO_QUALITY.get(self.aspect_ratio.get(), VIDEO_QUALITY["16:9"])
+        plan = CropPlan.for_image(self.image_path.get(), target_size)
+        box = plan.scaled_box(img.size)
+        cropped = img.crop(box)
         
-        if current_ratio > target_ratio:
-            # ภาพกว้างเกินไป ตัดข้าง
-            new_width = int(height * target_ratio)
-            left = (width - new_width) // 2
-            cropped = img.crop((left, 0, left + new_width, height))
-        else:
-            # ภาพสูงเกินไป ตัดบนล่าง
-            new_height = int(width / target_ratio)
-            top = (height - new_height) // 2
-            cropped = img.crop((0, top, width, top + new_height))
-            
         cropped.thumbnail((280, 180), Image.Resampling.LANCZOS)
         self.cropped_preview = ImageTk.PhotoImage(cropped)
         
         self.cropped_canvas.delete("all")
         self.cropped_canvas.create_image(150, 100, image=self.cropped_preview)
         
+        # แสดงกรอบบนภาพต้นฉบับ
+        left, top = 150 - img.width / 2, 100 - img.height / 2
+        self.original_canvas.delete("crop_box")
+        self.original_canvas.create_rectangle(left + box[0], top + box[1], left + box[2], top + box[3],
+                                              outline="red" if plan.source == "manual" else "orange",
+                                              width=2, tags="crop_box")
+    
+    def on_original_preview_click(self, event):
+        """เลือกจุดกึ่งกลางของกรอบ crop เองจากตำแหน่งที่คลิกบนภาพต้นฉบับ"""
+        img = self.preview_thumbnail
+        if img is None or not self.image_path.get():
+            return
+        focus = ((event.x - (150 - img.width / 2)) / img.width, (event.y - (100 - img.height / 2)) / img.height)
+        if not (0 <= focus[0] <= 1 and 0 <= focus[1] <= 1):
+            return
+        
+        target_size = VIDEO_QUALITY.get(self.aspect_ratio.get(), VIDEO_QUALITY["16:9"])
+        CropPlan.set_manual_focus(self.image_path.get(), target_size, focus)
+        self.create_crop_preview(img)
+        self.update_status("บันทึกจุดกึ่งกลางของกรอบ crop แล้ว")
+    
+    def reset_crop_focus(self):
+        """ลบจุดที่เลือกเอง กลับไปใช้จุดสนใจที่คำนวณอัตโนมัติ"""
+        img = self.preview_thumbnail
+        if img is None or not self.image_path.get():
+            return
+        target_size = VIDEO_QUALITY.get(self.aspect_ratio.get(), VIDEO_QUALITY["16:9"])
+        CropPlan.clear_manual_focus(self.image_path.get(), target_size)
+        self.create_crop_preview(img)
+        self.update_status("ใช้จุดสนใจอัตโนมัติแล้ว")
+        
+    def load_waveform(self):
+        """โหลด peaks ของเพลง (จาก cache หรือคำนวณใหม่) ใน background"""
+        audio_path = self.audio_path.get()
+        if not audio_path or not os.path.exists(audio_path):
+            return
+        trim_silence = self.trim_silence.get()
+        self.waveform_label.config(text="กำลังโหลดรูปคลื่นเสียง...")
+        
+        def worker():
+            try:
+                peaks = WaveformPeaks.load_or_compute(audio_path)
+                bounds = LibraryIndex().loop_bounds(audio_path) if trim_silence else None
+                if bounds:
+                    bounds = (bounds['start'], bounds['end'])
+                else:
+                    bounds = (0.0, peaks.duration)
+                self._run_on_ui(self._show_waveform, peaks, bounds)
+            except Exception as e:
+                self._run_on_ui(self.waveform_label.config, text=f"แสดงรูปคลื่นเสียงไม่ได้: {e}")
+        
+        threading.Thread(target=worker, daemon=True).start()
+    
+    def _show_waveform(self, peaks, bounds):
+        """เก็บ peaks ที่โหลดแล้วและวาดรูปคลื่น"""
+        self.waveform_peaks = peaks
+        self.waveform_bounds = bounds
+        self.waveform_zoom = 1
+        self.draw_waveform()
+    
+    def zoom_waveform(self, factor):
+        """ซูมรูปคลื่นรอบจุดต่อของลูป"""
+        if self.waveform_peaks is None:
+            return
+        self.waveform_zoom = min(max(self.waveform_zoom * factor, 1), WAVEFORM_MAX_ZOOM)
+        self.draw_waveform()
+    
+    def draw_waveform(self):
+        """วาดรูปคลื่นลงบน canvas
+        
+        ซูม 1 เท่า: แสดงทั้งเพลงพร้อมเส้นจุดเริ่ม/จบของลูป
+        ซูมมากกว่านั้น: แสดงท้ายลูปต่อด้วยหัวลูป โดยมีจุดต่ออยู่ตรงกลาง
+        """
+        canvas = self.waveform_canvas
+        canvas.delete("all")
+        peaks = self.waveform_peaks
+        if peaks is None or not peaks.duration:
+            return
+        
+        import numpy as np
+        
+        width, height = WAVEFORM_SIZE
+        middle = height / 2
+        start, end = self.waveform_bounds
+        
+        if self.waveform_zoom <= 1:
+            mins, maxs = peaks.columns(0, peaks.duration, width)
+            markers = [start / peaks.duration * width, end / peaks.duration * width]
+            visible = peaks.duration
+        else:
+            visible = (end - start) / self.waveform_zoom
+            half = width // 2
+            tail_mins, tail_maxs = peaks.columns(end - visible / 2, end, half)
+            head_mins, head_maxs = peaks.columns(start, start + visible / 2, width - half)
+            mins = np.concatenate((tail_mins, head_mins))
+            maxs = np.concatenate((tail_maxs, head_maxs))
+            markers = [half]
+        
+        for x, (low, high) in enumerate(zip(mins, maxs)):
+            canvas.create_line(x, middle - high * middle, x, middle - low * middle + 1, fill="#3498db")
+        for marker in markers:
+            canvas.create_line(marker, 0, marker, height, fill="#e74c3c", dash=(4, 2))
+        
+        self.waveform_label.config(
+            text=f"ซูม {self.waveform_zoom:g}x • แสดง {visible:.2f} วินาที • ลูป {start:.3f}-{end:.3f} วินาที"
+        )
+    
     def validate_settings(self):
         """ตรวจสอบการตั้งค่า"""
         errors = []
@@ -587,10 +600,12 @@ class ImageMusicLooperUI:
 🖼️ ภาพ: {os.path.basename(self.image_path.get())}
 🎵 เสียง: {os.path.basename(self.audio_path.get())}
 📁 บันทึกที่: {self.output_path.get()}
-⏰ ความยาว: {self.duration_hours.get():.1f} ชั่วโมง
+⏰ ความยาว: {'ไม่สิ้นสุด (HLS live)' if self.endless_stream.get() else f'{self.duration_hours.get():.1f} ชั่วโมง'}
 📐 อัตราส่วน: {self.aspect_ratio.get()}
 🎭 Crossfade: {'อัตโนมัติ' if self.auto_crossfade.get() else f'{self.crossfade_duration.get()} ms'}
 💾 เก็บไฟล์ต้นฉบับ: {'ใช่' if self.keep_original.get() else 'ไม่'}
+✂️ ตัดช่วงเงียบ: {'ใช่' if self.trim_silence.get() else 'ไม่'}
+🎞️ รูปแบบไฟล์: {self.output_format.get()}
 
 พร้อมสร้างวิดีโอแล้ว! 🚀"""
             
@@ -603,47 +618,57 @@ class ImageMusicLooperUI:
             return
             
         # ยืนยันการเริ่มต้น
-        if not messagebox.askyesno("ยืนยัน", 
-                                  f"เริ่มสร้างวิดีโอความยาว {self.duration_hours.get():.1f} ชั่วโมง?\n"
-                                  "การประมวลผลอาจใช้เวลานาน"):
+        if self.endless_stream.get():
+            question = "เริ่มสตรีม HLS แบบไม่สิ้นสุด?\nกดปุ่ม \"ยกเลิก\" เมื่อต้องการหยุดสตรีม"
+        else:
+            question = (f"เริ่มสร้างวิดีโอความยาว {self.duration_hours.get():.1f} ชั่วโมง?\n"
+                        "การประมวลผลอาจใช้เวลานาน")
+        if not messagebox.askyesno("ยืนยัน", question):
             return
             
         # ปิดการใช้งานปุ่ม
         self.start_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        
+        # สร้าง looper แบบกำหนดเอง (อ่านค่าจาก Tk variables บน main thread)
+        self.current_looper = CustomImageMusicLooper(
+            image_file=self.image_path.get(),
+            audio_file=self.audio_path.get(),
+            output_folder=self.output_path.get(),
+            duration_hours=self.duration_hours.get(),
+            aspect_ratio=self.aspect_ratio.get(),
+            crossfade_duration=self.crossfade_duration.get(),
+            auto_crossfade=self.auto_crossfade.get(),
+            keep_original=self.keep_original.get(),
+            trim_silence=self.trim_silence.get(),
+            output_format=self.output_format.get(),
+            endless=self.endless_stream.get(),
+            visualizer=None if self.visualizer.get() == "none" else self.visualizer.get(),
+            progress_callback=self.update_progress
+        )
         
         # เริ่ม thread สำหรับการประมวลผล
-        processing_thread = threading.Thread(target=self.process_video)
-        processing_thread.daemon = True
-        processing_thread.start()
+        self.processing_thread = threading.Thread(target=self.process_video, args=(self.current_looper,))
+        self.processing_thread.daemon = True
+        self.processing_thread.start()
         
-    def process_video(self):
-        """ประมวลผลวิดีโอ"""
+    def process_video(self, looper):
+        """ประมวลผลวิดีโอ (ทำงานใน worker thread)"""
         try:
             self.update_status("เริ่มการประมวลผล...")
-            self.progress_var.set(10)
-            
-            # สร้าง looper แบบกำหนดเอง
-            looper = CustomImageMusicLooper(
-                image_file=self.image_path.get(),
-                audio_file=self.audio_path.get(),
-                output_folder=self.output_path.get(),
-                duration_hours=self.duration_hours.get(),
-                aspect_ratio=self.aspect_ratio.get(),
-                crossfade_duration=self.crossfade_duration.get(),
-                auto_crossfade=self.auto_crossfade.get(),
-                keep_original=self.keep_original.get(),
-                progress_callback=self.update_progress
-            )
+            self.update_progress(10)
             
             # เริ่มการประมวลผล
             success = looper.process()
             
-            if success:
-                self.progress_var.set(100)
+            if looper.cancelled:
+                self.update_progress(0, "ยกเลิกการสร้างวิดีโอแล้ว ⏹️")
+            elif success:
+                self.update_progress(100)
                 self.update_status("เสร็จสิ้น! สร้างวิดีโอสำเร็จ ✅")
                 
                 # แสดงข้อความสำเร็จ
-                messagebox.showinfo("สำเร็จ!", 
+                self._run_on_ui(messagebox.showinfo, "สำเร็จ!", 
                                    f"สร้างวิดีโอเสร็จสิ้น!\n"
                                    f"ไฟล์บันทึกที่: {looper.output_video}")
             else:
@@ -664,9 +689,9 @@ class ImageMusicLooperUI:
 2. หรือใช้โปรแกรม Video Editor อื่น
 3. หรือรันโปรแกรมจากไฟล์ Python แทน .exe"""
                     
-                    messagebox.showwarning("ไม่สามารถสร้างวิดีโอได้", message)
+                    self._run_on_ui(messagebox.showwarning, "ไม่สามารถสร้างวิดีโอได้", message)
                 else:
-                    messagebox.showerror("ข้อผิดพลาด", 
+                    self._run_on_ui(messagebox.showerror, "ข้อผิดพลาด", 
                                        "ไม่สามารถสร้างวิดีโอได้\n\n"
                                        "💡 แนะนำ: รันโปรแกรมจากไฟล์ Python แทน .exe\n"
                                        "หรือติดตั้ง FFmpeg ในระบบ")
@@ -677,7 +702,7 @@ class ImageMusicLooperUI:
             # แสดงข้อความข้อผิดพลาดที่มีประโยชน์
             error_msg = str(e)
             if "moviepy" in error_msg.lower() or "no module named" in error_msg.lower():
-                messagebox.showerror("ขาดไลบรารี่", 
+                self._run_on_ui(messagebox.showerror, "ขาดไลบรารี่", 
                                    f"ข้อผิดพลาด: {error_msg}\n\n"
                                    "💡 วิธีแก้ไข:\n"
                                    "1. รันคำสั่ง: pip install moviepy\n"
@@ -685,7 +710,7 @@ class ImageMusicLooperUI:
                                    "3. หรือใช้โปรแกรม Video Editor อื่น\n\n"
                                    "🚀 หรือ Build ใหม่ด้วย: python build.py")
             else:
-                messagebox.showerror("ข้อผิดพลาด", f"เกิดข้อผิดพลาด: {str(e)}\n\n"
+                self._run_on_ui(messagebox.showerror, "ข้อผิดพลาด", f"เกิดข้อผิดพลาด: {str(e)}\n\n"
                                    "💡 ลองตรวจสอบ:\n"
                                    "• ไฟล์ภาพและเสียงถูกต้องหรือไม่\n"
                                    "• มีพื้นที่ในการบันทึกเพียงพอหรือไม่\n"
@@ -693,18 +718,59 @@ class ImageMusicLooperUI:
             
         finally:
             # เปิดการใช้งานปุ่มใหม่
-            self.start_button.config(state="normal")
+            self._run_on_ui(self._on_processing_finished)
+    
+    def _on_processing_finished(self):
+        """คืนสถานะปุ่มหลังงานจบหรือถูกยกเลิก"""
+        self.current_looper = None
+        self.start_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
+    
+    def cancel_processing(self):
+        """ยกเลิกงานที่กำลังทำอยู่"""
+        looper = self.current_looper
+        if looper is None:
+            return
+        self.update_status("กำลังยกเลิก...")
+        self.cancel_button.config(state="disabled")
+        threading.Thread(target=looper.cancel, daemon=True).start()
+    
+    def on_close(self):
+        """ปิดหน้าต่าง: ยกเลิกงานที่ค้างและรอให้ลบไฟล์ชั่วคราวก่อนออก"""
+        if self.current_looper is not None:
+            if not messagebox.askyesno("ยืนยัน", "กำลังสร้างวิดีโออยู่ ต้องการยกเลิกและปิดโปรแกรม?"):
+                return
+            self.current_looper.cancel()
+            if self.processing_thread is not None:
+                self.processing_thread.join(timeout=5)
+        self.root.destroy()
             
     def update_progress(self, value, message=""):
         """อัปเดต progress bar"""
-        self.progress_var.set(value)
+        self._run_on_ui(self.progress_var.set, value)
         if message:
             self.update_status(message)
             
     def update_status(self, message):
         """อัปเดตข้อความสถานะ"""
-        self.status_label.config(text=message)
-        self.root.update_idletasks()
+        self._run_on_ui(self.status_label.config, text=message)
+    
+    def _run_on_ui(self, func, *args, **kwargs):
+        """เรียกคำสั่งของ Tk บน main thread (thread อื่นจะส่งผ่านคิว)"""
+        if threading.current_thread() is threading.main_thread():
+            func(*args, **kwargs)
+        else:
+            self.ui_queue.put((func, args, kwargs))
+    
+    def _poll_ui_queue(self):
+        """ดึงคำสั่งจากคิวมาทำบน main thread โดยไม่บล็อก mainloop"""
+        try:
+            while True:
+                func, args, kwargs = self.ui_queue.get_nowait()
+                func(*args, **kwargs)
+        except queue.Empty:
+            pass
+        self.root.after(UI_POLL_INTERVAL_MS, self._poll_ui_queue)
         
     def open_output_folder(self):
         """เปิดโฟลเดอร์ผลลัพธ์"""
@@ -715,88 +781,49 @@ class ImageMusicLooperUI:
                 subprocess.run(['open', self.output_path.get()])
         else:
             messagebox.showwarning("เตือน", "โฟลเดอร์ไม่พบ")
-
-
-class CustomImageMusicLooper:
-    """คลาสสำหรับประมวลผลตาม UI"""
-    
-    def __init__(self, image_file, audio_file, output_folder, duration_hours, 
-                 aspect_ratio, crossfade_duration, auto_crossfade, keep_original, 
-                 progress_callback=None):
-        self.image_file = image_file
-        self.audio_file = audio_file
-        self.output_folder = output_folder
-        self.duration_hours = duration_hours
-        self.aspect_ratio = aspect_ratio
-        self.crossfade_duration = crossfade_duration
-        self.auto_crossfade = auto_crossfade
-        self.keep_original = keep_original
-        self.progress_callback = progress_callback
-        
-        # สร้าง processor
-        self.video_processor = VideoProcessor(progress_callback)
-        
-        # ชื่อไฟล์ผลลัพธ์
-        base_name = os.path.splitext(os.path.basename(audio_file))[0]
-        self.output_video = os.path.join(output_folder, f"{base_name}_music_loop.mp4")
-        
-    def process(self):
-        """ประมวลผลหลัก"""
-        try:
-            if self.progress_callback:
-                self.progress_callback(20, "กำลังโหลดไฟล์เสียง...")
-                
-            # สร้างโฟลเดอร์ชั่วคราว
-            temp_folder = self._create_temp_folder()
-            
-            # คัดลอกไฟล์
-            temp_audio, temp_image = self._copy_files_to_temp(temp_folder)
-            
-            if self.progress_callback:
-                self.progress_callback(40, "กำลังประมวลผลเสียง...")
-            
-            # สร้างวิดีโอ
-            success = self.video_processor.create_video(
-                image_path=temp_image,
-                audio_path=temp_audio,
-                output_path=self.output_video,
-                duration_seconds=int(self.duration_hours * 3600),
-                aspect_ratio=self.aspect_ratio
-            )
-            
-            if self.progress_callback:
-                self.progress_callback(80, "กำลังจัดระเบียบไฟล์...")
-                
-            # ลบโฟลเดอร์ชั่วคราว
-            shutil.rmtree(temp_folder, ignore_errors=True)
-            
-            if self.progress_callback:
-                self.progress_callback(100, "เสร็จสิ้น!")
-                
-            return success
-            
-        except Exception as e:
-            print(f"Error in CustomImageMusicLooper: {e}")
-            return False
     
-    def _create_temp_folder(self):
-        """สร้างโฟลเดอร์ชั่วคราว"""
-        temp_folder = os.path.join(self.output_folder, "temp")
-        os.makedirs(temp_folder, exist_ok=True)
-        return temp_folder
-    
-    def _copy_files_to_temp(self, temp_folder):
-        """คัดลอกไฟล์ไปยังโฟลเดอร์ชั่วคราว"""
-        base_name = os.path.splitext(os.path.basename(self.audio_file))[0]
-        temp_audio = os.path.join(temp_folder, f"{base_name}.mp3")
-        temp_image = os.path.join(temp_folder, f"{base_name}.jpg")
+    def verify_output_library(self):
+        """ตรวจสอบไฟล์ MP4 ทั้งหมดในโฟลเดอร์ผลลัพธ์ (อ่านไฟล์ใน background หน้าต่างไม่ค้าง)"""
+        folder = self.output_path.get()
+        if not os.path.exists(folder):
+            messagebox.showwarning("เตือน", "โฟลเดอร์ไม่พบ")
+            return
+        if self.verifying_library:
+            return
         
-        shutil.copy2(self.audio_file, temp_audio)
-        shutil.copy2(self.image_file, temp_image)
+        self.verifying_library = True
+        self.update_status("กำลังตรวจสอบไฟล์วิดีโอในโฟลเดอร์...")
         
-        return temp_audio, temp_image
+        def worker():
+            try:
+                results = verify_library(folder)
+                self._run_on_ui(self._show_library_results, results)
+            except Exception as e:
+                self._run_on_ui(messagebox.showerror, "ตรวจสอบไลบรารี", f"ตรวจสอบไม่ได้: {e}")
+            finally:
+                self._run_on_ui(setattr, self, 'verifying_library', False)
+        
+        threading.Thread(target=worker, daemon=True).start()
+    
+    def _show_library_results(self, results):
+        """แสดงผลการตรวจสอบไลบรารี"""
+        failed = [(path, problems) for path, ok, problems in results if not ok]
+        self.update_status(f"ตรวจสอบแล้ว {len(results)} ไฟล์, มีปัญหา {len(failed)} ไฟล์")
+        
+        if not results:
+            messagebox.showinfo("ตรวจสอบไลบรารี", "ไม่พบไฟล์ MP4 ในโฟลเดอร์")
+        elif failed:
+            details = "\n".join(f"❌ {os.path.basename(path)}: {problems[0]}" for path, problems in failed[:10])
+            messagebox.showwarning("ตรวจสอบไลบรารี", 
+                                   f"พบไฟล์ที่มีปัญหา {len(failed)} จาก {len(results)} ไฟล์\n\n{details}")
+        else:
+            messagebox.showinfo("ตรวจสอบไลบรารี", f"✅ ไฟล์ทั้งหมด {len(results)} ไฟล์ถูกต้อง")
+
+
 def main():
     """ฟังก์ชันหลัก"""
+    # จำเป็นสำหรับ process pool ของ visualizer เมื่อ build เป็นไฟล์ .exe
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = ImageMusicLooperUI(root)
     root.mainloop()
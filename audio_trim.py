@@ -0,0 +1,310 @@
+"""
+Audio loop-boundary trimming for Image Music Looper
+หาจุดเริ่มและจุดจบจริงของเพลง (ตัดช่วงเงียบและ padding ของ encoder)
+เพื่อไม่ให้มีช่องว่างซ้ำทุกรอบของลูป
+"""
+
+import os
+import struct
+
+from mp4_inspector import Mp4Inspector, Mp4ParseError
+from pcm_cache import PcmAudio, decode_range
+
+# ระดับเสียงที่ถือว่าเงียบ (dBFS)
+SILENCE_THRESHOLD_DB = -60.0
+
+# ขนาดหน้าต่างสำหรับคำนวณ RMS (วินาที)
+RMS_WINDOW_SECONDS = 0.01
+
+# ความยาวช่วงหัว/ท้ายที่ decode เมื่อรู้ความยาวจาก metadata แล้ว (วินาที)
+EDGE_SCAN_SECONDS = 30.0
+
+# ตำแหน่ง Xing/Info header ใน frame แรกของ MP3 (นับจากหลัง frame header)
+XING_OFFSETS = {
+    (True, False): 32, (True, True): 17,    # MPEG1 stereo / mono
+    (False, False): 17, (False, True): 9,   # MPEG2/2.5 stereo / mono
+}
+
+MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),   # MPEG1
+    2: (22050, 24000, 16000),   # MPEG2
+    0: (11025, 12000, 8000),    # MPEG2.5
+}
+
+
+class AudioTrimmer:
+    """คลาสสำหรับหาขอบเขตของลูปเสียง"""
+
+    def __init__(self, threshold_db=SILENCE_THRESHOLD_DB):
+        self.threshold_db = threshold_db
+
+    def find_loop_bounds(self, audio_path):
+        """ส่งคืน dict ที่มี start/end (วินาที) และแหล่งที่มาของข้อมูล"""
+        gapless = read_gapless_info(audio_path)
+
+        try:
+            if gapless:
+                # รู้ความยาวที่แน่นอนแล้ว ตรวจแค่ช่วงหัวและท้ายเพื่อหาช่วงเงียบ
+                # ใช้ PCM ใน cache ถ้ามี ไม่เช่นนั้น decode เฉพาะสองช่วงนั้น (ไม่ decode ทั้งเพลง)
+                duration = gapless['valid_samples'] / gapless['sample_rate']
+                pcm = PcmAudio.load_cached(audio_path)
+                if pcm is not None:
+                    start, end = self._scan_edges(pcm, duration)
+                else:
+                    start, end = self._scan_decoded_edges(audio_path, duration)
+                source = 'metadata'
+            else:
+                pcm = PcmAudio.load_or_decode(audio_path)
+                duration = pcm.duration
+                start, end = self._find_content_range(pcm.samples, pcm.sample_rate)
+                source = 'decode'
+        except (ImportError, OSError, RuntimeError, ValueError) as e:
+            # ไม่มี NumPy/FFmpeg ใช้ได้เฉพาะข้อมูลจาก metadata
+            print(f"Silence detection unavailable: {e}")
+            if not gapless:
+                return None
+            duration = gapless['valid_samples'] / gapless['sample_rate']
+            start, end = 0.0, duration
+            source = 'metadata'
+
+        if end <= start:
+            return None
+        return {'start': start, 'end': end, 'duration': duration, 'source': source}
+
+    def _scan_edges(self, pcm, duration):
+        """หาจุดเริ่ม/จบจากช่วงหัวและท้ายของเพลงเท่านั้น"""
+        edge = min(EDGE_SCAN_SECONDS, duration / 2)
+
+        head = pcm.samples[:pcm.frame_at(edge)]
+        head_start, _ = self._find_content_range(head, pcm.sample_rate)
+
+        # ตัดส่วนที่เกินความยาวจริง (padding ท้ายไฟล์)
+        tail_offset = max(duration - edge, 0.0)
+        tail = pcm.samples[pcm.frame_at(tail_offset):pcm.frame_at(duration)]
+        _, tail_end = self._find_content_range(tail, pcm.sample_rate)
+
+        return head_start, tail_offset + tail_end
+
+    def _scan_decoded_edges(self, audio_path, duration):
+        """decode เฉพาะช่วงหัวและท้ายของเพลงเพื่อหาจุดเริ่ม/จบ"""
+        edge = min(EDGE_SCAN_SECONDS, duration / 2)
+
+        head, sample_rate = decode_range(audio_path, duration=edge)
+        head_start, _ = self._find_content_range(head, sample_rate)
+
+        tail_offset = max(duration - edge, 0.0)
+        tail, sample_rate = decode_range(audio_path, start=tail_offset)
+        # ตัดส่วนที่เกินความยาวจริง (padding ท้ายไฟล์)
+        tail = tail[:max(int(round((duration - tail_offset) * sample_rate)), 0)]
+        _, tail_end = self._find_content_range(tail, sample_rate)
+
+        return head_start, tail_offset + tail_end
+
+    def _find_content_range(self, samples, sample_rate):
+        """หาตำแหน่ง frame แรกและสุดท้ายที่ดังกว่าเกณฑ์ด้วย windowed RMS
+
+        samples เป็น array ขนาด [frames, channels] (หรือ mono 1 มิติ) ใช้ slice ของ memmap ได้โดยตรง
+        """
+        import numpy as np
+
+        samples = samples.reshape(len(samples), -1)
+        total = len(samples)
+        if not total or not sample_rate:
+            return 0.0, 0.0
+
+        window = max(int(sample_rate * RMS_WINDOW_SECONDS), 1)
+        frame_count = total // window
+        threshold = 10 ** (self.threshold_db / 20)
+
+        if frame_count:
+            # reshape ของช่วงต่อเนื่องเป็น view ไม่คัดลอกข้อมูล
+            frames = samples[:frame_count * window].reshape(frame_count, -1)
+            rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+            loud = np.flatnonzero(rms > threshold)
+        else:
+            loud = np.empty(0, dtype=np.int64)
+
+        if not len(loud):
+            return 0.0, total / sample_rate
+
+        # ละเอียดถึงระดับ frame ภายในหน้าต่างแรกและหน้าต่างสุดท้าย
+        first_window = max(loud[0] - 1, 0) * window
+        last_window_end = min((loud[-1] + 2) * window, total)
+
+        head = np.flatnonzero(np.abs(samples[first_window:(loud[0] + 1) * window]).max(axis=1) > threshold)
+        tail = np.flatnonzero(np.abs(samples[loud[-1] * window:last_window_end]).max(axis=1) > threshold)
+
+        start_sample = first_window + (head[0] if len(head) else 0)
+        end_sample = loud[-1] * window + (tail[-1] + 1 if len(tail) else window)
+        return float(start_sample / sample_rate), float(min(end_sample, total) / sample_rate)
+
+
+def read_gapless_info(audio_path):
+    """อ่านข้อมูล gapless (LAME / iTunSMPB) จาก header โดยไม่ decode"""
+    ext = os.path.splitext(audio_path)[1].lower()
+    try:
+        if ext in ('.m4a', '.mp4', '.aac', '.m4b'):
+            return _read_mp4_itunsmpb(audio_path)
+        return _read_mp3_gapless(audio_path)
+    except (OSError, struct.error, ValueError, IndexError, Mp4ParseError):
+        return None
+
+
+def _read_mp3_gapless(audio_path):
+    """อ่าน LAME tag หรือ iTunSMPB ใน ID3 ของไฟล์ MP3"""
+    with open(audio_path, 'rb') as f:
+        header = f.read(10)
+        offset = 0
+        id3_data = b''
+        if header[:3] == b'ID3':
+            size = _syncsafe(header[6:10])
+            footer = 10 if header[5] & 0x10 else 0
+            id3_data = f.read(size)
+            offset = 10 + size + footer
+
+        f.seek(offset)
+        data = f.read(4096)
+
+    # หา frame sync แรก
+    for index in range(len(data) - 4):
+        if data[index] == 0xFF and (data[index + 1] & 0xE0) == 0xE0:
+            break
+    else:
+        return None
+
+    b1, b2, b3 = data[index + 1], data[index + 2], data[index + 3]
+    version = (b1 >> 3) & 0x03
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version == 1 or sample_rate_index == 3:
+        return None
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    mpeg1 = version == 3
+    mono = (b3 >> 6) == 3
+    samples_per_frame = 1152 if mpeg1 else 576
+
+    xing = index + 4 + XING_OFFSETS[(mpeg1, mono)]
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        position = xing + 8
+        frames = None
+        if flags & 0x01:
+            frames = struct.unpack('>I', data[position:position + 4])[0]
+            position += 4
+        if flags & 0x02:
+            position += 4
+        if flags & 0x04:
+            position += 100
+        if flags & 0x08:
+            position += 4
+
+        # LAME extension: delay/padding 12 bit อยู่ที่ byte 21-23 ของ tag
+        if frames and data[position:position + 4] in (b'LAME', b'Lavf', b'Lavc'):
+            raw = data[position + 21:position + 24]
+            delay = (raw[0] << 4) | (raw[1] >> 4)
+            padding = ((raw[1] & 0x0F) << 8) | raw[2]
+            total = frames * samples_per_frame
+            return {
+                'sample_rate': sample_rate,
+                'delay': delay,
+                'padding': padding,
+                'valid_samples': total - delay - padding,
+            }
+
+    smpb = _find_id3_itunsmpb(id3_data)
+    if smpb:
+        return _parse_itunsmpb(smpb, sample_rate)
+    return None
+
+
+def _find_id3_itunsmpb(id3_data):
+    """หา COMM frame ชื่อ iTunSMPB ใน ID3v2.3/2.4"""
+    position = 0
+    while position + 10 <= len(id3_data):
+        frame_id = id3_data[position:position + 4]
+        if not frame_id.strip(b'\x00'):
+            break
+        size = struct.unpack('>I', id3_data[position + 4:position + 8])[0]
+        body = id3_data[position + 10:position + 10 + size]
+        if frame_id == b'COMM' and len(body) > 4:
+            encoding = body[0]
+            text = body[4:]
+            if encoding in (1, 2):
+                # คำอธิบายและข้อความขึ้นต้นด้วย BOM ของตัวเอง
+                text = text.decode('utf-16' if encoding == 1 else 'utf-16-be', errors='ignore')
+                parts = text.replace('\ufeff', '').split('\x00')
+            else:
+                parts = text.decode('latin-1').split('\x00')
+            if parts and parts[0] == 'iTunSMPB':
+                return ''.join(parts[1:])
+        position += 10 + size
+    return None
+
+
+def _read_mp4_itunsmpb(audio_path):
+    """อ่าน iTunSMPB จาก moov/udta/meta/ilst ของไฟล์ MP4/M4A"""
+    inspector = Mp4Inspector(audio_path)
+    info = inspector.inspect()
+    sound = [track for track in info['tracks'] if track['type'] == 'soun']
+    if not sound or not sound[0]['timescale']:
+        return None
+
+    with open(audio_path, 'rb') as f:
+        file_size = os.path.getsize(audio_path)
+        smpb = _find_mp4_freeform(inspector, f, 0, file_size, b'iTunSMPB')
+    if not smpb:
+        return None
+    return _parse_itunsmpb(smpb, sound[0]['timescale'])
+
+
+def _find_mp4_freeform(inspector, f, start, end, name, keys=None):
+    """ค้นหาค่า metadata ตามชื่อ ทั้งแบบ iTunes ('----') และแบบ mdta keys"""
+    for box_type, box_start, header_size, box_end in inspector._iter_boxes(f, start, end):
+        payload = box_start + header_size
+        if box_type in (b'moov', b'udta', b'ilst'):
+            found = _find_mp4_freeform(inspector, f, payload, box_end, name, keys)
+            if found:
+                return found
+        elif box_type == b'meta':
+            # meta ของ MP4 เป็น FullBox มี version/flags นำหน้า 4 byte
+            f.seek(payload)
+            if f.read(4) == b'\x00\x00\x00\x00':
+                payload += 4
+            found = _find_mp4_freeform(inspector, f, payload, box_end, name, keys={})
+            if found:
+                return found
+        elif box_type == b'keys' and keys is not None:
+            f.seek(payload + 4)
+            entry_count = struct.unpack('>I', f.read(4))[0]
+            for index in range(1, entry_count + 1):
+                key_size = struct.unpack('>I', f.read(4))[0]
+                keys[index] = f.read(key_size - 4)[4:]
+        elif box_type == b'----' or (keys and struct.unpack('>I', box_type)[0] in keys):
+            # แบบ mdta ชื่ออยู่ใน keys ส่วนแบบ iTunes ชื่ออยู่ใน name box
+            atom_name = keys.get(struct.unpack('>I', box_type)[0]) if keys else None
+            value = None
+            for child_type, child_start, child_header, child_end in inspector._iter_boxes(f, payload, box_end):
+                f.seek(child_start + child_header)
+                body = f.read(child_end - child_start - child_header)
+                if child_type == b'name':
+                    atom_name = body[4:]
+                elif child_type == b'data':
+                    value = body[8:].decode('latin-1')
+            if atom_name == name:
+                return value
+    return None
+
+
+def _parse_itunsmpb(value, sample_rate):
+    """แปลงค่า iTunSMPB (hex: delay, padding, จำนวน sample จริง)"""
+    fields = value.split()
+    if len(fields) < 4:
+        return None
+    delay, padding, valid = int(fields[1], 16), int(fields[2], 16), int(fields[3], 16)
+    if not valid:
+        return None
+    return {'sample_rate': sample_rate, 'delay': delay, 'padding': padding, 'valid_samples': valid}
+
+
+def _syncsafe(data):
+    """แปลงเลขแบบ syncsafe ของ ID3"""
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
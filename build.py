@@ -18,7 +18,8 @@ def install_requirements():
     requirements = [
         "pyinstaller",
         "pillow",
-        "moviepy"
+        "moviepy",
+        "numpy"
     ]
     
     for package in requirements:
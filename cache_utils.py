@@ -0,0 +1,65 @@
+"""
+Cache helpers for Image Music Looper
+ตำแหน่งโฟลเดอร์ cache และ hash ของเนื้อหาไฟล์ที่ใช้เป็น key
+"""
+
+import os
+import hashlib
+import tempfile
+import threading
+
+# ตั้งค่าตัวแปรนี้เพื่อให้หลายเครื่อง/หลาย process ใช้ cache โฟลเดอร์เดียวกัน
+CACHE_DIR_ENV = "IML_CACHE_DIR"
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".image_music_looper", "cache")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# จำ hash ไว้ตาม (path, size, mtime) เพื่อไม่ต้องอ่านไฟล์ซ้ำใน process เดียวกัน
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+# umask ของ process (อ่านได้เฉพาะด้วยการตั้งค่าใหม่ จึงอ่านครั้งเดียวตอน import)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def get_cache_dir(name):
+    """ส่งคืนโฟลเดอร์ cache ย่อยตามชื่อ (สร้างให้ถ้ายังไม่มี)"""
+    base = os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+    path = os.path.join(base, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_content_hash(path):
+    """SHA-1 ของเนื้อหาไฟล์ (hex)"""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        cached = _hash_memo.get(memo_key)
+    if cached:
+        return cached
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+
+    with _hash_lock:
+        _hash_memo[memo_key] = content_hash
+    return content_hash
+
+
+def make_temp_path(path, suffix=".tmp"):
+    """สร้างไฟล์ชั่วคราวชื่อไม่ซ้ำในโฟลเดอร์เดียวกับ path สำหรับเขียนแล้ว os.replace ทับ path
+
+    ชื่อไม่ชนกันแม้หลาย thread/process เขียนไฟล์เดียวกันพร้อมกัน
+    """
+    fd, temp_path = tempfile.mkstemp(suffix=suffix, prefix=f"{os.path.basename(path)}.",
+                                     dir=os.path.dirname(path) or None)
+    os.close(fd)
+    # mkstemp ให้สิทธิ์เฉพาะเจ้าของ ใช้สิทธิ์ปกติแทน (cache ที่หลายเครื่องใช้ร่วมกัน)
+    os.chmod(temp_path, 0o666 & ~_UMASK)
+    return temp_path
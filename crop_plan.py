@@ -0,0 +1,167 @@
+"""
+Crop planning for Image Music Looper
+หาจุดสนใจของภาพ (ขอบและสีที่เด่นจากค่าเฉลี่ย) บนภาพย่อขนาดเล็กด้วย NumPy
+แล้ววางกรอบ crop ตามอัตราส่วนวิดีโอให้ครอบจุดนั้น แทนการตัดตรงกลางภาพเสมอ
+ผลลัพธ์และจุดที่ผู้ใช้เลือกเองในแท็บตัวอย่างเก็บไว้ใน cache ตามภาพและอัตราส่วน
+"""
+
+import os
+import json
+
+from cache_utils import get_cache_dir, file_content_hash, make_temp_path
+
+# เปลี่ยนค่านี้เมื่อวิธีหาจุดสนใจเปลี่ยน ผลเก่าจะถูกคำนวณใหม่
+CROP_PLAN_VERSION = 1
+
+# ขนาดด้านยาวของภาพที่ใช้วิเคราะห์ (พิกเซล)
+ANALYSIS_SIZE = 160
+
+# น้ำหนักที่ดึงกรอบเข้าหากลางภาพ (สัดส่วนของพลังงานรวม) ภาพเรียบๆ จะได้กรอบกลางภาพเหมือนเดิม
+CENTER_BIAS = 0.15
+
+
+class CropPlan:
+    """คลาสสำหรับกรอบ crop ของภาพหนึ่งภาพที่อัตราส่วนหนึ่ง"""
+
+    def __init__(self, image_size, target_size, focus, source="auto"):
+        self.image_size = tuple(image_size)
+        self.target_size = tuple(target_size)
+        # จุดกึ่งกลางของกรอบ (x, y) เป็นสัดส่วน 0..1 ของภาพ
+        self.focus = tuple(focus)
+        self.source = source    # "auto", "manual" หรือ "center"
+
+    @property
+    def box(self):
+        """กรอบ crop (left, top, right, bottom) ขนาดใหญ่ที่สุดตามอัตราส่วน ในพิกเซลของภาพต้นฉบับ"""
+        image_width, image_height = self.image_size
+        target_width, target_height = self.target_size
+        target_ratio = target_width / target_height
+
+        if image_width / image_height > target_ratio:
+            width, height = min(int(image_height * target_ratio), image_width), image_height
+        else:
+            width, height = image_width, min(int(image_width / target_ratio), image_height)
+
+        left = min(max(int(round(self.focus[0] * image_width - width / 2)), 0), image_width - width)
+        top = min(max(int(round(self.focus[1] * image_height - height / 2)), 0), image_height - height)
+        return left, top, left + width, top + height
+
+    def scaled_box(self, size):
+        """กรอบ crop สำหรับภาพเดียวกันที่ถูกย่อเป็นขนาด size"""
+        scale_x = size[0] / self.image_size[0]
+        scale_y = size[1] / self.image_size[1]
+        left, top, right, bottom = self.box
+        return (int(round(left * scale_x)), int(round(top * scale_y)),
+                int(round(right * scale_x)), int(round(bottom * scale_y)))
+
+    @classmethod
+    def for_image(cls, image_path, target_size):
+        """กรอบ crop จาก cache (จุดที่ผู้ใช้เลือกเองมาก่อน) ไม่เช่นนั้นคำนวณและบันทึกไว้"""
+        path = _plan_path(image_path, target_size)
+        data = _read_plan(path)
+        if data:
+            if data.get('manual_focus'):
+                return cls(data['image_size'], target_size, data['manual_focus'], "manual")
+            if data.get('version') == CROP_PLAN_VERSION and data.get('auto_focus'):
+                return cls(data['image_size'], target_size, data['auto_focus'], "auto")
+
+        plan = cls.compute(image_path, target_size)
+        _write_plan(path, dict(data or {}, version=CROP_PLAN_VERSION,
+                               image_size=list(plan.image_size), auto_focus=list(plan.focus)))
+        return plan
+
+    @classmethod
+    def compute(cls, image_path, target_size):
+        """หาจุดสนใจบนภาพย่อ แล้วเลือกตำแหน่งกรอบที่ครอบพลังงานของภาพได้มากที่สุด"""
+        from PIL import Image
+
+        with Image.open(image_path) as img:
+            image_size = img.size
+            # JPEG: ให้ decoder ย่อภาพตั้งแต่ตอนอ่าน (เร็วมากแม้ภาพใหญ่)
+            img.draft('RGB', (ANALYSIS_SIZE, ANALYSIS_SIZE))
+            small = img.convert('RGB')
+        small.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.Resampling.BILINEAR)
+
+        try:
+            focus = _find_focus(small, image_size, target_size)
+        except ImportError:
+            return cls(image_size, target_size, (0.5, 0.5), "center")
+        return cls(image_size, target_size, focus, "auto")
+
+    @classmethod
+    def set_manual_focus(cls, image_path, target_size, focus):
+        """บันทึกจุดกึ่งกลางกรอบที่ผู้ใช้เลือกเอง (x, y เป็นสัดส่วน 0..1)"""
+        plan = cls.for_image(image_path, target_size)
+        path = _plan_path(image_path, target_size)
+        focus = [min(max(float(value), 0.0), 1.0) for value in focus]
+        _write_plan(path, dict(_read_plan(path) or {}, image_size=list(plan.image_size), manual_focus=focus))
+        return cls(plan.image_size, target_size, focus, "manual")
+
+    @classmethod
+    def clear_manual_focus(cls, image_path, target_size):
+        """ลบจุดที่ผู้ใช้เลือกเอง กลับไปใช้จุดสนใจที่คำนวณได้"""
+        path = _plan_path(image_path, target_size)
+        data = _read_plan(path)
+        if data and data.pop('manual_focus', None):
+            _write_plan(path, data)
+        return cls.for_image(image_path, target_size)
+
+
+def _find_focus(small, image_size, target_size):
+    """ตำแหน่งกึ่งกลางกรอบ (สัดส่วน 0..1) ที่ให้ผลรวมพลังงานขอบ+ความเด่นของสีสูงสุด"""
+    import numpy as np
+
+    rgb = np.asarray(small, dtype=np.float32) / 255.0
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    # พลังงานขอบ: ขนาด gradient
+    edges = np.zeros_like(gray)
+    edges[:, 1:] += np.abs(np.diff(gray, axis=1))
+    edges[1:, :] += np.abs(np.diff(gray, axis=0))
+
+    # ความเด่น: สีที่ต่างจากสีเฉลี่ยของภาพ (ใบหน้า/ตัวอักษรบนพื้นหลังเรียบ)
+    saliency = np.abs(rgb - rgb.reshape(-1, 3).mean(axis=0)).sum(axis=2)
+
+    energy = edges / (edges.mean() + 1e-6) + saliency / (saliency.mean() + 1e-6)
+
+    height, width = gray.shape
+    target_ratio = target_size[0] / target_size[1]
+    if image_size[0] / image_size[1] > target_ratio:
+        # ภาพกว้างกว่ากรอบ เลื่อนกรอบตามแนวนอน
+        profile, window = energy.sum(axis=0), min(max(int(round(height * target_ratio)), 1), width)
+    else:
+        profile, window = energy.sum(axis=1), min(max(int(round(width / target_ratio)), 1), height)
+
+    positions = len(profile) - window + 1
+    if positions <= 1:
+        return 0.5, 0.5
+
+    cumulative = np.concatenate(([0.0], np.cumsum(profile, dtype=np.float64)))
+    scores = cumulative[window:] - cumulative[:positions]
+    center = (positions - 1) / 2
+    scores -= CENTER_BIAS * cumulative[-1] * np.abs(np.arange(positions) - center) / center
+    best = (int(np.argmax(scores)) + window / 2) / len(profile)
+
+    if image_size[0] / image_size[1] > target_ratio:
+        return best, 0.5
+    return 0.5, best
+
+
+def _plan_path(image_path, target_size):
+    name = f"{file_content_hash(image_path)}_{target_size[0]}x{target_size[1]}.json"
+    return os.path.join(get_cache_dir("crops"), name)
+
+
+def _read_plan(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_plan(path, data):
+    temp_path = make_temp_path(path)
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
@@ -0,0 +1,181 @@
+"""
+Endless HLS output for Image Music Looper
+นำ segment ของเพลงหนึ่งรอบที่ encode ไว้แล้วมาวนเผยแพร่เป็น HLS แบบ live
+โดยเก็บไว้เพียง N segment ล่าสุด ใช้ดิสก์และ CPU คงที่ไม่ว่าจะสตรีมนานเท่าไร
+
+ทดสอบได้ด้วย HTTP server ในเครื่อง:
+    python -m http.server --directory <output_dir> 8000
+แล้วเปิด http://localhost:8000/live.m3u8 ด้วย VLC หรือ ffplay
+"""
+
+import os
+import math
+import time
+import shutil
+from collections import deque
+
+LIVE_PLAYLIST_NAME = "live.m3u8"
+SOURCE_PLAYLIST_NAME = "loop.m3u8"
+LIVE_SEGMENT_PREFIX = "live_"
+
+# จำนวน segment ใน playlist
+DEFAULT_WINDOW_SIZE = 6
+
+# ความละเอียดในการรอระหว่าง segment (วินาที) เพื่อให้หยุดได้เร็ว
+STOP_POLL_SECONDS = 0.25
+
+
+def read_vod_playlist(playlist_path):
+    """อ่านรายการ (ชื่อไฟล์, ความยาว) จาก playlist แบบ VOD ที่ FFmpeg สร้าง"""
+    segments = []
+    duration = None
+    with open(playlist_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line and not line.startswith('#') and duration is not None:
+                segments.append((line, duration))
+                duration = None
+    return segments
+
+
+class RollingHlsPublisher:
+    """คลาสสำหรับเผยแพร่ segment ของลูปเป็น HLS live แบบ rolling window"""
+
+    def __init__(self, source_dir, output_dir, window_size=DEFAULT_WINDOW_SIZE,
+                 should_stop=None, clock=time.monotonic, sleep=time.sleep):
+        self.source_dir = source_dir
+        self.output_dir = output_dir
+        self.window_size = max(int(window_size), 1)
+        self.should_stop = should_stop or (lambda: False)
+        self.clock = clock
+        self.sleep = sleep
+
+        self.segments = read_vod_playlist(os.path.join(source_dir, SOURCE_PLAYLIST_NAME))
+        if not self.segments:
+            raise ValueError(f"No HLS segments found in {source_dir}")
+        self.target_duration = math.ceil(max(duration for _, duration in self.segments))
+
+        self.window = deque()    # (ชื่อไฟล์, ความยาว, มี discontinuity ก่อนหน้าหรือไม่)
+        self.retired = deque()   # segment ที่ออกจาก playlist แล้วแต่ยังเก็บไว้ให้ client ที่โหลดอยู่
+        self.media_sequence = 0
+        self.discontinuity_sequence = 0
+        self.published = 0
+
+    @property
+    def playlist_path(self):
+        return os.path.join(self.output_dir, LIVE_PLAYLIST_NAME)
+
+    def run(self, max_segments=None):
+        """เผยแพร่ segment ไปเรื่อยๆ จนกว่าจะถูกสั่งหยุด (หรือครบ max_segments)"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        if not self.published:
+            self._remove_stale_files()
+        start_time = self.clock()
+        media_time = 0.0
+        prefill_time = None
+
+        while not self.should_stop():
+            for index, (name, duration) in enumerate(self.segments):
+                if self.should_stop() or (max_segments is not None and self.published >= max_segments):
+                    return self.published
+
+                # เติม window แรกทันที หลังจากนั้นปล่อย segment ตามเวลาจริง
+                if self.published >= self.window_size:
+                    if prefill_time is None:
+                        prefill_time = media_time
+                    if not self._wait_until(start_time + media_time - prefill_time):
+                        return self.published
+
+                self._publish(name, duration, discontinuity=index == 0 and self.published > 0)
+                media_time += duration
+
+            if max_segments is not None and self.published >= max_segments:
+                break
+        return self.published
+
+    def cleanup(self):
+        """ลบ segment และ playlist ที่เผยแพร่ไปแล้วทั้งหมด"""
+        for name, _duration, _discontinuity in self.window:
+            self._remove(name)
+        for name in self.retired:
+            self._remove(name)
+        self._remove(LIVE_PLAYLIST_NAME)
+        self.window.clear()
+        self.retired.clear()
+
+    def _publish(self, source_name, duration, discontinuity):
+        """เพิ่ม segment ใหม่เข้า playlist และลบ segment เก่าที่หมดอายุ"""
+        name = f"{LIVE_SEGMENT_PREFIX}{self.published:09d}.ts"
+        self._link_segment(os.path.join(self.source_dir, source_name), os.path.join(self.output_dir, name))
+        self.window.append((name, duration, discontinuity))
+        self.published += 1
+
+        while len(self.window) > self.window_size:
+            old_name, _old_duration, old_discontinuity = self.window.popleft()
+            self.media_sequence += 1
+            if old_discontinuity:
+                self.discontinuity_sequence += 1
+            self.retired.append(old_name)
+
+        while len(self.retired) > self.window_size:
+            self._remove(self.retired.popleft())
+
+        self._write_playlist()
+
+    def _write_playlist(self):
+        """เขียน playlist ใหม่แบบ atomic เพื่อไม่ให้ client อ่านได้ไฟล์ครึ่งๆ"""
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            f"#EXT-X-MEDIA-SEQUENCE:{self.media_sequence}",
+            f"#EXT-X-DISCONTINUITY-SEQUENCE:{self.discontinuity_sequence}",
+        ]
+        for name, duration, discontinuity in self.window:
+            # timestamp เริ่มใหม่ทุกครั้งที่วนกลับไป segment แรกของลูป
+            if discontinuity:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f"#EXTINF:{duration:.6f},")
+            lines.append(name)
+
+        temp_path = self.playlist_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, self.playlist_path)
+
+    def _link_segment(self, source, target):
+        """สร้าง segment ด้วย hard link (ไม่ใช้พื้นที่เพิ่ม) หรือคัดลอกถ้าทำไม่ได้"""
+        temp_target = target + ".tmp"
+        try:
+            os.link(source, temp_target)
+        except OSError:
+            shutil.copyfile(source, temp_target)
+        os.replace(temp_target, target)
+
+    def _remove_stale_files(self):
+        """ลบ segment และ playlist ที่ค้างจากการสตรีมครั้งก่อน (เช่นโปรแกรมปิดไปกลางคัน)
+
+        ลำดับ segment เริ่มที่ 0 ใหม่ ถ้าไม่ลบ client จะได้ไฟล์เก่าที่ชื่อซ้ำกับ segment ใหม่
+        """
+        for name in os.listdir(self.output_dir):
+            if name.startswith(LIVE_PLAYLIST_NAME) or \
+                    (name.startswith(LIVE_SEGMENT_PREFIX) and name.endswith(('.ts', '.ts.tmp'))):
+                self._remove(name)
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.output_dir, name))
+        except OSError:
+            pass
+
+    def _wait_until(self, deadline):
+        """รอจนถึงเวลาที่กำหนด ส่งคืน False ถ้าถูกสั่งหยุดระหว่างรอ"""
+        while True:
+            if self.should_stop():
+                return False
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                return True
+            self.sleep(min(remaining, STOP_POLL_SECONDS))
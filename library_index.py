@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Track library index for Image Music Looper
+เก็บผลวิเคราะห์เพลง (ความยาว, codec, จุดลูป, ความดัง) ไว้ใน SQLite
+เพื่อให้เพลงที่ใช้ซ้ำไม่ต้องวิเคราะห์ใหม่ทุกครั้ง สแกนทั้งโฟลเดอร์ได้ด้วย process pool
+
+ตัวอย่าง:
+    python library_index.py D:\\Music
+"""
+
+import os
+import re
+import sys
+import time
+import sqlite3
+import subprocess
+from contextlib import contextmanager
+
+from cache_utils import get_cache_dir, file_content_hash
+
+INDEX_FILE_NAME = "tracks.sqlite"
+
+# เปลี่ยนค่านี้เมื่อวิธีวิเคราะห์เปลี่ยน ผลเก่าจะถูกวิเคราะห์ใหม่
+ANALYSIS_VERSION = 1
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.aac', '.flac', '.ogg')
+
+# เวลารอเมื่อฐานข้อมูลถูก process อื่นล็อกอยู่ (วินาที)
+DATABASE_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    analysis_version INTEGER NOT NULL,
+    codec TEXT,
+    duration REAL,
+    sample_rate INTEGER,
+    channels INTEGER,
+    loop_start REAL,
+    loop_end REAL,
+    loop_source TEXT,
+    loudness_db REAL,
+    analyzed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tracks_content_hash ON tracks (content_hash);
+"""
+
+ANALYSIS_FIELDS = ('codec', 'duration', 'sample_rate', 'channels',
+                   'loop_start', 'loop_end', 'loop_source', 'loudness_db')
+
+
+def analyze_track(audio_path):
+    """วิเคราะห์เพลงหนึ่งไฟล์ ส่งคืน dict ตาม ANALYSIS_FIELDS (ทำงานใน process แยกได้)"""
+    import numpy as np
+    from audio_trim import AudioTrimmer
+    from pcm_cache import PcmAudio, stream_range
+
+    # หาจุดลูปก่อน: ไฟล์ที่มีข้อมูล gapless อ่านจาก header และ decode เฉพาะหัว/ท้ายเพลง
+    bounds = AudioTrimmer().find_loop_bounds(audio_path)
+    start = bounds['start'] if bounds else 0.0
+    end = bounds['end'] if bounds else None
+
+    # ความดังเฉลี่ย (RMS dBFS) ของช่วงที่ใช้ลูป จาก PCM ใน cache ถ้ามี
+    # ไม่เช่นนั้น decode เฉพาะช่วงนั้นทีละส่วน (ไม่เขียน PCM ทั้งเพลงลง cache)
+    pcm = PcmAudio.load_cached(audio_path)
+    if pcm is not None:
+        sample_rate, channels = pcm.sample_rate, pcm.channels
+        first = pcm.frame_at(start)
+        last = pcm.frame_count if end is None else pcm.frame_at(end)
+        step = sample_rate * 60
+        chunks = (pcm.samples[index:min(index + step, last)] for index in range(first, last, step))
+    else:
+        sample_rate, channels, chunks = stream_range(audio_path, start, None if end is None else end - start)
+
+    frames = 0
+    mean_square = 0.0
+    for chunk in chunks:
+        frames += len(chunk)
+        mean_square += float(np.square(chunk, dtype=np.float64).sum())
+    mean_square /= max(frames * channels, 1)
+
+    return {
+        'codec': probe_codec(audio_path),
+        'duration': bounds['duration'] if bounds else frames / sample_rate,
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'loop_start': bounds['start'] if bounds else None,
+        'loop_end': bounds['end'] if bounds else None,
+        'loop_source': bounds['source'] if bounds else None,
+        'loudness_db': 10 * np.log10(mean_square) if mean_square > 0 else None,
+    }
+
+
+def probe_codec(audio_path):
+    """อ่านชื่อ codec ของเสียงจาก log ของ FFmpeg"""
+    result = subprocess.run(['ffmpeg', '-hide_banner', '-nostdin', '-i', audio_path],
+                            capture_output=True, text=True)
+    match = re.search(r'Audio: (\w+)', result.stderr)
+    return match.group(1) if match else None
+
+
+class LibraryIndex:
+    """คลาสสำหรับอ่าน/เขียนผลวิเคราะห์เพลงใน SQLite"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(get_cache_dir("library"), INDEX_FILE_NAME)
+        with self._transaction() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # เปิด connection ใหม่ทุกครั้ง ใช้จาก thread ไหนก็ได้
+        conn = sqlite3.connect(self.db_path, timeout=DATABASE_TIMEOUT)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """connection ที่ commit เมื่อสำเร็จ (rollback เมื่อผิดพลาด) และปิดเสมอ
+
+        with ของ sqlite3.Connection จัดการแค่ transaction ไม่ได้ปิด connection
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, audio_path):
+        """ผลวิเคราะห์ของไฟล์ (dict) หรือ None ถ้ายังไม่มีหรือไฟล์เปลี่ยนไป
+
+        ถ้า path ไม่ตรงแต่เนื้อหาตรงกับไฟล์อื่นที่วิเคราะห์แล้ว (ย้าย/คัดลอกไฟล์) จะใช้ผลนั้น
+        """
+        path = os.path.abspath(audio_path)
+        stat = os.stat(path)
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM tracks WHERE path = ? AND analysis_version = ?",
+                               (path, ANALYSIS_VERSION)).fetchone()
+            if row and row['size'] == stat.st_size and row['mtime_ns'] == stat.st_mtime_ns:
+                return dict(row)
+
+            row = conn.execute("SELECT * FROM tracks WHERE content_hash = ? AND analysis_version = ?",
+                               (file_content_hash(path), ANALYSIS_VERSION)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+    def analyze(self, audio_path):
+        """ผลวิเคราะห์จาก index ถ้ามี ไม่เช่นนั้นวิเคราะห์แล้วบันทึกไว้"""
+        analysis = self.lookup(audio_path)
+        if analysis is None or analysis['path'] != os.path.abspath(audio_path):
+            analysis = analysis or analyze_track(audio_path)
+            self.record(audio_path, file_content_hash(audio_path), analysis)
+        return analysis
+
+    def loop_bounds(self, audio_path):
+        """จุดลูปในรูปแบบเดียวกับ AudioTrimmer.find_loop_bounds (ใช้ผลใน index ถ้ามี)"""
+        try:
+            try:
+                analysis = self.analyze(audio_path)
+            except sqlite3.Error as e:
+                # index เสียหรือถูกล็อกนานเกินไป วิเคราะห์ตรงๆ แทน
+                print(f"Track library index unavailable: {e}")
+                analysis = analyze_track(audio_path)
+        except (ImportError, OSError, RuntimeError, ValueError) as e:
+            # ไม่มี NumPy/FFmpeg: ใช้ AudioTrimmer ซึ่งอ่านได้เฉพาะ metadata หรือส่งคืน None (ไม่ตัด)
+            print(f"Track analysis unavailable: {e}")
+            from audio_trim import AudioTrimmer
+            return AudioTrimmer().find_loop_bounds(audio_path)
+
+        if analysis['loop_start'] is None or analysis['loop_end'] is None:
+            return None
+        return {'start': analysis['loop_start'], 'end': analysis['loop_end'],
+                'duration': analysis['duration'], 'source': analysis['loop_source']}
+
+    def record(self, audio_path, content_hash, analysis):
+        """บันทึกผลวิเคราะห์ของไฟล์"""
+        path = os.path.abspath(audio_path)
+        stat = os.stat(path)
+        values = [analysis.get(field) for field in ANALYSIS_FIELDS]
+        with self._transaction() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO tracks (path, size, mtime_ns, content_hash, analysis_version, "
+                f"{', '.join(ANALYSIS_FIELDS)}, analyzed_at) "
+                f"VALUES (?, ?, ?, ?, ?, {', '.join('?' * len(ANALYSIS_FIELDS))}, ?)",
+                [path, stat.st_size, stat.st_mtime_ns, content_hash, ANALYSIS_VERSION] + values + [time.time()])
+
+    def scan(self, folder, workers=None, progress_callback=None):
+        """สแกนเพลงทั้งโฟลเดอร์ วิเคราะห์เฉพาะไฟล์ใหม่หรือที่เปลี่ยนไป
+
+        ส่งคืน dict จำนวนไฟล์: analyzed, reused (เนื้อหาซ้ำกับไฟล์อื่น), unchanged, removed, failed
+        """
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        folder = os.path.abspath(folder)
+        with self._transaction() as conn:
+            known = {row['path']: (row['size'], row['mtime_ns'])
+                     for row in conn.execute("SELECT path, size, mtime_ns FROM tracks WHERE analysis_version = ?",
+                                             (ANALYSIS_VERSION,))}
+            known_hashes = {row['content_hash'] for row in
+                            conn.execute("SELECT content_hash FROM tracks WHERE analysis_version = ?",
+                                         (ANALYSIS_VERSION,))}
+
+        counts = {'analyzed': 0, 'reused': 0, 'unchanged': 0, 'removed': 0, 'failed': 0}
+        pending = []
+        present = set()
+        for current_dir, _dirs, files in os.walk(folder):
+            for name in sorted(files):
+                if not name.lower().endswith(AUDIO_EXTENSIONS):
+                    continue
+                path = os.path.join(current_dir, name)
+                present.add(path)
+                stat = os.stat(path)
+                # ขนาดและเวลาแก้ไขไม่เปลี่ยน ถือว่าเป็นไฟล์เดิม ไม่ต้องอ่านเนื้อหา
+                if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                    counts['unchanged'] += 1
+                else:
+                    pending.append(path)
+
+        done = 0
+
+        def finish(path, kind, content_hash=None, analysis=None, error=None):
+            nonlocal done
+            if kind != 'failed':
+                try:
+                    self.record(path, content_hash, analysis)
+                except OSError as e:
+                    kind, error = 'failed', e
+            if kind == 'failed':
+                print(f"Could not analyze track {path}: {error}")
+            counts[kind] += 1
+            done += 1
+            if progress_callback:
+                progress_callback(done, len(pending), path)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # hash ใน worker (อ่านไฟล์ขนานกัน) แล้วจัดกลุ่มไฟล์ที่เนื้อหาเหมือนกันใน process หลัก
+            hash_futures = {executor.submit(file_content_hash, path): path for path in pending}
+            groups = {}
+            for future in as_completed(hash_futures):
+                path = hash_futures[future]
+                try:
+                    groups.setdefault(future.result(), []).append(path)
+                except Exception as e:
+                    finish(path, 'failed', error=e)
+
+            # เนื้อหาที่เคยวิเคราะห์แล้ว (ไฟล์ย้าย/คัดลอก) ใช้ผลเดิม
+            new_groups = {}
+            for content_hash, paths in groups.items():
+                analysis = self._analysis_by_hash(content_hash) if content_hash in known_hashes else None
+                if analysis is None:
+                    new_groups[content_hash] = sorted(paths)
+                    continue
+                for path in paths:
+                    finish(path, 'reused', content_hash, analysis)
+
+            # เนื้อหาใหม่วิเคราะห์ครั้งเดียวต่อ hash แม้มีหลายไฟล์ในการสแกนเดียวกัน
+            analysis_futures = {executor.submit(analyze_track, paths[0]): content_hash
+                                for content_hash, paths in new_groups.items()}
+            for future in as_completed(analysis_futures):
+                content_hash = analysis_futures[future]
+                first, *copies = new_groups[content_hash]
+                try:
+                    analysis = future.result()
+                except Exception as e:
+                    for path in new_groups[content_hash]:
+                        finish(path, 'failed', error=e)
+                    continue
+                finish(first, 'analyzed', content_hash, analysis)
+                for path in copies:
+                    finish(path, 'reused', content_hash, analysis)
+
+        # ลบไฟล์ที่ไม่อยู่ในโฟลเดอร์แล้ว
+        prefix = folder.rstrip(os.sep) + os.sep
+        removed = [path for path in known if path.startswith(prefix) and path not in present]
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM tracks WHERE path = ?", [(path,) for path in removed])
+        counts['removed'] = len(removed)
+        return counts
+
+    def _analysis_by_hash(self, content_hash):
+        """ผลวิเคราะห์ของเนื้อหาที่ hash ตรงกัน หรือ None ถ้าไม่มี (เช่นถูกลบไประหว่างสแกน)"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM tracks WHERE content_hash = ? AND analysis_version = ?",
+                               (content_hash, ANALYSIS_VERSION)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+
+def main():
+    """สแกนโฟลเดอร์เพลงจาก command line"""
+    if len(sys.argv) < 2 or not os.path.isdir(sys.argv[1]):
+        print("Usage: python library_index.py <music folder>")
+        return 1
+
+    def report(done, total, path):
+        print(f"[{done}/{total}] {path}")
+
+    counts = LibraryIndex().scan(sys.argv[1], progress_callback=report)
+    print(", ".join(f"{name} {count}" for name, count in counts.items()))
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1097 @@
+"""
+Render engine for Image Music Looper
+สร้างวิดีโอ/สตรีมจากภาพและเพลงโดยไม่ขึ้นกับ UI (ไม่ import tkinter)
+ใช้ได้ทั้งจากหน้าต่างโปรแกรม, render_cli, render_farm หรือ process อื่นบน server ที่ไม่มีจอ
+import ที่หนัก (PIL, NumPy, MoviePy) ทำเมื่อใช้งานจริงเท่านั้น
+
+รับเหตุการณ์ของงานได้สองแบบ:
+    progress_callback(percent, message="")  ความคืบหน้า 0-100 และข้อความสถานะ
+    events=RenderEvents()                   object ที่มีเมธอด progress() และ trace()
+ทุก callback ถูกเรียกจาก thread ที่ทำงาน ผู้เรียกต้องส่งต่อไป thread ของ UI เอง
+"""
+
+import os
+import math
+import shutil
+import tempfile
+import threading
+import subprocess
+import importlib.util
+
+from mp4_inspector import Mp4Inspector
+from pcm_cache import PcmAudio
+from library_index import LibraryIndex
+from crop_plan import CropPlan
+from render_outputs import (metadata_comment, find_identical_output, choose_output_path, publish_output,
+                            link_output)
+from admission import (AdmissionCancelled, PeakRssMonitor, FALLBACK_AUDIO_SECONDS, estimate_footprint,
+                       record_peak_rss, shared_scheduler)
+from render_extend import (EXTENDABLE_FORMATS, AAC_FRAME_SAMPLES, AAC_PRIMING_SAMPLES, SPLICE_START_FRAME,
+                           render_settings_key, render_fingerprint, find_render_manifests, save_render_manifest,
+                           choose_splice_units, splice_plan, read_adts_frames, write_spliced_adts,
+                           aac_frames_for, MAX_SPLICE_SLIP_SECONDS, ADTS_SAMPLE_RATES)
+from visualizer import VISUALIZER_STYLES, VISUALIZER_FPS, compute_levels, render_period_video
+from hls_stream import RollingHlsPublisher, SOURCE_PLAYLIST_NAME, LIVE_PLAYLIST_NAME, DEFAULT_WINDOW_SIZE
+from cache_utils import get_cache_dir, file_content_hash
+
+DEFAULT_DURATION_HOURS = 4.0
+DEFAULT_ASPECT_RATIO = "16:9"
+
+# ระยะเวลารอให้ FFmpeg ปิดตัวเองก่อนบังคับ kill (วินาที)
+PROCESS_TERMINATE_TIMEOUT = 0.5
+
+# Video quality settings
+VIDEO_QUALITY = {
+    "16:9": (1280, 720),
+    "4:3": (960, 720),
+    "1:1": (720, 720),
+    "21:9": (1680, 720)
+}
+
+# MP4 ปกติ: ย้าย moov ไปไว้ต้นไฟล์หลังเขียนเสร็จ เล่นบนเว็บได้ก่อนโหลดครบ
+FASTSTART_ARGS = ['-movflags', '+faststart']
+
+# รูปแบบไฟล์ผลลัพธ์: (นามสกุลไฟล์, ตัวเลือก muxer ของ FFmpeg)
+# fmp4/mpegts เขียนเป็นช่วงๆ ระหว่าง encode จึงอัปโหลดหรือส่งผ่าน pipe ได้ก่อนสร้างเสร็จ
+OUTPUT_FORMATS = {
+    "mp4": (".mp4", FASTSTART_ARGS + ['-f', 'mp4']),
+    "fmp4": (".mp4", ['-movflags', '+frag_keyframe+empty_moov+default_base_moof+delay_moov', '-f', 'mp4']),
+    "mpegts": (".ts", ['-f', 'mpegts']),
+}
+
+# ระยะห่าง keyframe (วินาที) = ความยาวของแต่ละ fragment ในโหมด streaming
+STREAMING_FRAGMENT_SECONDS = 10
+
+# ภาพนิ่งไม่ได้ประโยชน์จาก B-frame และการไม่มี B-frame ทำให้ตัดต่อแบบ stream copy ได้ตรง frame
+STILL_VIDEO_ARGS = ('-bf', '0')
+
+# sample rate ที่ AAC รองรับ และจำนวนช่องเสียงที่ encoder จัด layout ให้ได้โดยตรง
+# เสียงต้นฉบับที่อยู่ในช่วงนี้จะใช้ตามเดิมตลอดทาง ไม่ resample หรือ remix
+AAC_SAMPLE_RATES = ADTS_SAMPLE_RATES
+AAC_CHANNEL_COUNTS = (1, 2, 3, 4, 5, 6, 8)
+
+# MoviePy อ่านเสียงเป็น 2 ช่องเสมอ เสียงที่มีจำนวนช่องอื่นจึงต้องใช้ FFmpeg
+MOVIEPY_CHANNELS = 2
+
+# ความยาวของแต่ละ segment ในโหมดสตรีม HLS ไม่สิ้นสุด (วินาที)
+HLS_SEGMENT_SECONDS = 6
+
+
+class RenderEvents:
+    """interface สำหรับรับเหตุการณ์ของงาน (override เฉพาะเมธอดที่ต้องการ)"""
+    
+    def progress(self, percent, message=""):
+        """ความคืบหน้า 0-100 และข้อความสถานะ"""
+    
+    def trace(self, stage, detail):
+        """การตัดสินใจของงาน เช่น backend และรูปแบบเสียงที่เลือก"""
+
+
+class RenderCancelled(Exception):
+    """ผู้ใช้ยกเลิกการสร้างวิดีโอ"""
+
+
+class VideoProcessor:
+    """คลาสสำหรับประมวลผลวิดีโอ"""
+    
+    def __init__(self, progress_callback=None, output_format="mp4", visualizer=None, trace_callback=None):
+        self.progress_callback = progress_callback
+        self.trace_callback = trace_callback
+        self.output_format = output_format if output_format in OUTPUT_FORMATS else "mp4"
+        self.visualizer = visualizer if visualizer in VISUALIZER_STYLES else None
+        self._cancel_event = threading.Event()
+        self._process = None
+        self._process_lock = threading.Lock()
+        self._audio_formats = {}
+        # True = หน่วยความจำไม่พอสำหรับ MoviePy ใช้ FFmpeg แทน (ตั้งโดย admission control)
+        self.low_memory = False
+        # backend ที่ใช้จริงในงานล่าสุด ("moviepy", "ffmpeg" หรือ "visualizer")
+        self.backend = None
+        # metadata ที่เขียนลงไฟล์ผลลัพธ์ เช่น {'comment': fingerprint ของงาน}
+        self.metadata = {}
+        # ลำดับการตัดสินใจของงาน (ขั้นตอน, รายละเอียด) เช่น backend และรูปแบบเสียงที่เลือก
+        self.trace = []
+    
+    def cancel(self):
+        """ยกเลิกงานที่กำลังทำ และหยุด FFmpeg ที่กำลังทำงานอยู่"""
+        self._cancel_event.set()
+        with self._process_lock:
+            process = self._process
+        if process and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=PROCESS_TERMINATE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    
+    def is_cancelled(self):
+        """ตรวจสอบว่าถูกยกเลิกแล้วหรือไม่"""
+        return self._cancel_event.is_set()
+    
+    def check_cancelled(self):
+        """โยน RenderCancelled ถ้างานถูกยกเลิกแล้ว"""
+        if self._cancel_event.is_set():
+            raise RenderCancelled()
+    
+    def _run_ffmpeg(self, cmd, stdout=subprocess.PIPE):
+        """รัน FFmpeg แบบยกเลิกได้ ส่งคืน (returncode, stderr)
+        
+        stdout=None ให้ FFmpeg เขียนลง stdout ของโปรแกรมโดยตรง (ใช้กับ output "-")
+        """
+        self.check_cancelled()
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=stdout,
+                                   stderr=subprocess.PIPE, text=True)
+        with self._process_lock:
+            self._process = process
+        try:
+            while True:
+                try:
+                    _, stderr = process.communicate(timeout=0.1)
+                    break
+                except subprocess.TimeoutExpired:
+                    if self._cancel_event.is_set():
+                        self.cancel()
+        finally:
+            with self._process_lock:
+                self._process = None
+        
+        self.check_cancelled()
+        return process.returncode, stderr
+    
+    def add_trace(self, stage, detail):
+        """บันทึกการตัดสินใจของงานลงใน trace"""
+        self.trace.append((stage, detail))
+        if self.trace_callback:
+            self.trace_callback(stage, detail)
+    
+    def create_video(self, image_path, audio_path, output_path, duration_seconds, aspect_ratio, loop_bounds=None):
+        """สร้างวิดีโอด้วยวิธีที่เหมาะสม
+        
+        loop_bounds: dict ที่มี start/end (วินาที) ของช่วงเสียงที่จะใช้ลูป (จาก AudioTrimmer หรือ LibraryIndex)
+        """
+        try:
+            success = self._create_video_with_available_backend(image_path, audio_path, output_path, duration_seconds, aspect_ratio, loop_bounds)
+        except RenderCancelled:
+            self._remove_partial_output(output_path)
+            raise
+        
+        # ตรวจสอบไฟล์ที่ได้ (ข้ามกรณีที่สร้างเป็นไฟล์คำแนะนำ, MPEG-TS หรือส่งออกทาง pipe)
+        if success and self.output_format != "mpegts" and os.path.isfile(output_path):
+            success = self._verify_output(output_path, duration_seconds)
+        return success
+    
+    def choose_backend(self, audio_path, output_path):
+        """backend ที่จะใช้สร้างวิดีโอ ("moviepy" หรือ "ffmpeg") และเหตุผลที่ไม่ใช้ MoviePy"""
+        # MoviePy เขียนได้เฉพาะ MP4 ปกติ รูปแบบ streaming และ visualizer ต้องใช้ FFmpeg
+        if self.output_format != "mp4" or output_path == "-" or self.visualizer:
+            return "ffmpeg", "streaming output or visualizer"
+        # MoviePy จะ remix/resample ทุกรอบของลูป FFmpeg แปลงครั้งเดียวที่ลูป
+        source_format, audio_format = self._audio_format_pair(audio_path)
+        if audio_format and (audio_format[1] != MOVIEPY_CHANNELS or audio_format != source_format):
+            return "ffmpeg", "audio format needs a one-time conversion or is not stereo"
+        # MoviePy เก็บภาพทั้งภาพเป็น array ใน process นี้ FFmpeg ส่งภาพที่ย่อแล้วไปทีละ frame
+        if self.low_memory:
+            return "ffmpeg", "memory is tight for MoviePy"
+        if importlib.util.find_spec("moviepy") is None:
+            return "ffmpeg", "MoviePy not installed"
+        return "moviepy", None
+    
+    def _create_video_with_available_backend(self, image_path, audio_path, output_path, duration_seconds, aspect_ratio, loop_bounds):
+        """ลอง MoviePy ก่อน ถ้าไม่ได้ใช้ FFmpeg"""
+        backend, reason = self.choose_backend(audio_path, output_path)
+        if backend == "ffmpeg":
+            self.add_trace("backend", f"ffmpeg ({reason})")
+            return self._create_video_with_ffmpeg(image_path, audio_path, output_path, duration_seconds, aspect_ratio, loop_bounds)
+        try:
+            success = self._create_video_with_moviepy(image_path, audio_path, output_path, duration_seconds, aspect_ratio, loop_bounds)
+            self.backend = "moviepy"
+            self.add_trace("backend", "moviepy")
+            return success
+        except ImportError:
+            self.add_trace("backend", "ffmpeg (MoviePy not installed)")
+            return self._create_video_with_ffmpeg(image_path, audio_path, output_path, duration_seconds, aspect_ratio, loop_bounds)
+        except RenderCancelled:
+            raise
+        except Exception as e:
+            print(f"Error with MoviePy, trying FFmpeg: {e}")
+            self.add_trace("backend", f"ffmpeg (MoviePy failed: {e})")
+            return self._create_video_with_ffmpeg(image_path, audio_path, output_path, duration_seconds, aspect_ratio, loop_bounds)
+    
+    def extend_video(self, source_path, output_path, duration_seconds, manifest):
+        """สร้างวิดีโอความยาวใหม่จากวิดีโอเดิม (การตั้งค่าเดียวกัน) ด้วย stream copy (ไม่ encode ใหม่)
+        
+        manifest: ข้อมูลการ render ของ source_path จาก render manifest
+        output_path เป็นไฟล์เดียวกับ source_path ได้ (ต่อความยาวในที่เดิม)
+        ส่งคืน False ถ้าต่อไม่ได้ ผู้เรียกควร render ใหม่ทั้งหมด
+        """
+        sample_rate = manifest['sample_rate']
+        existing_duration = manifest['duration_seconds']
+        total_frames = aac_frames_for(duration_seconds, sample_rate)
+        
+        if self.progress_callback:
+            self.progress_callback(45, "กำลังต่อความยาววิดีโอเดิม (ไม่ต้อง encode ใหม่)...")
+        
+        if duration_seconds <= existing_duration:
+            return self._trim_video(source_path, output_path, duration_seconds)
+        
+        units = choose_splice_units(manifest['loop_samples'], sample_rate, existing_duration)
+        # slip สะสมตลอดความยาวใหม่ต้องไม่เกินขอบเขต (มีแต่ช่วงที่ slip ทางเดียวจะสะสมตามจำนวนจุดต่อ)
+        max_lag = splice_plan(units, total_frames)[1] if units else None
+        if max_lag is None or max_lag > MAX_SPLICE_SLIP_SECONDS * sample_rate:
+            print("No loop-aligned splice point in the existing render, rendering from scratch")
+            return False
+        source_frames = SPLICE_START_FRAME + max(unit_frames for unit_frames, _slip in units) + 1
+        
+        # ทำงานในโฟลเดอร์เดียวกับไฟล์ผลลัพธ์ เพื่อให้ rename ทับไฟล์เดิมได้ทันที
+        work_dir = tempfile.mkdtemp(prefix=".iml_extend_", dir=os.path.dirname(os.path.abspath(output_path)))
+        try:
+            source_audio = os.path.join(work_dir, "source.aac")
+            returncode, stderr = self._run_ffmpeg([
+                'ffmpeg', '-y', '-i', source_path, '-map', '0:a:0', '-c', 'copy',
+                '-t', f"{source_frames * AAC_FRAME_SAMPLES / sample_rate + 1:.6f}", '-f', 'adts', source_audio
+            ])
+            if returncode != 0:
+                print(f"FFmpeg audio extract error: {stderr}")
+                return False
+            
+            adts_rate, offsets = read_adts_frames(source_audio)
+            if adts_rate != sample_rate or len(offsets) - 1 < min(source_frames, total_frames):
+                print("Existing render does not match its manifest, rendering from scratch")
+                return False
+            
+            spliced_audio = os.path.join(work_dir, "audio.aac")
+            write_spliced_adts(source_audio, offsets, units, total_frames, spliced_audio, self.check_cancelled)
+            
+            # ภาพนิ่งเหมือนกันทั้งไฟล์ ต่อวิดีโอเดิมซ้ำจนยาวพอ
+            video_list = os.path.join(work_dir, "video.txt")
+            escaped = os.path.abspath(source_path).replace("'", "'\\''")
+            with open(video_list, 'w', encoding='utf-8') as f:
+                for _ in range(max(math.ceil(duration_seconds / existing_duration), 1)):
+                    f.write(f"file '{escaped}'\nduration {existing_duration}\n")
+            
+            # ADTS ไม่มี edit list เลื่อนเวลาเสียงให้ priming อยู่ก่อน 0 แล้ว muxer จะเขียน edit list ข้ามให้
+            temp_output = os.path.join(work_dir, "output" + os.path.splitext(output_path)[1])
+            ffmpeg_cmd = [
+                'ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', video_list,
+                '-itsoffset', f"{-AAC_PRIMING_SAMPLES / sample_rate:.9f}", '-i', spliced_audio,
+                '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-bsf:a', 'aac_adtstoasc',
+                '-t', str(duration_seconds), *self._metadata_args()
+            ]
+            ffmpeg_cmd += self._output_format_args(temp_output)
+            returncode, stderr = self._run_ffmpeg(ffmpeg_cmd)
+            if returncode != 0:
+                print(f"FFmpeg extend error: {stderr}")
+                return False
+            
+            if max_lag:
+                print(f"Extended {source_path} with audio off the loop by at most "
+                      f"{max_lag / sample_rate * 1000:.2f} ms")
+            os.replace(temp_output, output_path)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        if self._verify_output(output_path, duration_seconds):
+            return True
+        print("Extended render failed verification, rendering from scratch")
+        return False
+    
+    def _trim_video(self, source_path, output_path, duration_seconds):
+        """ตัดวิดีโอเดิมให้สั้นลงด้วย stream copy (ไม่ต้องต่อเสียง จึงไม่ต้องอ่าน frame AAC เอง)"""
+        work_dir = tempfile.mkdtemp(prefix=".iml_extend_", dir=os.path.dirname(os.path.abspath(output_path)))
+        try:
+            temp_output = os.path.join(work_dir, "output" + os.path.splitext(output_path)[1])
+            ffmpeg_cmd = ['ffmpeg', '-y', '-i', source_path, '-map', '0:v:0', '-map', '0:a:0', '-c', 'copy',
+                          '-t', str(duration_seconds), *self._metadata_args()]
+            ffmpeg_cmd += self._output_format_args(temp_output)
+            returncode, stderr = self._run_ffmpeg(ffmpeg_cmd)
+            if returncode != 0:
+                print(f"FFmpeg trim error: {stderr}")
+                return False
+            os.replace(temp_output, output_path)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        if self._verify_output(output_path, duration_seconds):
+            return True
+        print("Trimmed render failed verification, rendering from scratch")
+        return False
+    
+    def _remove_partial_output(self, output_path):
+        """ลบไฟล์ที่เขียนไม่เสร็จหลังการยกเลิก"""
+        for path in (output_path, self._moviepy_temp_audio(output_path)):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                print(f"Could not remove partial file {path}: {e}")
+    
+    def _moviepy_temp_audio(self, output_path):
+        """ชื่อไฟล์เสียงชั่วคราวที่ MoviePy ใช้ระหว่างเขียนวิดีโอ"""
+        return os.path.splitext(output_path)[0] + "_temp_audio.m4a"
+    
+    def _cancellable_moviepy_logger(self):
+        """สร้าง logger ของ MoviePy ที่หยุดการเขียนเมื่อถูกยกเลิก"""
+        from proglog import ProgressBarLogger
+        
+        processor = self
+        
+        class CancellableLogger(ProgressBarLogger):
+            def bars_callback(self, bar, attr, value, old_value=None):
+                processor.check_cancelled()
+        
+        return CancellableLogger()
+    
+    def _verify_output(self, output_path, duration_seconds):
+        """ตรวจสอบความยาวและ track ของไฟล์ผลลัพธ์จาก MP4 box"""
+        if self.progress_callback:
+            self.progress_callback(75, "กำลังตรวจสอบไฟล์วิดีโอ...")
+        
+        ok, problems, info = Mp4Inspector(output_path).verify(expected_duration=duration_seconds)
+        if not ok:
+            print(f"Output verification failed for {output_path}:")
+            for problem in problems:
+                print(f"  - {problem}")
+        elif info['moov_position'] == 'end':
+            print(f"Note: moov atom is at the end of {output_path} (not web-optimized)")
+        return ok
+    
+    def _create_video_with_moviepy(self, image_path, audio_path, output_path, duration_seconds, aspect_ratio, loop_bounds=None):
+        """สร้างวิดีโอด้วย MoviePy"""
+        from moviepy.editor import ImageClip, AudioFileClip, concatenate_audioclips
+        
+        if self.progress_callback:
+            self.progress_callback(45, "กำลังใช้ MoviePy สร้างวิดีโอ...")
+        
+        # โหลดไฟล์เสียง (อ่าน PCM จาก cache แทนการ decode ไฟล์ต้นฉบับซ้ำ)
+        # ใช้ sample rate ที่ตกลงไว้ ค่าเริ่มต้นของ MoviePy (44.1 kHz) จะ resample ทั้งไฟล์
+        audio_format = self.negotiate_audio_format(audio_path)
+        audio_fps = audio_format[0] if audio_format else 44100
+        source_audio = AudioFileClip(self._cached_pcm_path(audio_path), fps=audio_fps)
+        audio = source_audio
+        
+        # ตัดช่วงเงียบ/padding หัวท้ายออกก่อนลูป
+        if loop_bounds:
+            audio = source_audio.subclip(loop_bounds['start'], min(loop_bounds['end'], source_audio.duration))
+        
+        # คำนวณจำนวนรอบที่ต้องลูป
+        audio_duration = audio.duration
+        loops_needed = int(duration_seconds / audio_duration) + 1
+        
+        # สร้างเสียงลูป
+        audio_loops = [audio for _ in range(loops_needed)]
+        final_audio = concatenate_audioclips(audio_loops).subclip(0, duration_seconds)
+        
+        # สร้างวิดีโอจากภาพ
+        image_clip = ImageClip(image_path, duration=duration_seconds)
+        image_clip = self._resize_image_clip_moviepy(image_clip, aspect_ratio, image_path)
+        
+        # รวมภาพและเสียง
+        video = image_clip.set_audio(final_audio)
+        try:
+            video.write_videofile(output_path, fps=1, codec='libx264', audio_codec='aac', audio_fps=audio_fps,
+                                  ffmpeg_params=list(STILL_VIDEO_ARGS) + FASTSTART_ARGS + self._metadata_args(),
+                                  temp_audiofile=self._moviepy_temp_audio(output_path),
+                                  verbose=False, logger=self._cancellable_moviepy_logger())
+        finally:
+            # ปิดไฟล์
+            source_audio.close()
+            video.close()
+        
+        return True
+    
+    def _create_video_with_ffmpeg(self, image_path, audio_path, output_path, duration_seconds, aspect_ratio, loop_bounds=None):
+        """สร้างวิดีโอด้วย FFmpeg"""
+        if self.progress_callback:
+            self.progress_callback(45, "กำลังใช้ FFmpeg สร้างวิดีโอ...")
+        self.backend = "ffmpeg"
+        
+        try:
+            resized_image = self._resize_image_for_ffmpeg(image_path, aspect_ratio)
+            loop_audio, loop_is_temp = self._build_loop_segment(audio_path, loop_bounds)
+            
+            # visualizer: วนวิดีโอหนึ่งรอบเพลงด้วย stream copy แทนการ encode ภาพนิ่ง
+            period_video = self._build_visualizer_period(resized_image, audio_path, loop_bounds) if self.visualizer else None
+            if period_video:
+                video_input = ['-stream_loop', '-1', '-i', period_video]
+                video_codec = ['-c:v', 'copy']
+            else:
+                video_input = ['-loop', '1', '-i', resized_image]
+                video_codec = ['-c:v', 'libx264', *STILL_VIDEO_ARGS, '-pix_fmt', 'yuv420p', '-r', '1']
+            
+            ffmpeg_cmd = [
+                'ffmpeg', '-y', *video_input, '-stream_loop', '-1', '-i', loop_audio,
+                *video_codec, '-c:a', 'aac', *self._audio_format_args(audio_path), '-t', str(duration_seconds),
+                *self._metadata_args()
+            ]
+            ffmpeg_cmd += self._output_format_args(output_path)
+            
+            try:
+                returncode, stderr = self._run_ffmpeg(ffmpeg_cmd, stdout=None if output_path == "-" else subprocess.PIPE)
+            finally:
+                if loop_is_temp:
+                    os.remove(loop_audio)
+                if resized_image != image_path:
+                    os.remove(resized_image)
+            
+            if returncode == 0:
+                return True
+            else:
+                print(f"FFmpeg error: {stderr}")
+                return False
+                
+        except RenderCancelled:
+            raise
+        except FileNotFoundError:
+            return self._create_fallback_instructions(output_path, image_path, audio_path, duration_seconds, aspect_ratio)
+        except Exception as e:
+            print(f"Error with FFmpeg: {e}")
+            return self._create_fallback_instructions(output_path, image_path, audio_path, duration_seconds, aspect_ratio)
+    
+    def create_hls_loop_segments(self, image_path, audio_path, segment_dir, aspect_ratio, loop_bounds=None,
+                                 segment_seconds=HLS_SEGMENT_SECONDS):
+        """encode เพลงหนึ่งรอบเป็น HLS segment สำหรับวนซ้ำในโหมดสตรีมไม่สิ้นสุด
+        
+        ถ้า segment_dir มี playlist อยู่แล้วจะใช้ของเดิมโดยไม่ encode ใหม่
+        """
+        if os.path.exists(os.path.join(segment_dir, SOURCE_PLAYLIST_NAME)):
+            return True
+        
+        if self.progress_callback:
+            self.progress_callback(45, "กำลังเตรียม HLS segment ของเพลงหนึ่งรอบ...")
+        
+        resized_image = self._resize_image_for_ffmpeg(image_path, aspect_ratio)
+        loop_audio, loop_is_temp = self._build_loop_segment(audio_path, loop_bounds)
+        if loop_bounds:
+            period = loop_bounds['end'] - loop_bounds['start']
+        else:
+            period = self._probe_duration(audio_path)
+        
+        # encode ลงโฟลเดอร์ชั่วคราวก่อน แล้ว rename เมื่อเสร็จ เพื่อไม่ให้ cache มีไฟล์ไม่ครบ
+        build_dir = f"{segment_dir}.{os.getpid()}.tmp"
+        os.makedirs(build_dir, exist_ok=True)
+        ffmpeg_cmd = [
+            'ffmpeg', '-y', '-loop', '1', '-framerate', '1', '-i', resized_image, '-i', loop_audio,
+            '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-r', '1', '-g', str(segment_seconds),
+            '-c:a', 'aac', *self._audio_format_args(audio_path), '-t', f"{period:.6f}",
+            '-f', 'hls', '-hls_time', str(segment_seconds), '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(build_dir, 'segment_%05d.ts'),
+            os.path.join(build_dir, SOURCE_PLAYLIST_NAME)
+        ]
+        
+        try:
+            returncode, stderr = self._run_ffmpeg(ffmpeg_cmd)
+        except RenderCancelled:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+        finally:
+            if loop_is_temp:
+                os.remove(loop_audio)
+            if resized_image != image_path:
+                os.remove(resized_image)
+        
+        if returncode != 0:
+            print(f"FFmpeg HLS error: {stderr}")
+            shutil.rmtree(build_dir, ignore_errors=True)
+            return False
+        
+        try:
+            os.replace(build_dir, segment_dir)
+        except OSError:
+            # process อื่นสร้าง cache เดียวกันเสร็จก่อน
+            shutil.rmtree(build_dir, ignore_errors=True)
+        return True
+    
+    def _build_visualizer_period(self, resized_image, audio_path, loop_bounds):
+        """วิดีโอ overlay ของเพลงหนึ่งรอบ (cache ตามภาพ เพลง ช่วงลูป และรูปแบบ)
+        
+        ส่งคืน None ถ้าสร้างไม่ได้ (จะใช้ภาพนิ่งแทน)
+        """
+        import hashlib
+        
+        bounds = f"{loop_bounds['start']:.6f}-{loop_bounds['end']:.6f}" if loop_bounds else "full"
+        key = ":".join([file_content_hash(resized_image), file_content_hash(audio_path), bounds,
+                        self.visualizer, str(VISUALIZER_FPS)])
+        period_video = os.path.join(get_cache_dir("visualizer"), f"{hashlib.sha1(key.encode()).hexdigest()}.mp4")
+        if os.path.exists(period_video):
+            return period_video
+        
+        if self.progress_callback:
+            self.progress_callback(45, "กำลังสร้างภาพเคลื่อนไหวตามเสียงของเพลงหนึ่งรอบ...")
+        self.backend = "visualizer"
+        try:
+            pcm = PcmAudio.load_or_decode(audio_path)
+            start, end = (loop_bounds['start'], loop_bounds['end']) if loop_bounds else (None, None)
+            levels, loudness, frame_rate = compute_levels(pcm, start, end)
+            # timescale เท่ากับอัตรา sample ทำให้ความยาววิดีโอตรงกับลูปเสียงทุก sample
+            completed = render_period_video(resized_image, levels, loudness, frame_rate, period_video,
+                                            self.visualizer, timescale=pcm.sample_rate,
+                                            should_stop=self.is_cancelled)
+        except (ImportError, OSError, RuntimeError, ValueError) as e:
+            print(f"Visualizer unavailable, using the still image: {e}")
+            return None
+        
+        if not completed:
+            raise RenderCancelled()
+        return period_video
+    
+    def _probe_duration(self, audio_path):
+        """อ่านความยาวของไฟล์เสียง (วินาที) จาก log ของ FFmpeg"""
+        import re
+        
+        returncode, stderr = self._run_ffmpeg(['ffmpeg', '-hide_banner', '-i', audio_path])
+        match = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', stderr)
+        if not match:
+            raise RuntimeError(f"Cannot read duration of {audio_path}")
+        hours, minutes, seconds = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    
+    def _metadata_args(self):
+        """ตัวเลือก FFmpeg สำหรับเขียน metadata ของไฟล์ผลลัพธ์"""
+        args = []
+        for key, value in self.metadata.items():
+            args += ['-metadata', f"{key}={value}"]
+        return args
+    
+    def _output_format_args(self, output_path):
+        """ตัวเลือก FFmpeg สำหรับรูปแบบไฟล์ผลลัพธ์ (output "-" = เขียนลง stdout)"""
+        output_format = self.output_format
+        if output_path == "-" and output_format == "mp4":
+            # MP4 ปกติต้อง seek กลับไปเขียน moov จึงส่งทาง pipe ไม่ได้
+            output_format = "fmp4"
+        
+        args = list(OUTPUT_FORMATS[output_format][1])
+        if output_format != "mp4":
+            args = ['-g', str(STREAMING_FRAGMENT_SECONDS)] + args
+        return args + ['pipe:1' if output_path == "-" else output_path]
+    
+    def _cached_pcm_path(self, audio_path):
+        """path ของ PCM ที่ decode แล้วใน cache หรือไฟล์ต้นฉบับถ้าใช้ cache ไม่ได้"""
+        try:
+            return PcmAudio.load_or_decode(audio_path).path
+        except (ImportError, OSError, RuntimeError, ValueError) as e:
+            print(f"PCM cache unavailable: {e}")
+            return audio_path
+    
+    def negotiate_audio_format(self, audio_path):
+        """เลือก (sample_rate, channels) ของเสียงผลลัพธ์ ส่งคืน None ถ้าอ่านเสียงต้นฉบับไม่ได้
+        
+        ใช้รูปแบบของต้นฉบับถ้า AAC รองรับ ไม่เช่นนั้นเลือก sample rate ที่รองรับถัดขึ้นไป
+        และ downmix เป็น 2 ช่อง การแปลงทำครั้งเดียวตอนสร้างลูป (ดู _build_loop_segment)
+        """
+        return self._audio_format_pair(audio_path)[1]
+    
+    def _audio_format_pair(self, audio_path):
+        """(รูปแบบต้นฉบับ, รูปแบบผลลัพธ์) ของเสียง อ่านครั้งเดียวต่อเนื้อหาไฟล์"""
+        try:
+            key = file_content_hash(audio_path)
+        except OSError:
+            key = audio_path
+        if key in self._audio_formats:
+            return self._audio_formats[key]
+        
+        try:
+            pcm = PcmAudio.load_or_decode(audio_path)
+        except (ImportError, OSError, RuntimeError, ValueError) as e:
+            print(f"Cannot probe audio format, leaving it to the encoder: {e}")
+            self._audio_formats[key] = (None, None)
+            self.add_trace("audio", "unknown source format (encoder defaults)")
+            return None, None
+        
+        sample_rate, channels = pcm.sample_rate, pcm.channels
+        if sample_rate not in AAC_SAMPLE_RATES:
+            sample_rate = min((rate for rate in AAC_SAMPLE_RATES if rate >= sample_rate), default=max(AAC_SAMPLE_RATES))
+        if channels not in AAC_CHANNEL_COUNTS:
+            channels = 2
+        
+        source, target = (pcm.sample_rate, pcm.channels), (sample_rate, channels)
+        self._audio_formats[key] = (source, target)
+        if target == source:
+            self.add_trace("audio", f"kept {pcm.sample_rate} Hz, {pcm.channels} ch")
+        else:
+            self.add_trace("audio", f"{pcm.sample_rate} Hz, {pcm.channels} ch -> {sample_rate} Hz, {channels} ch "
+                                    f"(converted once in the loop segment)")
+        return source, target
+    
+    def _audio_format_args(self, audio_path):
+        """ระบุ sample rate/จำนวนช่องให้ encoder ตรงกับลูป เพื่อไม่ให้ FFmpeg แปลงซ้ำตลอดความยาววิดีโอ"""
+        audio_format = self.negotiate_audio_format(audio_path)
+        if not audio_format:
+            return []
+        return ['-ar', str(audio_format[0]), '-ac', str(audio_format[1])]
+    
+    def _build_loop_segment(self, audio_path, loop_bounds):
+        """เตรียมเสียงสำหรับ -stream_loop ส่งคืน (path, เป็นไฟล์ชั่วคราวหรือไม่)
+        
+        ใช้ PCM จาก cache: ไม่ตัดก็ป้อนไฟล์ cache ให้ FFmpeg โดยตรง (ไม่ต้อง decode ซ้ำทุกรอบ)
+        ถ้าตัดก็คัดลอกช่วง loop_bounds จาก memmap เป็น WAV เพื่อให้ต่อกันได้ไร้ช่องว่าง
+        ถ้ารูปแบบเสียงต้องแปลง จะแปลงเฉพาะลูปหนึ่งรอบนี้
+        """
+        try:
+            pcm = PcmAudio.load_or_decode(audio_path)
+        except (ImportError, OSError, RuntimeError, ValueError) as e:
+            print(f"PCM cache unavailable, using FFmpeg to cut the loop: {e}")
+            self.add_trace("loop", "cut from the source by FFmpeg")
+            return self._build_loop_segment_with_ffmpeg(audio_path, loop_bounds)
+        
+        audio_format = self.negotiate_audio_format(audio_path)
+        segment_path = os.path.splitext(audio_path)[0] + '_loop.wav'
+        if audio_format and audio_format != (pcm.sample_rate, pcm.channels):
+            self.add_trace("loop", "resampled/remixed one loop from cached PCM")
+            return self._convert_loop_segment(pcm, loop_bounds, audio_format, segment_path), True
+        
+        if not loop_bounds:
+            self.add_trace("loop", "cached PCM as-is")
+            return pcm.path, False
+        self.add_trace("loop", "trimmed from cached PCM")
+        return pcm.write_wav(segment_path, loop_bounds['start'], loop_bounds['end']), True
+    
+    def _convert_loop_segment(self, pcm, loop_bounds, audio_format, segment_path):
+        """ตัดลูปจาก PCM cache และแปลงเป็น sample rate/จำนวนช่องที่ตกลงไว้ด้วย FFmpeg"""
+        trim_args = []
+        if loop_bounds:
+            trim_args = ['-ss', f"{loop_bounds['start']:.6f}", '-to', f"{loop_bounds['end']:.6f}"]
+        cmd = [
+            'ffmpeg', '-y', *trim_args, '-i', pcm.path,
+            '-ar', str(audio_format[0]), '-ac', str(audio_format[1]), '-c:a', 'pcm_f32le', segment_path
+        ]
+        returncode, stderr = self._run_ffmpeg(cmd)
+        if returncode != 0:
+            raise RuntimeError(f"FFmpeg could not convert the loop segment: {stderr[-500:]}")
+        return segment_path
+    
+    def _build_loop_segment_with_ffmpeg(self, audio_path, loop_bounds):
+        """ตัดเสียงตาม loop_bounds ด้วย FFmpeg (ใช้เมื่อไม่มี NumPy)"""
+        if not loop_bounds:
+            return audio_path, False
+        
+        segment_path = os.path.splitext(audio_path)[0] + '_loop.wav'
+        segment_cmd = [
+            'ffmpeg', '-y', '-i', audio_path,
+            '-ss', f"{loop_bounds['start']:.6f}", '-to', f"{loop_bounds['end']:.6f}",
+            '-vn', '-c:a', 'pcm_s16le', segment_path
+        ]
+        returncode, stderr = self._run_ffmpeg(segment_cmd)
+        if returncode != 0:
+            print(f"FFmpeg loop segment error, using untrimmed audio: {stderr}")
+            return audio_path, False
+        return segment_path, True
+    
+    def _resize_image_clip_moviepy(self, clip, aspect_ratio, image_path):
+        """ปรับขนาดภาพสำหรับ MoviePy"""
+        target_size = VIDEO_QUALITY.get(aspect_ratio, VIDEO_QUALITY["16:9"])
+        left, top, right, bottom = self._crop_plan(image_path, target_size).box
+        return clip.crop(x1=left, y1=top, x2=right, y2=bottom).resize(target_size)
+    
+    def _resize_image_for_ffmpeg(self, image_path, aspect_ratio):
+        """ปรับขนาดภาพสำหรับ FFmpeg"""
+        from PIL import Image
+        
+        img = Image.open(image_path)
+        target_size = VIDEO_QUALITY.get(aspect_ratio, VIDEO_QUALITY["16:9"])
+        img_resized = self._crop_and_resize_image(img, target_size, self._crop_plan(image_path, target_size).box)
+        
+        temp_image_path = image_path.replace('.jpg', '_resized.jpg').replace('.png', '_resized.jpg')
+        img_resized.save(temp_image_path, 'JPEG')
+        return temp_image_path
+    
+    def _crop_plan(self, image_path, target_size):
+        """กรอบ crop ตามจุดสนใจของภาพ (ใช้ร่วมกับแท็บตัวอย่าง)"""
+        plan = CropPlan.for_image(image_path, target_size)
+        self.add_trace("crop", f"{plan.source} box {plan.box} of {plan.image_size[0]}x{plan.image_size[1]}")
+        return plan
+    
+    def _crop_and_resize_image(self, img, target_size, box=None):
+        """Crop และ resize ภาพ (ไม่ระบุ box = ตัดกลางภาพ)"""
+        from PIL import Image
+        
+        if box is None:
+            box = CropPlan(img.size, target_size, (0.5, 0.5), "center").box
+        return img.crop(box).resize(target_size, Image.Resampling.LANCZOS)
+    
+    def _create_fallback_instructions(self, output_path, image_path, audio_path, duration_seconds, aspect_ratio):
+        """สร้างไฟล์คำแนะนำ"""
+        instructions_file = output_path.replace('.mp4', '_instructions.txt')
+        duration_hours = duration_seconds / 3600
+        
+        instructions = f"""🎬 วิธีสร้างวิดีโอด้วยตัวเอง
+
+เนื่องจากไม่สามารถสร้างวิดีโออัตโนมัติได้ กรุณาทำตามขั้นตอนต่อไปนี้:
+
+📁 ไฟล์ที่ต้องใช้:
+• ภาพ: {image_path}
+• เสียง: {audio_path}
+• ความยาววิดีโอ: {duration_hours:.1f} ชั่วโมง
+• อัตราส่วน: {aspect_ratio}
+
+🛠️ วิธีที่ 1: ใช้ FFmpeg (แนะนำ)
+1. ดาวน์โหลด FFmpeg จาก https://ffmpeg.org/download.html
+2. เปิด Command Prompt
+3. รันคำสั่ง:
+   ffmpeg -loop 1 -i "{image_path}" -i "{audio_path}" -c:v libx264 -c:a aac -t {duration_seconds} -pix_fmt yuv420p -r 1 "{output_path}"
+
+🎥 วิธีที่ 2: ใช้โปรแกรม Video Editor
+• DaVinci Resolve (ฟรี)
+• OpenShot (ฟรี)
+• Adobe Premiere Pro
+• Canva (ออนไลน์)
+
+📋 ขั้นตอน:
+1. นำเข้าภาพและเสียง
+2. ตั้งความยาวภาพเป็น {duration_hours:.1f} ชั่วโมง
+3. วางเสียงซ้ำจนครบเวลา
+4. Export เป็น MP4
+"""
+        
+        try:
+            with open(instructions_file, 'w', encoding='utf-8') as f:
+                f.write(instructions)
+            
+            if self.progress_callback:
+                self.progress_callback(100, f"สร้างไฟล์คำแนะนำ: {os.path.basename(instructions_file)}")
+            
+            return True
+        except Exception as e:
+            print(f"Error creating instructions: {e}")
+            return False
+
+
+class CustomImageMusicLooper:
+    """คลาสสำหรับประมวลผลงานหนึ่งงาน (UI, CLI และ worker ใช้ร่วมกัน)
+    
+    events: RenderEvents (หรือ object ที่มี progress/trace) ใช้แทน progress_callback ได้
+    scheduler: AdmissionScheduler ที่ใช้ร่วมกับงานอื่น (ไม่ระบุ = scheduler ของทั้ง process)
+    """
+    
+    def __init__(self, image_file, audio_file, output_folder, duration_hours, 
+                 aspect_ratio, crossfade_duration, auto_crossfade, keep_original, 
+                 trim_silence=True, output_format="mp4", output_file=None, endless=False,
+                 hls_window_size=DEFAULT_WINDOW_SIZE, visualizer=None, progress_callback=None, events=None,
+                 scheduler=None):
+        if events is not None:
+            progress_callback = progress_callback or events.progress
+        self.image_file = image_file
+        self.audio_file = audio_file
+        self.output_folder = output_folder
+        self.duration_hours = duration_hours
+        self.aspect_ratio = aspect_ratio
+        self.crossfade_duration = crossfade_duration
+        self.auto_crossfade = auto_crossfade
+        self.keep_original = keep_original
+        self.trim_silence = trim_silence
+        self.output_format = output_format
+        self.endless = endless
+        self.hls_window_size = hls_window_size
+        self.visualizer = visualizer
+        self.progress_callback = progress_callback
+        self.scheduler = scheduler or shared_scheduler()
+        
+        # สร้าง processor
+        self.video_processor = VideoProcessor(progress_callback, output_format, visualizer,
+                                              trace_callback=events.trace if events is not None else None)
+        
+        # ชื่อไฟล์ผลลัพธ์ (output_file="-" = ส่งออกทาง stdout)
+        # ชื่อปกติอาจถูกเติม fingerprint ใน process() ถ้างานอื่นที่ตั้งค่าต่างกันใช้ชื่อนี้อยู่
+        base_name = os.path.splitext(os.path.basename(audio_file))[0]
+        extension = OUTPUT_FORMATS.get(output_format, OUTPUT_FORMATS["mp4"])[0]
+        self.output_file = output_file
+        self.output_video = output_file or os.path.join(output_folder, f"{base_name}_music_loop{extension}")
+        
+        # โหมดสตรีมไม่สิ้นสุด: ผลลัพธ์คือ playlist ในโฟลเดอร์ HLS
+        self.hls_output_dir = os.path.join(output_folder, f"{base_name}_hls")
+        if endless:
+            self.output_video = os.path.join(self.hls_output_dir, LIVE_PLAYLIST_NAME)
+        self.cancelled = False
+    
+    @property
+    def trace(self):
+        """การตัดสินใจของงาน (ขั้นตอน, รายละเอียด) เช่น backend และรูปแบบเสียงที่ใช้"""
+        return self.video_processor.trace
+    
+    def cancel(self):
+        """ยกเลิกงาน (เรียกจาก thread อื่นได้)"""
+        self.cancelled = True
+        self.video_processor.cancel()
+        
+    def process(self):
+        """ประมวลผลหลัก"""
+        temp_folder = render_folder = None
+        try:
+            if self.progress_callback:
+                self.progress_callback(20, "กำลังโหลดไฟล์เสียง...")
+                
+            # สร้างโฟลเดอร์ชั่วคราว
+            temp_folder = self._create_temp_folder()
+            
+            # คัดลอกไฟล์
+            temp_audio, temp_image = self._copy_files_to_temp(temp_folder)
+            
+            if self.progress_callback:
+                self.progress_callback(40, "กำลังประมวลผลเสียง...")
+            
+            # หาจุดเริ่ม-จบจริงของเพลงสำหรับลูป (ใช้ผลใน library index ถ้าเคยวิเคราะห์แล้ว)
+            loop_bounds = None
+            if self.trim_silence:
+                loop_bounds = LibraryIndex().loop_bounds(self.audio_file)
+            self.video_processor.check_cancelled()
+            
+            if self.endless:
+                return self._stream_endless(temp_image, temp_audio, loop_bounds)
+            
+            duration_seconds = int(self.duration_hours * 3600)
+            
+            # งานที่เหมือนกันทุกอย่างเคยสร้างไว้แล้ว ใช้ไฟล์เดิมทันที
+            settings_key = fingerprint = None
+            preferred_path = self.output_video
+            if self.output_video != "-":
+                settings_key = self._render_settings_key(temp_audio, loop_bounds)
+                fingerprint = render_fingerprint(settings_key, duration_seconds)
+                self.video_processor.metadata = {'comment': metadata_comment(fingerprint)}
+                if self._reuse_identical_output(fingerprint):
+                    return True
+                if not self.output_file:
+                    self.output_video = choose_output_path(preferred_path, fingerprint)
+            
+            # เขียนในโฟลเดอร์ชั่วคราวข้างไฟล์ปลายทาง (ระบบไฟล์เดียวกัน) แล้วย้ายเข้าที่เมื่อเสร็จ
+            # ไม่มีใครเห็นไฟล์ที่เขียนไม่ครบ
+            render_path = self.output_video
+            if fingerprint:
+                render_folder = self._create_render_folder()
+                render_path = os.path.join(render_folder, os.path.basename(self.output_video))
+            
+            # ไฟล์เดิมที่สร้างจากการตั้งค่าเดียวกัน (ต่างแค่ความยาว) ต่อหรือตัดเป็นไฟล์ใหม่ได้โดยไม่ encode ใหม่
+            # (visualizer วนตามความยาวเพลง ไม่ใช่ความยาวไฟล์ จึงต่อด้วยวิธีนี้ไม่ได้)
+            success = False
+            if fingerprint and self.output_format in EXTENDABLE_FORMATS and not self.visualizer:
+                success = self._extend_existing_render(settings_key, render_path, duration_seconds)
+            
+            # สร้างวิดีโอ (รอจนหน่วยความจำและ CPU ที่เหลือพอสำหรับงานนี้)
+            if not success:
+                footprint = self._plan_footprint(temp_image, temp_audio, loop_bounds)
+                with self.scheduler.reserve(footprint, should_stop=self.video_processor.is_cancelled):
+                    monitor = PeakRssMonitor(is_shared=lambda: self.scheduler.running > 1).start()
+                    try:
+                        success = self.video_processor.create_video(
+                            image_path=temp_image,
+                            audio_path=temp_audio,
+                            output_path=render_path,
+                            duration_seconds=duration_seconds,
+                            aspect_ratio=self.aspect_ratio,
+                            loop_bounds=loop_bounds
+                        )
+                    finally:
+                        self._record_footprint(footprint, monitor, success and os.path.isfile(render_path))
+            
+            if success and fingerprint:
+                self._publish_output(render_path, preferred_path, fingerprint)
+                if os.path.isfile(self.output_video):
+                    self._save_render_manifest(settings_key, fingerprint, duration_seconds, loop_bounds)
+            
+            if self.progress_callback:
+                self.progress_callback(80, "กำลังจัดระเบียบไฟล์...")
+            
+            if self.progress_callback:
+                self.progress_callback(100, "เสร็จสิ้น!")
+                
+            return success
+        
+        except (RenderCancelled, AdmissionCancelled):
+            self.cancelled = True
+            if self.progress_callback:
+                self.progress_callback(0, "ยกเลิกการสร้างวิดีโอแล้ว")
+            return False
+            
+        except Exception as e:
+            print(f"Error in CustomImageMusicLooper: {e}")
+            return False
+        
+        finally:
+            # ลบโฟลเดอร์ชั่วคราว
+            for folder in (temp_folder, render_folder):
+                if folder:
+                    shutil.rmtree(folder, ignore_errors=True)
+    
+    def _render_settings_key(self, audio_path, loop_bounds):
+        """key ของการตั้งค่าทั้งหมดที่มีผลต่อวิดีโอ (ยกเว้นความยาว) รวมรูปแบบเสียงที่เลือกได้"""
+        return render_settings_key(self.image_file, self.audio_file, self.aspect_ratio, loop_bounds,
+                                   self.output_format, self._crop_box(), visualizer=self.visualizer,
+                                   audio_format=self.video_processor.negotiate_audio_format(audio_path))
+    
+    def _render_backend(self, audio_path):
+        """backend ที่งานนี้จะใช้ ("moviepy", "ffmpeg" หรือ "visualizer")"""
+        if self.visualizer:
+            return "visualizer"
+        return self.video_processor.choose_backend(audio_path, self.output_video)[0]
+    
+    def _reuse_identical_output(self, fingerprint):
+        """ใช้ไฟล์ของงานที่เหมือนกันทุกอย่าง (hardlink ไปยังชื่อของงานนี้ หรืออ้างถึงไฟล์เดิม)"""
+        existing = find_identical_output(fingerprint)
+        if existing is None:
+            return False
+        target = self.output_file or choose_output_path(self.output_video, fingerprint)
+        # ผู้ใช้ระบุชื่อไฟล์เอง: คัดลอกถ้า link ข้าม drive ไม่ได้
+        self.output_video = link_output(existing, target, copy=bool(self.output_file))
+        if self.output_video == existing:
+            self.video_processor.add_trace("render", f"identical job already rendered: {existing}")
+        else:
+            self.video_processor.add_trace("render", f"identical job already rendered, reused {existing}")
+        if self.progress_callback:
+            self.progress_callback(100, "ใช้ไฟล์ที่เคยสร้างจากงานเดียวกัน")
+        return True
+    
+    def _publish_output(self, render_path, preferred_path, fingerprint):
+        """ย้ายไฟล์ที่เขียนเสร็จเข้าที่ (ชื่อปกติ หรือชื่อที่เติม fingerprint ถ้างานอื่นใช้ชื่อนี้อยู่)"""
+        if os.path.isfile(render_path):
+            self.output_video = publish_output(render_path, preferred_path, fingerprint,
+                                               exclusive=not self.output_file)
+            return
+        
+        # ไม่มี FFmpeg: ได้ไฟล์คำแนะนำแทนวิดีโอ ย้ายไปไว้ข้างชื่อไฟล์ผลลัพธ์
+        instructions = render_path.replace('.mp4', '_instructions.txt')
+        if os.path.isfile(instructions):
+            with open(instructions, 'r', encoding='utf-8') as f:
+                text = f.read().replace(render_path, self.output_video)
+            with open(self.output_video.replace('.mp4', '_instructions.txt'), 'w', encoding='utf-8') as f:
+                f.write(text)
+    
+    def _plan_footprint(self, image_path, audio_path, loop_bounds):
+        """ประมาณทรัพยากรของงานจากขนาดภาพ ความยาวเพลง และ backend
+        
+        ถ้า MoviePy จะใช้หน่วยความจำเกินที่เหลือ เปลี่ยนไปใช้ FFmpeg ซึ่งใช้น้อยกว่า
+        """
+        from PIL import Image
+        
+        with Image.open(image_path) as img:
+            image_size = img.size
+        target_size = VIDEO_QUALITY.get(self.aspect_ratio, VIDEO_QUALITY["16:9"])
+        if loop_bounds:
+            audio_seconds = loop_bounds['end'] - loop_bounds['start']
+        else:
+            try:
+                audio_seconds = PcmAudio.load_or_decode(audio_path).duration
+            except (ImportError, OSError, RuntimeError, ValueError):
+                # ไม่มี NumPy/FFmpeg: อ่านความยาวจาก log ของ FFmpeg หรือใช้ค่าเริ่มต้นของ model
+                try:
+                    audio_seconds = self.video_processor._probe_duration(audio_path)
+                except (OSError, RuntimeError):
+                    audio_seconds = FALLBACK_AUDIO_SECONDS
+        
+        backend = self._render_backend(audio_path)
+        footprint = estimate_footprint(backend, image_size, target_size, audio_seconds)
+        
+        if backend == "moviepy":
+            free_mb = self.scheduler.free_memory_mb()
+            if footprint.memory_mb > free_mb:
+                self.video_processor.low_memory = True
+                self.video_processor.add_trace("memory", f"MoviePy needs ~{footprint.memory_mb:.0f} MB "
+                                                         f"but only {free_mb:.0f} MB is free, using FFmpeg")
+                footprint = estimate_footprint("ffmpeg", image_size, target_size, audio_seconds)
+        return footprint
+    
+    def _record_footprint(self, footprint, monitor, rendered):
+        """บันทึก peak RSS ที่วัดได้เทียบกับค่าประมาณ
+        
+        ใช้ปรับ model เฉพาะเมื่อได้วิดีโอจริงและวัดได้ตรงงาน (ไม่ใช่ไฟล์คำแนะนำหรืองานที่ล้มเหลว)
+        """
+        peak_mb = monitor.stop()
+        if peak_mb is None:
+            self.video_processor.add_trace("memory", f"estimated {footprint.memory_mb:.0f} MB, peak not measurable")
+            return
+        self.video_processor.add_trace("memory", f"estimated {footprint.memory_mb:.0f} MB, peak {peak_mb:.0f} MB"
+                                                 f"{' (shared with other jobs)' if monitor.shared else ''}")
+        if not rendered or monitor.shared or self.video_processor.backend != footprint.backend:
+            return
+        try:
+            record_peak_rss(footprint, peak_mb, {'aspect_ratio': self.aspect_ratio})
+        except OSError as e:
+            print(f"Could not record memory usage: {e}")
+    
+    def _extend_existing_render(self, settings_key, output_path, duration_seconds):
+        """สร้างไฟล์ความยาวใหม่จากไฟล์ผลลัพธ์เดิมที่สร้างด้วยการตั้งค่าเดียวกัน (ไฟล์เดิมไม่ถูกแก้ไข)"""
+        manifests = [entry for entry in find_render_manifests(settings_key=settings_key) if entry['loop_samples']]
+        if not manifests:
+            return False
+        # ใช้ไฟล์ที่ยาวที่สุด: ตัดได้ทุกความยาวที่สั้นกว่า และมีช่วงให้หาจุดต่อมากที่สุด
+        manifest = max(manifests, key=lambda entry: entry['duration_seconds'])
+        extended = self.video_processor.extend_video(manifest['path'], output_path, duration_seconds, manifest)
+        if extended:
+            action = "extended" if duration_seconds > manifest['duration_seconds'] else "trimmed"
+            self.video_processor.add_trace("render", f"{action} {manifest['path']} "
+                                                     f"({manifest['duration_seconds']} s) with stream copy")
+        return extended
+    
+    def _save_render_manifest(self, settings_key, fingerprint, duration_seconds, loop_bounds):
+        """บันทึก fingerprint และความยาวของลูป (sample) ไว้คู่กับไฟล์ผลลัพธ์ สำหรับใช้ซ้ำและต่อความยาว"""
+        loop_samples = sample_rate = None
+        try:
+            pcm = PcmAudio.load_or_decode(self.audio_file)
+            if loop_bounds:
+                loop_samples = pcm.frame_at(loop_bounds['end']) - pcm.frame_at(loop_bounds['start'])
+            else:
+                loop_samples = pcm.frame_count
+            # ความยาวลูปตาม sample rate ของเสียงในไฟล์ผลลัพธ์ (อาจถูกแปลงตอนสร้างลูป)
+            sample_rate = (self.video_processor.negotiate_audio_format(self.audio_file) or (pcm.sample_rate,))[0]
+            loop_samples = round(loop_samples * sample_rate / pcm.sample_rate)
+        except (ImportError, OSError, RuntimeError, ValueError) as e:
+            # ยังใช้ไฟล์ซ้ำได้ แต่ต่อความยาวจากไฟล์นี้ไม่ได้
+            print(f"Could not measure the loop for the render manifest: {e}")
+            loop_samples = sample_rate = None
+        try:
+            save_render_manifest(self.output_video, settings_key, fingerprint, duration_seconds,
+                                 loop_samples, sample_rate)
+        except OSError as e:
+            print(f"Could not record render manifest: {e}")
+    
+    def _stream_endless(self, temp_image, temp_audio, loop_bounds):
+        """สตรีม HLS แบบ rolling window ไปเรื่อยๆ จนกว่าจะถูกยกเลิก"""
+        segment_dir = os.path.join(get_cache_dir("hls"), self._hls_cache_key(loop_bounds))
+        if not self.video_processor.create_hls_loop_segments(temp_image, temp_audio, segment_dir,
+                                                             self.aspect_ratio, loop_bounds):
+            return False
+        
+        publisher = RollingHlsPublisher(segment_dir, self.hls_output_dir, self.hls_window_size,
+                                        should_stop=self.video_processor.is_cancelled)
+        if self.progress_callback:
+            self.progress_callback(100, f"กำลังสตรีม HLS: {self.output_video}")
+        try:
+            publisher.run()
+        finally:
+            publisher.cleanup()
+        
+        # การสตรีมจบได้ทางเดียวคือถูกสั่งหยุด
+        self.video_processor.check_cancelled()
+        return True
+    
+    def _hls_cache_key(self, loop_bounds):
+        """key ของ segment cache จากเนื้อหาไฟล์และการตั้งค่าที่มีผลต่อ segment"""
+        import hashlib
+        
+        bounds = f"{loop_bounds['start']:.6f}-{loop_bounds['end']:.6f}" if loop_bounds else "full"
+        key = ":".join([file_content_hash(self.image_file), file_content_hash(self.audio_file),
+                        self.aspect_ratio, bounds, str(HLS_SEGMENT_SECONDS), str(self._crop_box())])
+        return hashlib.sha1(key.encode()).hexdigest()
+    
+    def _crop_box(self):
+        """กรอบ crop ของภาพที่อัตราส่วนนี้ (รวมจุดที่ผู้ใช้เลือกเองในแท็บตัวอย่าง)"""
+        return CropPlan.for_image(self.image_file, VIDEO_QUALITY.get(self.aspect_ratio, VIDEO_QUALITY["16:9"])).box
+    
+    def _create_temp_folder(self):
+        """สร้างโฟลเดอร์ชั่วคราว (แยกต่องาน เพื่อให้หลายงานใช้โฟลเดอร์ผลลัพธ์เดียวกันพร้อมกันได้)"""
+        os.makedirs(self.output_folder, exist_ok=True)
+        return tempfile.mkdtemp(prefix="temp_", dir=self.output_folder)
+    
+    def _create_render_folder(self):
+        """สร้างโฟลเดอร์ชั่วคราวในโฟลเดอร์ของไฟล์ผลลัพธ์ (rename เข้าที่ได้เสมอ แม้ปลายทางอยู่ต่าง drive)"""
+        output_dir = os.path.dirname(os.path.abspath(self.output_video))
+        os.makedirs(output_dir, exist_ok=True)
+        return tempfile.mkdtemp(prefix=".iml_render_", dir=output_dir)
+    
+    def _copy_files_to_temp(self, temp_folder):
+        """คัดลอกไฟล์ไปยังโฟลเดอร์ชั่วคราว"""
+        base_name = os.path.splitext(os.path.basename(self.audio_file))[0]
+        temp_audio = os.path.join(temp_folder, f"{base_name}.mp3")
+        temp_image = os.path.join(temp_folder, f"{base_name}.jpg")
+        
+        shutil.copy2(self.audio_file, temp_audio)
+        shutil.copy2(self.image_file, temp_image)
+        
+        return temp_audio, temp_image
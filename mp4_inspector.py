@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+MP4 box inspector for Image Music Looper
+อ่านเฉพาะ box ที่จำเป็น (moov/mvhd/tkhd/mdhd/hdlr/stsd/stts) ด้วยการ seek
+เพื่อตรวจสอบไฟล์ผลลัพธ์โดยไม่ต้อง decode ทั้งไฟล์
+"""
+
+import os
+import sys
+import struct
+
+# box ที่มี box ลูกอยู่ข้างใน
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'mvex', b'edts'}
+
+# ค่าความคลาดเคลื่อนของความยาว (วินาที) ที่ยอมรับได้
+DEFAULT_DURATION_TOLERANCE = 1.0
+
+# handler ของ track ที่ต้องมีในวิดีโอผลลัพธ์
+REQUIRED_TRACK_TYPES = ('vide', 'soun')
+
+
+class Mp4ParseError(Exception):
+    """ไฟล์ไม่ใช่ MP4 ที่อ่านได้"""
+
+
+class Mp4Inspector:
+    """คลาสสำหรับอ่านข้อมูลโครงสร้างของไฟล์ MP4"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def inspect(self):
+        """อ่านข้อมูลหลักของไฟล์และส่งคืนเป็น dict"""
+        file_size = os.path.getsize(self.path)
+        info = {
+            'path': self.path,
+            'file_size': file_size,
+            'duration': None,
+            'timescale': None,
+            'tracks': [],
+            'moov_position': None,
+            'fragmented': False,
+            'truncated': False,
+        }
+
+        # ค่า default ของ fragment (จาก trex) และเวลาสิ้นสุดของแต่ละ track
+        self._trex_durations = {}
+        self._truncated = False
+        fragment_ends = {}
+
+        with open(self.path, 'rb') as f:
+            seen_mdat = False
+            for box_type, start, header_size, end in self._iter_boxes(f, 0, file_size):
+                if box_type == b'mdat':
+                    seen_mdat = True
+                elif box_type == b'moof':
+                    info['fragmented'] = True
+                    self._parse_moof(f, start + header_size, end, fragment_ends)
+                elif box_type == b'moov':
+                    info['moov_position'] = 'end' if seen_mdat else 'start'
+                    self._parse_moov(f, start + header_size, end, info)
+
+        if info['moov_position'] is None:
+            raise Mp4ParseError(f"ไม่พบ moov box: {self.path}")
+
+        if fragment_ends:
+            self._apply_fragment_durations(info, fragment_ends)
+        info['truncated'] = self._truncated
+        return info
+
+    def verify(self, expected_duration=None, tolerance=DEFAULT_DURATION_TOLERANCE,
+               required_tracks=REQUIRED_TRACK_TYPES):
+        """ตรวจสอบไฟล์ ส่งคืน (ผ่านหรือไม่, รายการปัญหา, ข้อมูลไฟล์)"""
+        try:
+            info = self.inspect()
+        except (OSError, Mp4ParseError, struct.error) as e:
+            return False, [f"อ่านไฟล์ไม่ได้: {e}"], None
+
+        problems = []
+        if info['truncated']:
+            problems.append("ไฟล์ไม่ครบ (ขนาดของ box เกินขนาดไฟล์)")
+        track_types = [track['type'] for track in info['tracks']]
+        for required in required_tracks:
+            if required not in track_types:
+                problems.append(f"ไม่พบ track ประเภท {required}")
+
+        movie_duration = info['duration'] or 0.0
+        if expected_duration is not None and abs(movie_duration - expected_duration) > tolerance:
+            problems.append(f"ความยาวไม่ตรง: {movie_duration:.2f}s (ต้องการ {expected_duration:.2f}s)")
+
+        # ทุก track ต้องยาวเท่ากับตัววิดีโอ ไม่เช่นนั้นจะมีช่วงเงียบหรือภาพค้าง
+        reference = expected_duration if expected_duration is not None else movie_duration
+        for track in info['tracks']:
+            if track['duration'] is not None and abs(track['duration'] - reference) > tolerance:
+                problems.append(f"track {track['id']} ({track['type']}/{track['codec']}) "
+                                f"ยาว {track['duration']:.2f}s ไม่ตรงกับ {reference:.2f}s")
+
+        return not problems, problems, info
+
+    def _iter_boxes(self, f, start, end):
+        """วนอ่าน header ของ box ในช่วง [start, end)"""
+        position = start
+        while position + 8 <= end:
+            f.seek(position)
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            size, box_type = struct.unpack('>I4s', header)
+            header_size = 8
+            if size == 1:
+                size = self._unpack(f, '>Q')[0]
+                header_size = 16
+            elif size == 0:
+                size = end - position
+            if size < header_size:
+                raise Mp4ParseError(f"ขนาด box ไม่ถูกต้องที่ตำแหน่ง {position}")
+            if position + size > end:
+                # box ยาวเกินไฟล์หรือ box แม่ (ไฟล์ถูกตัดระหว่างเขียน) อ่านเท่าที่มี
+                self._truncated = True
+            box_end = min(position + size, end)
+            yield box_type, position, header_size, box_end
+            position += size
+
+    def _parse_moov(self, f, start, end, info):
+        """อ่าน mvhd และ trak ทั้งหมดใน moov"""
+        for box_type, box_start, header_size, box_end in self._iter_boxes(f, start, end):
+            payload = box_start + header_size
+            if box_type == b'mvhd':
+                timescale, duration = self._read_time_header(f, payload)
+                info['timescale'] = timescale
+                info['duration'] = duration / timescale if timescale else None
+            elif box_type == b'trak':
+                track = {'id': None, 'type': None, 'codec': None, 'duration': None,
+                         'timescale': None, 'sample_count': None}
+                self._parse_track_box(f, payload, box_end, track)
+                info['tracks'].append(track)
+            elif box_type == b'mvex':
+                info['fragmented'] = True
+                self._parse_mvex(f, payload, box_end)
+
+    def _parse_track_box(self, f, start, end, track):
+        """อ่าน box ที่เกี่ยวข้องกับ track แบบ recursive"""
+        for box_type, box_start, header_size, box_end in self._iter_boxes(f, start, end):
+            payload = box_start + header_size
+            if box_type in CONTAINER_BOXES:
+                self._parse_track_box(f, payload, box_end, track)
+            elif box_type == b'tkhd':
+                f.seek(payload)
+                version = self._read(f, 1)[0]
+                f.seek(payload + (20 if version == 1 else 12))
+                track['id'] = self._unpack(f, '>I')[0]
+            elif box_type == b'mdhd':
+                timescale, duration = self._read_time_header(f, payload)
+                track['timescale'] = timescale
+                track['duration'] = duration / timescale if timescale else None
+            elif box_type == b'hdlr':
+                f.seek(payload + 8)
+                track['type'] = self._read(f, 4).decode('ascii', errors='replace')
+            elif box_type == b'stsd':
+                f.seek(payload + 12)
+                track['codec'] = self._read(f, 4).decode('ascii', errors='replace')
+            elif box_type == b'stts':
+                self._read_stts(f, payload, track)
+
+    def _parse_mvex(self, f, start, end):
+        """อ่าน default_sample_duration ของแต่ละ track จาก trex"""
+        for box_type, box_start, header_size, _box_end in self._iter_boxes(f, start, end):
+            if box_type == b'trex':
+                f.seek(box_start + header_size + 4)
+                track_id, _description_index, default_duration = self._unpack(f, '>III')
+                self._trex_durations[track_id] = default_duration
+
+    def _parse_moof(self, f, start, end, fragment_ends):
+        """หาเวลาสิ้นสุดของแต่ละ track ใน fragment (tfdt + ผลรวม duration ใน trun)"""
+        for box_type, box_start, header_size, box_end in self._iter_boxes(f, start, end):
+            if box_type != b'traf':
+                continue
+            track_id, default_duration, base_time, total = None, None, 0, 0
+            for child_type, child_start, child_header, _child_end in self._iter_boxes(f, box_start + header_size, box_end):
+                payload = child_start + child_header
+                f.seek(payload)
+                version_flags = self._unpack(f, '>I')[0]
+                version, flags = version_flags >> 24, version_flags & 0xFFFFFF
+                if child_type == b'tfhd':
+                    track_id = self._unpack(f, '>I')[0]
+                    skip = (8 if flags & 0x01 else 0) + (4 if flags & 0x02 else 0)
+                    if flags & 0x08:
+                        f.seek(skip, os.SEEK_CUR)
+                        default_duration = self._unpack(f, '>I')[0]
+                elif child_type == b'tfdt':
+                    base_time = self._unpack(f, '>Q' if version == 1 else '>I')[0]
+                elif child_type == b'trun':
+                    total += self._read_trun_duration(f, flags, default_duration, track_id)
+            if track_id is not None:
+                fragment_ends[track_id] = max(fragment_ends.get(track_id, 0), base_time + total)
+
+    def _read_trun_duration(self, f, flags, default_duration, track_id):
+        """รวม duration ของ sample ใน trun (ตำแหน่งไฟล์อยู่หลัง version/flags)"""
+        sample_count = self._unpack(f, '>I')[0]
+        f.seek((4 if flags & 0x01 else 0) + (4 if flags & 0x04 else 0), os.SEEK_CUR)
+        if not flags & 0x100:
+            if default_duration is None:
+                default_duration = self._trex_durations.get(track_id, 0)
+            return sample_count * default_duration
+
+        fields = sum(4 for bit in (0x100, 0x200, 0x400, 0x800) if flags & bit)
+        data = self._read(f, sample_count * fields)
+        return sum(struct.unpack_from('>I', data, index)[0] for index in range(0, len(data), fields))
+
+    def _apply_fragment_durations(self, info, fragment_ends):
+        """แทนความยาว track ด้วยค่าจาก fragment (moov ของ fMP4 ไม่มีความยาวจริง)"""
+        for track in info['tracks']:
+            end_time = fragment_ends.get(track['id'])
+            if end_time is not None and track['timescale']:
+                track['duration'] = end_time / track['timescale']
+        durations = [track['duration'] for track in info['tracks'] if track['duration']]
+        if durations:
+            info['duration'] = max(durations)
+
+    def _read_time_header(self, f, payload):
+        """อ่าน timescale/duration จาก mvhd หรือ mdhd"""
+        f.seek(payload)
+        version = self._read(f, 1)[0]
+        if version == 1:
+            f.seek(payload + 20)
+            return self._unpack(f, '>IQ')
+        f.seek(payload + 12)
+        return self._unpack(f, '>II')
+
+    def _read_stts(self, f, payload, track):
+        """รวมจำนวน sample จากตาราง stts"""
+        f.seek(payload + 4)
+        entry_count = self._unpack(f, '>I')[0]
+        data = self._read(f, entry_count * 8)
+        sample_count = 0
+        for index in range(0, len(data) - 7, 8):
+            count, _delta = struct.unpack_from('>II', data, index)
+            sample_count += count
+        track['sample_count'] = sample_count
+
+    def _read(self, f, size):
+        """อ่านให้ครบ size ไบต์ โยน Mp4ParseError ถ้าไฟล์สิ้นสุดก่อน (ไฟล์ถูกตัดหรือเสีย)"""
+        position = f.tell()
+        data = f.read(size)
+        if len(data) < size:
+            raise Mp4ParseError(f"ข้อมูลขาดที่ตำแหน่ง {position} (ต้องการ {size} ไบต์ ได้ {len(data)})")
+        return data
+
+    def _unpack(self, f, fmt):
+        return struct.unpack(fmt, self._read(f, struct.calcsize(fmt)))
+
+
+def verify_library(folder, tolerance=DEFAULT_DURATION_TOLERANCE):
+    """ตรวจสอบไฟล์ .mp4 ทั้งหมดในโฟลเดอร์ ส่งคืนรายการ (path, ผ่านหรือไม่, ปัญหา)"""
+    results = []
+    for current_dir, _dirs, files in os.walk(folder):
+        for name in sorted(files):
+            if not name.lower().endswith('.mp4'):
+                continue
+            path = os.path.join(current_dir, name)
+            ok, problems, _info = Mp4Inspector(path).verify(tolerance=tolerance)
+            results.append((path, ok, problems))
+    return results
+
+
+def main():
+    """ตรวจสอบไฟล์หรือโฟลเดอร์จาก command line"""
+    if len(sys.argv) < 2:
+        print("Usage: python mp4_inspector.py <file.mp4|folder>")
+        return 1
+
+    target = sys.argv[1]
+    if os.path.isdir(target):
+        results = verify_library(target)
+    else:
+        ok, problems, _info = Mp4Inspector(target).verify()
+        results = [(target, ok, problems)]
+
+    failed = 0
+    for path, ok, problems in results:
+        print(f"{'✅' if ok else '❌'} {path}")
+        for problem in problems:
+            print(f"   - {problem}")
+        failed += 0 if ok else 1
+
+    print(f"\n{len(results) - failed}/{len(results)} files OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
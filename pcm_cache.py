@@ -0,0 +1,281 @@
+"""
+Decoded PCM cache for Image Music Looper
+decode เพลงเป็น PCM float32 ครั้งเดียว เก็บเป็นไฟล์ WAV ใน cache แล้วเปิดด้วย numpy.memmap
+ทุกขั้นตอน (ตัดช่วงเงียบ, รูปคลื่น, ป้อนเสียงให้ encoder) อ่านหน้าเดียวกันโดยไม่ต้อง decode ซ้ำ
+"""
+
+import io
+import os
+import struct
+import subprocess
+
+from cache_utils import get_cache_dir, file_content_hash, make_temp_path
+
+# header WAV แบบ IEEE float 44 ไบต์ ข้อมูลเริ่มที่ offset ที่หารด้วย 4 ลงตัว
+# ทำให้ FFmpeg/MoviePy เปิดไฟล์ cache ได้โดยตรง
+WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+WAVE_FORMAT_IEEE_FLOAT = 3
+SAMPLE_BYTES = 4
+
+# ขนาดรวมสูงสุดของ cache (ไบต์) ลบไฟล์ที่ใช้ล่าสุดนานที่สุดก่อน
+PCM_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# ขนาดข้อมูลที่คัดลอกต่อครั้ง (ไบต์)
+COPY_CHUNK_BYTES = 4 * 1024 * 1024
+
+
+class PcmAudio:
+    """คลาสสำหรับเสียง PCM ที่ decode แล้ว (memmap ขนาด [frames, channels])"""
+
+    def __init__(self, path, sample_rate, channels, samples):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.samples = samples
+
+    @property
+    def frame_count(self):
+        return len(self.samples)
+
+    @property
+    def duration(self):
+        return self.frame_count / self.sample_rate if self.sample_rate else 0.0
+
+    @classmethod
+    def load_or_decode(cls, audio_path, max_bytes=PCM_CACHE_MAX_BYTES):
+        """เปิด PCM จาก cache ถ้ามี ไม่เช่นนั้น decode ด้วย FFmpeg แล้วเก็บไว้"""
+        pcm = cls.load_cached(audio_path)
+        if pcm is not None:
+            return pcm
+
+        cache_path = _cache_path(audio_path)
+        cls.decode(audio_path, cache_path)
+        evict_pcm_cache(max_bytes, keep=cache_path)
+        return cls.load(cache_path)
+
+    @classmethod
+    def load_cached(cls, audio_path):
+        """เปิด PCM จาก cache ถ้าเคย decode ไว้แล้ว ไม่เช่นนั้น None (ไม่ decode)"""
+        cache_path = _cache_path(audio_path)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            pcm = cls.load(cache_path)
+            # ใช้ mtime เป็นเวลาใช้งานล่าสุดสำหรับการลบไฟล์เก่า
+            os.utime(cache_path)
+            return pcm
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Invalid PCM cache {cache_path}, decoding again: {e}")
+            return None
+
+    @classmethod
+    def decode(cls, audio_path, cache_path):
+        """decode ไฟล์เสียงเป็น WAV float32 (เขียนไฟล์ชั่วคราวก่อนแล้ว rename)"""
+        cmd = ['ffmpeg', '-v', 'error', '-nostdin', '-i', audio_path,
+               '-vn', '-map_metadata', '-1', '-c:a', 'pcm_f32le', '-f', 'wav', '-']
+
+        temp_path = make_temp_path(cache_path)
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            sample_rate, channels = _read_wav_stream_header(process.stdout)
+            data_size = 0
+            with open(temp_path, 'wb') as f:
+                f.write(_wav_header(sample_rate, channels, 0))
+                for chunk in iter(lambda: process.stdout.read(COPY_CHUNK_BYTES), b''):
+                    f.write(chunk)
+                    data_size += len(chunk)
+                f.seek(0)
+                f.write(_wav_header(sample_rate, channels, data_size))
+        except (OSError, ValueError, struct.error):
+            _remove_quietly(temp_path)
+            raise RuntimeError(f"FFmpeg could not decode {audio_path}")
+        finally:
+            process.stdout.close()
+            process.wait()
+
+        if process.returncode != 0:
+            _remove_quietly(temp_path)
+            raise RuntimeError(f"FFmpeg could not decode {audio_path}")
+        try:
+            os.replace(temp_path, cache_path)
+        except OSError:
+            # thread/process อื่น decode ไฟล์เดียวกันเสร็จก่อน และไฟล์นั้นถูกเปิดอยู่ (Windows) ใช้ไฟล์นั้นแทน
+            _remove_quietly(temp_path)
+            if not os.path.exists(cache_path):
+                raise
+
+    @classmethod
+    def load(cls, path):
+        """เปิดไฟล์ WAV ใน cache ด้วย numpy.memmap (ไม่อ่านข้อมูลเข้าหน่วยความจำ)"""
+        import numpy as np
+
+        with open(path, 'rb') as f:
+            header = WAV_HEADER.unpack(f.read(WAV_HEADER.size))
+        (riff, _riff_size, wave, fmt, _fmt_size, format_tag, channels,
+         sample_rate, _byte_rate, _block_align, bits, data, _data_size) = header
+        if (riff, wave, fmt, data) != (b'RIFF', b'WAVE', b'fmt ', b'data') \
+                or format_tag != WAVE_FORMAT_IEEE_FLOAT or bits != SAMPLE_BYTES * 8 or not channels:
+            raise ValueError("not a PCM cache file")
+
+        # ความยาวคำนวณจากขนาดไฟล์ (ขนาดใน header จำกัดที่ 4 GB)
+        frames = (os.path.getsize(path) - WAV_HEADER.size) // (channels * SAMPLE_BYTES)
+        if frames <= 0:
+            raise ValueError("empty PCM cache file")
+        samples = np.memmap(path, dtype='<f4', mode='r', offset=WAV_HEADER.size, shape=(frames, channels))
+        return cls(path, sample_rate, channels, samples)
+
+    def frame_at(self, seconds):
+        """ตำแหน่ง frame ของเวลาที่กำหนด (จำกัดให้อยู่ในช่วงของไฟล์)"""
+        return min(max(int(round(seconds * self.sample_rate)), 0), self.frame_count)
+
+    def write_wav(self, target_path, start=0.0, end=None):
+        """เขียนช่วง [start, end) วินาทีเป็นไฟล์ WAV float32 โดยคัดลอกจาก memmap ทีละส่วน"""
+        first = self.frame_at(start)
+        last = self.frame_count if end is None else self.frame_at(end)
+        frames = self.samples[first:max(last, first)]
+
+        step = max(COPY_CHUNK_BYTES // (self.channels * SAMPLE_BYTES), 1)
+        with open(target_path, 'wb') as f:
+            f.write(_wav_header(self.sample_rate, self.channels, frames.nbytes))
+            for index in range(0, len(frames), step):
+                f.write(frames[index:index + step].tobytes())
+        return target_path
+
+
+def decode_range(audio_path, start=0.0, duration=None):
+    """decode เฉพาะช่วงเวลาที่กำหนดเข้าหน่วยความจำ (ไม่เก็บใน cache)
+
+    ส่งคืน (array float32 ขนาด [frames, channels], sample_rate)
+    """
+    import numpy as np
+
+    cmd = ['ffmpeg', '-v', 'error', '-nostdin']
+    if start:
+        cmd += ['-ss', f"{start:.6f}"]
+    cmd += ['-i', audio_path]
+    if duration:
+        cmd += ['-t', f"{duration:.6f}"]
+    cmd += ['-vn', '-map_metadata', '-1', '-c:a', 'pcm_f32le', '-f', 'wav', '-']
+
+    result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg could not decode {audio_path}")
+    stream = io.BytesIO(result.stdout)
+    try:
+        sample_rate, channels = _read_wav_stream_header(stream)
+    except struct.error:
+        raise ValueError("FFmpeg did not produce WAV data")
+    data = stream.read()
+    frame_bytes = channels * SAMPLE_BYTES
+    samples = np.frombuffer(data[:len(data) // frame_bytes * frame_bytes], dtype='<f4')
+    return samples.reshape(-1, channels), sample_rate
+
+
+def stream_range(audio_path, start=0.0, duration=None):
+    """decode ช่วงเวลาที่กำหนดแล้วอ่านทีละส่วน (ไม่เก็บทั้งช่วงไว้ในหน่วยความจำหรือ cache)
+
+    ส่งคืน (sample_rate, channels, iterator ของ array float32 ขนาด [frames, channels])
+    """
+    import numpy as np
+
+    # -ss หลัง -i: decode ตั้งแต่ต้นแล้วทิ้งส่วนหน้า ตรงทุก sample (seek ของ MP3 คลาดได้หลายสิบ ms)
+    cmd = ['ffmpeg', '-v', 'error', '-nostdin', '-i', audio_path]
+    if start:
+        cmd += ['-ss', f"{start:.6f}"]
+    if duration:
+        cmd += ['-t', f"{duration:.6f}"]
+    cmd += ['-vn', '-map_metadata', '-1', '-c:a', 'pcm_f32le', '-f', 'wav', '-']
+
+    process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        sample_rate, channels = _read_wav_stream_header(process.stdout)
+    except (OSError, ValueError, struct.error):
+        process.stdout.close()
+        process.wait()
+        raise RuntimeError(f"FFmpeg could not decode {audio_path}")
+
+    def chunks():
+        frame_bytes = channels * SAMPLE_BYTES
+        try:
+            pending = b''
+            for data in iter(lambda: process.stdout.read(COPY_CHUNK_BYTES), b''):
+                data = pending + data
+                usable = len(data) // frame_bytes * frame_bytes
+                pending = data[usable:]
+                if usable:
+                    yield np.frombuffer(data[:usable], dtype='<f4').reshape(-1, channels)
+        finally:
+            process.stdout.close()
+            process.wait()
+        if process.returncode != 0:
+            raise RuntimeError(f"FFmpeg could not decode {audio_path}")
+
+    return sample_rate, channels, chunks()
+
+
+def evict_pcm_cache(max_bytes=PCM_CACHE_MAX_BYTES, keep=None):
+    """ลบไฟล์ PCM ที่ไม่ได้ใช้นานที่สุดจนขนาดรวมไม่เกิน max_bytes"""
+    cache_dir = get_cache_dir("pcm")
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.wav'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if keep and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            # ไฟล์ที่ process อื่นเปิดอยู่ (Windows) ลบไม่ได้ ข้ามไป
+            pass
+
+
+def _cache_path(audio_path):
+    return os.path.join(get_cache_dir("pcm"), f"{file_content_hash(audio_path)}.wav")
+
+
+def _read_wav_stream_header(stream):
+    """อ่าน header WAV จาก pipe ของ FFmpeg จนถึง data chunk ส่งคืน (sample_rate, channels)"""
+    riff = stream.read(12)
+    if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        raise ValueError("FFmpeg did not produce WAV data")
+
+    sample_rate = channels = None
+    while True:
+        chunk_id, size = struct.unpack('<4sI', stream.read(8))
+        if chunk_id == b'data':
+            break
+        payload = stream.read(size + (size & 1))
+        if chunk_id == b'fmt ':
+            channels, sample_rate = struct.unpack_from('<HI', payload, 2)
+
+    if not sample_rate or not channels:
+        raise ValueError("WAV stream has no fmt chunk")
+    return sample_rate, channels
+
+
+def _wav_header(sample_rate, channels, data_size):
+    """header WAV 44 ไบต์สำหรับ PCM float32"""
+    block_align = channels * SAMPLE_BYTES
+    data_size = min(data_size, 0xFFFFFFFF - 36)
+    return WAV_HEADER.pack(b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, WAVE_FORMAT_IEEE_FLOAT,
+                           channels, sample_rate, sample_rate * block_align, block_align,
+                           SAMPLE_BYTES * 8, b'data', data_size)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Command-line renderer for Image Music Looper
+สร้างวิดีโอโดยไม่ต้องเปิดหน้าต่างโปรแกรม
+
+ตัวอย่าง: ส่ง fragmented MP4 ออกทาง stdout ให้โปรแกรมอัปโหลดอ่านต่อได้ทันที
+    python render_cli.py --image cover.jpg --audio song.mp3 --hours 4 --format fmp4 --output - | uploader
+
+สตรีม HLS ไม่สิ้นสุด (หยุดด้วย Ctrl+C):
+    python render_cli.py --image cover.jpg --audio song.mp3 --endless --output-folder stream
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import multiprocessing
+import tempfile
+
+from looper_engine import CustomImageMusicLooper, OUTPUT_FORMATS, VIDEO_QUALITY, DEFAULT_ASPECT_RATIO, DEFAULT_DURATION_HOURS
+from hls_stream import DEFAULT_WINDOW_SIZE
+from visualizer import VISUALIZER_STYLES
+
+
+def parse_args(argv=None):
+    """อ่าน argument จาก command line"""
+    parser = argparse.ArgumentParser(description="Render an Image Music Looper video without the GUI")
+    parser.add_argument('--image', required=True, help="background image")
+    parser.add_argument('--audio', required=True, help="audio file to loop")
+    parser.add_argument('--hours', type=float, default=DEFAULT_DURATION_HOURS, help="video length in hours")
+    parser.add_argument('--ratio', default=DEFAULT_ASPECT_RATIO, choices=sorted(VIDEO_QUALITY))
+    parser.add_argument('--format', default="mp4", choices=sorted(OUTPUT_FORMATS))
+    parser.add_argument('--output', help="output file, or '-' to stream to stdout")
+    parser.add_argument('--output-folder', default=os.getcwd(), help="folder for the default output name")
+    parser.add_argument('--no-trim', action='store_true', help="keep silence at the loop boundaries")
+    parser.add_argument('--endless', action='store_true',
+                        help="publish a never-ending HLS live playlist into <output-folder>/<name>_hls (Ctrl+C to stop)")
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW_SIZE, help="HLS segments kept in the live playlist")
+    parser.add_argument('--visualizer', choices=VISUALIZER_STYLES, help="overlay a spectrum bar or progress ring")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ฟังก์ชันหลัก"""
+    args = parse_args(argv)
+    streaming = args.output == "-"
+
+    # stdout เป็นของวิดีโอ ข้อความอื่นทั้งหมดต้องไปที่ stderr
+    if streaming:
+        sys.stdout = sys.stderr
+    work_folder = tempfile.mkdtemp(prefix="iml_") if streaming else args.output_folder
+
+    def report(value, message=""):
+        print(f"[{value:3.0f}%] {message}", file=sys.stderr)
+
+    looper = CustomImageMusicLooper(
+        image_file=args.image,
+        audio_file=args.audio,
+        output_folder=work_folder,
+        duration_hours=args.hours,
+        aspect_ratio=args.ratio,
+        crossfade_duration=0,
+        auto_crossfade=False,
+        keep_original=True,
+        trim_silence=not args.no_trim,
+        output_format=args.format,
+        output_file=args.output,
+        endless=args.endless,
+        hls_window_size=args.window,
+        visualizer=args.visualizer,
+        progress_callback=report
+    )
+
+    try:
+        success = looper.process()
+    except KeyboardInterrupt:
+        looper.cancel()
+        success = False
+    finally:
+        if streaming:
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+    for stage, detail in looper.trace:
+        print(f"[trace] {stage}: {detail}", file=sys.stderr)
+    if success and not streaming:
+        print(f"Output: {looper.output_video}", file=sys.stderr)
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+Incremental render extension for Image Music Looper
+ต่อหรือตัดความยาววิดีโอที่เคยสร้างไว้แล้ว (ภาพ/เพลง/การตั้งค่าเดียวกัน) ด้วย stream copy
+แทนการ encode ใหม่ทั้งหมด
+
+เสียง: คัดลอก frame AAC ของไฟล์เดิมเป็นช่วงยาว L frame ที่ใกล้เคียง M รอบของลูป แล้ววนต่อจนได้ความยาวที่ต้องการ
+ช่วงที่วนเริ่มหลัง frame priming ของ encoder และตอน mux ใส่ edit list ข้าม priming เหมือนไฟล์เดิม
+เสียงจึงตรงกับการ render ใหม่ทั้งไฟล์ทุก sample จนถึงจุดต่อแรก
+L frame มักไม่ได้ยาวเท่า M รอบพอดี ทุกจุดต่อเสียงจึงเลื่อนไปเล็กน้อย (slip)
+สลับใช้ช่วงที่ slip เป็นบวกและลบให้ slip สะสมอยู่ใกล้ศูนย์ ถ้าสะสมเกิน MAX_SPLICE_SLIP_SECONDS จะ render ใหม่
+ภาพ: เป็นภาพนิ่งทั้งไฟล์ (ไม่มี B-frame) จึงต่อไฟล์เดิมซ้ำด้วย concat demuxer แล้วตัดตรง frame ได้เลย
+
+manifest ของแต่ละไฟล์ผลลัพธ์ (settings_key, fingerprint, ความยาว, ความยาวลูป) อยู่ใน cache "renders"
+ใช้ทั้งหาไฟล์ต้นทางสำหรับต่อความยาว และหาไฟล์ของงานที่เหมือนกันเพื่อใช้ซ้ำ (render_outputs)
+"""
+
+import os
+import json
+import math
+import hashlib
+from array import array
+
+from cache_utils import get_cache_dir, file_content_hash, make_temp_path
+
+# เปลี่ยนค่านี้เมื่อวิธี render เปลี่ยนจนไฟล์เดิมใช้ต่อหรือใช้ซ้ำไม่ได้
+RENDER_SETTINGS_VERSION = 3
+
+# รูปแบบไฟล์ที่ต่อความยาวได้
+EXTENDABLE_FORMATS = ('mp4', 'fmp4')
+
+# จำนวน sample ต่อ frame ของ AAC-LC
+AAC_FRAME_SAMPLES = 1024
+
+# จำนวน sample ของ priming ที่ encoder AAC ของ FFmpeg ใส่ไว้ต้นไฟล์ (ไฟล์ mp4 ข้ามด้วย edit list)
+AAC_PRIMING_SAMPLES = 1024
+
+# เริ่มช่วงที่ใช้วนหลัง frame แรกๆ ที่มี priming ของ encoder
+SPLICE_START_FRAME = 2
+
+# ความคลาดเคลื่อนสูงสุดของเสียงเทียบกับการ render ใหม่ทั้งไฟล์ (วินาที) ทั้งที่แต่ละจุดต่อและที่สะสม
+# ถ้าหาช่วงที่ดีกว่านี้ไม่ได้จะ render ใหม่
+MAX_SPLICE_SLIP_SECONDS = 0.002
+
+# ความยาวสูงสุดของช่วงที่ใช้วน (วินาที) จำกัดปริมาณข้อมูลที่ต้องอ่านจากไฟล์เดิม
+MAX_SPLICE_UNIT_SECONDS = 3600
+
+# ขนาดข้อมูลที่คัดลอกต่อครั้งเมื่อเขียนเสียงที่ต่อแล้ว (ไบต์)
+COPY_CHUNK_BYTES = 4 * 1024 * 1024
+
+ADTS_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000,
+                     22050, 16000, 12000, 11025, 8000, 7350)
+
+
+def render_settings_key(image_path, audio_path, aspect_ratio, loop_bounds, output_format, crop_box=None,
+                        visualizer=None, audio_format=None):
+    """key ของการตั้งค่าที่มีผลต่อเนื้อหาวิดีโอ (ยกเว้นความยาว)
+
+    ไฟล์ที่ key ตรงกันต่างกันแค่ความยาว จึงต่อหรือตัดจากกันได้ด้วย stream copy
+    ไม่รวม backend (MoviePy/FFmpeg) ซึ่งเลือกตามหน่วยความจำที่ว่างตอน render
+    ทั้งสองได้ภาพ/เสียงเดียวกัน งานเดียวกันจึงได้ key เดียวกันเสมอ
+    """
+    bounds = f"{loop_bounds['start']:.6f}-{loop_bounds['end']:.6f}" if loop_bounds else "full"
+    audio = "x".join(str(value) for value in audio_format) if audio_format else "source"
+    key = ":".join([str(RENDER_SETTINGS_VERSION), file_content_hash(image_path), file_content_hash(audio_path),
+                    aspect_ratio, bounds, output_format, str(crop_box), str(visualizer), audio])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def render_fingerprint(settings_key, duration_seconds):
+    """fingerprint ของงาน: การตั้งค่าทั้งหมดรวมความยาว (งานที่ fingerprint ตรงกันได้วิดีโอเดียวกัน)"""
+    return hashlib.sha1(f"{settings_key}:{duration_seconds}".encode()).hexdigest()
+
+
+def _manifest_path(output_path):
+    name = hashlib.sha1(os.path.abspath(output_path).encode()).hexdigest()
+    return os.path.join(get_cache_dir("renders"), f"{name}.json")
+
+
+def load_render_manifest(output_path):
+    """อ่านข้อมูลการ render ของไฟล์ผลลัพธ์ ส่งคืน None ถ้าไม่มีหรือไฟล์ถูกแก้ไขไปแล้ว"""
+    try:
+        with open(_manifest_path(output_path), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        stat = os.stat(output_path)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('size') != stat.st_size or manifest.get('mtime_ns') != stat.st_mtime_ns:
+        return None
+    return manifest
+
+
+def save_render_manifest(output_path, settings_key, fingerprint, duration_seconds, loop_samples=None,
+                         sample_rate=None):
+    """บันทึกข้อมูลการ render เพื่อใช้ไฟล์ซ้ำหรือต่อความยาวครั้งถัดไป
+
+    loop_samples/sample_rate เป็น None ได้ (อ่านเสียงไม่ได้) ไฟล์นั้นใช้ซ้ำได้แต่ต่อความยาวไม่ได้
+    """
+    stat = os.stat(output_path)
+    manifest = {
+        'path': os.path.abspath(output_path),
+        'settings_key': settings_key,
+        'fingerprint': fingerprint,
+        'duration_seconds': duration_seconds,
+        'loop_samples': loop_samples,
+        'sample_rate': sample_rate,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+    }
+    path = _manifest_path(output_path)
+    temp_path = make_temp_path(path)
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, path)
+
+
+def find_render_manifests(fingerprint=None, settings_key=None):
+    """manifest ของไฟล์ผลลัพธ์ที่ยังไม่ถูกแก้ไข ซึ่ง fingerprint/settings_key ตรงกับที่ระบุ"""
+    cache_dir = get_cache_dir("renders")
+    manifests = []
+    for name in sorted(os.listdir(cache_dir)):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(cache_dir, name), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if fingerprint is not None and entry.get('fingerprint') != fingerprint:
+            continue
+        if settings_key is not None and entry.get('settings_key') != settings_key:
+            continue
+        manifest = load_render_manifest(entry['path']) if entry.get('path') else None
+        if manifest == entry:
+            manifests.append(manifest)
+    return manifests
+
+
+def choose_splice_units(loop_samples, sample_rate, available_seconds):
+    """หาจำนวน frame AAC (L) ที่ยาวใกล้เคียง M รอบของลูปมากที่สุด
+
+    ส่งคืนรายการ (L, slip เป็น sample) ที่ใช้วนสลับกัน หรือ None ถ้าไม่มีช่วงที่คลาดเคลื่อนน้อยพอ
+    ถ้ามี L ที่ยาวเท่า M รอบพอดีจะมีช่วงเดียว ไม่เช่นนั้นมีช่วงที่ slip เป็นลบและบวกอย่างละไม่เกินหนึ่งช่วง
+    """
+    if loop_samples <= 0:
+        return None
+    limit = min(available_seconds, MAX_SPLICE_UNIT_SECONDS) * sample_rate
+    limit -= (SPLICE_START_FRAME + 1) * AAC_FRAME_SAMPLES
+    max_slip = MAX_SPLICE_SLIP_SECONDS * sample_rate
+
+    shorter = longer = None
+    for periods in range(1, int(limit // loop_samples) + 1):
+        unit_frames = periods * loop_samples // AAC_FRAME_SAMPLES
+        slip = unit_frames * AAC_FRAME_SAMPLES - periods * loop_samples
+        if slip == 0:
+            return [(unit_frames, 0)]
+        if unit_frames and -slip <= max_slip and (shorter is None or slip > shorter[1]):
+            shorter = (unit_frames, slip)
+        slip += AAC_FRAME_SAMPLES
+        if slip <= max_slip and (unit_frames + 1) * AAC_FRAME_SAMPLES <= limit and \
+                (longer is None or slip < longer[1]):
+            longer = (unit_frames + 1, slip)
+
+    units = [unit for unit in (shorter, longer) if unit]
+    return units or None
+
+
+def splice_plan(units, total_frames, frame_count=0):
+    """ลำดับช่วง frame [start, end) ของไฟล์เดิมที่ต่อกันได้เสียงยาว total_frames
+
+    ส่งคืน (ช่วง frame, slip สะสมที่มากที่สุดเป็น sample)
+    ช่วงแรกเริ่มที่ frame 0 ช่วงถัดไปเริ่มที่ SPLICE_START_FRAME ทุกครั้ง
+    ก่อนแต่ละจุดต่อเลือกช่วงที่ทำให้ slip สะสมใกล้ศูนย์ที่สุด
+    ถ้าไฟล์เดิมมีอย่างน้อย total_frames frame (frame_count) ใช้แค่ส่วนต้นไฟล์
+    """
+    if total_frames <= frame_count:
+        return [(0, total_frames)], 0
+
+    plan = []
+    start = written = lag = max_lag = 0
+    while True:
+        unit_frames, slip = min(units, key=lambda unit: abs(lag + unit[1]))
+        end = SPLICE_START_FRAME + unit_frames
+        if written + end - start >= total_frames:
+            plan.append((start, start + total_frames - written))
+            return plan, max_lag
+        plan.append((start, end))
+        written += end - start
+        lag += slip
+        max_lag = max(max_lag, abs(lag))
+        start = SPLICE_START_FRAME
+
+
+def read_adts_frames(path):
+    """อ่านตำแหน่งของทุก frame ในไฟล์ ADTS ส่งคืน (sample_rate, offsets)
+
+    offsets มีตำแหน่งเริ่มของทุก frame และตำแหน่งสิ้นสุดของไฟล์ต่อท้าย
+    อ่านเฉพาะ header 7 ไบต์ของแต่ละ frame ไม่โหลดข้อมูลเสียงเข้าหน่วยความจำ
+    """
+    offsets = array('q')
+    sample_rate = None
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        position = 0
+        while position + 7 <= file_size:
+            f.seek(position)
+            header = f.read(7)
+            if header[0] != 0xFF or (header[1] & 0xF6) != 0xF0:
+                raise ValueError(f"ADTS sync lost at byte {position}")
+            if (header[6] & 0x03) != 0:
+                raise ValueError("ADTS frames with several raw data blocks are not supported")
+            if sample_rate is None:
+                sample_rate = ADTS_SAMPLE_RATES[(header[2] >> 2) & 0x0F]
+            length = ((header[3] & 0x03) << 11) | (header[4] << 3) | (header[5] >> 5)
+            if length < 7:
+                raise ValueError(f"Invalid ADTS frame length at byte {position}")
+            offsets.append(position)
+            position += length
+
+    offsets.append(min(position, file_size))
+    return sample_rate, offsets
+
+
+def write_spliced_adts(source_path, offsets, units, total_frames, target_path, check_cancelled=None):
+    """เขียน ADTS ความยาว total_frames ตาม splice_plan: ต้นไฟล์เดิม แล้ววนช่วงที่เริ่มที่ SPLICE_START_FRAME
+
+    คัดลอกทีละ COPY_CHUNK_BYTES จากไฟล์ต้นทาง ใช้หน่วยความจำคงที่ไม่ว่าวิดีโอจะยาวเท่าไร
+    """
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as out:
+        plan, _max_lag = splice_plan(units, total_frames, len(offsets) - 1)
+        for start, end in plan:
+            _copy_range(source, out, offsets[start], offsets[end], check_cancelled)
+
+
+def _copy_range(source, out, start, end, check_cancelled=None):
+    """คัดลอกไบต์ [start, end) ของไฟล์ต้นทางทีละส่วน"""
+    source.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        if check_cancelled:
+            check_cancelled()
+        chunk = source.read(min(COPY_CHUNK_BYTES, remaining))
+        if not chunk:
+            raise ValueError("ADTS source ended early")
+        out.write(chunk)
+        remaining -= len(chunk)
+
+
+def aac_frames_for(duration_seconds, sample_rate):
+    """จำนวน frame AAC ที่ต้องใช้ให้ครอบคลุมความยาว (รวม frame priming)"""
+    return math.ceil(duration_seconds * sample_rate / AAC_FRAME_SAMPLES) + 1
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Distributed rendering for Image Music Looper
+coordinator แจกงาน (spec ของ CustomImageMusicLooper) ให้ worker หลายเครื่องผ่าน TCP
+โปรโตคอลเป็น JSON หนึ่งบรรทัดต่อข้อความ worker ของานเองเมื่อว่าง รายงานความคืบหน้าและผลกลับมา
+งานที่ล้มเหลวหรือ worker หลุดระหว่างทำ จะถูกส่งให้ worker ตัวอื่นทำใหม่
+
+ทุกเครื่องต้องเห็นไฟล์ภาพ/เพลง/โฟลเดอร์ผลลัพธ์ที่ path เดียวกัน (เช่น network drive)
+และใช้ cache ร่วมกันผ่าน --cache-dir (ส่งให้ worker เป็น IML_CACHE_DIR)
+
+ตัวอย่าง:
+    python render_farm.py coordinator --jobs jobs.json --port 8765 --cache-dir //nas/iml_cache
+    python render_farm.py worker --host 192.168.1.10 --port 8765
+
+jobs.json เป็นรายการ spec เช่น
+    [{"image_file": "cover.jpg", "audio_file": "song.mp3", "output_folder": "out", "duration_hours": 4}]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+import socketserver
+
+from cache_utils import CACHE_DIR_ENV
+from admission import AdmissionScheduler
+
+DEFAULT_PORT = 8765
+
+# จำนวนครั้งสูงสุดที่ทำงานเดียวกันก่อนถือว่าล้มเหลว
+DEFAULT_MAX_ATTEMPTS = 3
+
+# worker ที่ยังไม่มีงานให้ทำจะถามใหม่ทุกกี่วินาที
+WAIT_SECONDS = 1.0
+
+# ถ้าไม่มี worker เชื่อมต่ออยู่เลยนานเท่านี้ (วินาที) งานที่เหลือถือว่าล้มเหลว
+DEFAULT_WORKER_TIMEOUT = 300
+
+# ค่าเริ่มต้นของ spec (เหมือน render_cli)
+JOB_DEFAULTS = {
+    'duration_hours': 1,
+    'aspect_ratio': "16:9",
+    'crossfade_duration': 0,
+    'auto_crossfade': False,
+    'keep_original': True,
+    'trim_silence': True,
+    'output_format': "mp4",
+}
+
+# key ที่ไม่ใช่ argument ของ CustomImageMusicLooper หรือไม่รองรับในโหมดนี้
+UNSUPPORTED_JOB_KEYS = ('progress_callback', 'events', 'scheduler', 'endless')
+
+
+class FarmJob:
+    """สถานะของงานหนึ่งงานใน coordinator"""
+
+    def __init__(self, job_id, spec):
+        self.job_id = job_id
+        self.spec = dict(JOB_DEFAULTS, **spec)
+        self.state = "pending"       # pending, running, done, failed
+        self.attempts = 0
+        self.failed_workers = set()
+        self.worker = None
+        self.progress = 0
+        self.output = None
+        self.error = None
+        self.trace = []
+
+
+class RenderCoordinator:
+    """คลาสสำหรับแจกงานให้ worker และรวบรวมผล"""
+
+    def __init__(self, specs, host="0.0.0.0", port=DEFAULT_PORT, cache_dir=None,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, progress_callback=None,
+                 worker_timeout=DEFAULT_WORKER_TIMEOUT):
+        for spec in specs:
+            unsupported = [key for key in UNSUPPORTED_JOB_KEYS if key in spec]
+            if unsupported:
+                raise ValueError(f"Unsupported job option: {', '.join(unsupported)}")
+            if 'image_file' not in spec or 'audio_file' not in spec or 'output_folder' not in spec:
+                raise ValueError("Each job needs image_file, audio_file and output_folder")
+
+        self.jobs = [FarmJob(index, spec) for index, spec in enumerate(specs)]
+        self.cache_dir = cache_dir
+        self.max_attempts = max(int(max_attempts), 1)
+        self.worker_timeout = worker_timeout
+        self.progress_callback = progress_callback
+        self.workers = set()
+        self.condition = threading.Condition()
+
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                coordinator._serve_worker(self)
+
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler, bind_and_activate=False)
+        self.server.daemon_threads = True
+        self.server.allow_reuse_address = True
+        self.server.server_bind()
+        self.server.server_activate()
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    @property
+    def finished(self):
+        return all(job.state in ("done", "failed") for job in self.jobs)
+
+    def run(self):
+        """รับ worker จนงานทั้งหมดเสร็จ ส่งคืนรายการ FarmJob
+
+        ถ้าไม่มี worker เชื่อมต่ออยู่เลยนาน worker_timeout วินาที (ตั้งแต่เริ่มหรือหลัง worker ตัวสุดท้ายหลุด)
+        งานที่ยังไม่เสร็จจะถูกตั้งเป็นล้มเหลว worker_timeout=None รอไปเรื่อยๆ
+        """
+        server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        server_thread.start()
+        try:
+            with self.condition:
+                idle_since = time.monotonic()
+                while not self.finished:
+                    if self.workers or self.worker_timeout is None:
+                        idle_since = time.monotonic()
+                        self.condition.wait()
+                        continue
+                    remaining = idle_since + self.worker_timeout - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            if not self.finished:
+                self._fail_unfinished(f"no worker connected for {self.worker_timeout} seconds")
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+        return self.jobs
+
+    def _serve_worker(self, handler):
+        """คุยกับ worker หนึ่งตัวจนกว่าจะตัดการเชื่อมต่อ"""
+        worker = f"{handler.client_address[0]}:{handler.client_address[1]}"
+        current = None
+        with self.condition:
+            self.workers.add(worker)
+            self.condition.notify_all()
+        try:
+            for line in handler.rfile:
+                message = json.loads(line)
+                kind = message.get('type')
+
+                if kind == "hello":
+                    worker_name = message.get('worker')
+                    if worker_name:
+                        with self.condition:
+                            self.workers.discard(worker)
+                            worker = f"{worker_name}@{worker}"
+                            self.workers.add(worker)
+
+                elif kind == "request":
+                    current = self._next_job(worker)
+                    if current is None:
+                        reply = {'type': "shutdown"} if self.finished else {'type': "wait", 'seconds': WAIT_SECONDS}
+                    else:
+                        reply = {'type': "job", 'job': current.job_id, 'spec': current.spec,
+                                 'cache_dir': self.cache_dir}
+                    handler.wfile.write((json.dumps(reply) + "\n").encode())
+                    if reply['type'] == "shutdown":
+                        break
+
+                elif kind == "progress" and current is not None:
+                    current.progress = message.get('value', 0)
+                    self._report(current, message.get('message', ""))
+
+                elif kind == "result" and current is not None:
+                    current.trace = message.get('trace', [])
+                    self._finish_job(current, worker, message.get('success'),
+                                     message.get('output'), message.get('error'))
+                    current = None
+        except (OSError, ValueError) as e:
+            print(f"Worker {worker} connection error: {e}")
+        finally:
+            with self.condition:
+                self.workers.discard(worker)
+                self.condition.notify_all()
+            if current is not None:
+                # worker หลุดระหว่างทำงาน ให้ worker อื่นทำแทน
+                self._finish_job(current, worker, False, None, "worker disconnected")
+
+    def _next_job(self, worker):
+        """เลือกงานถัดไปให้ worker (หลีกเลี่ยงงานที่ worker นี้เคยทำไม่สำเร็จ)"""
+        with self.condition:
+            pending = [job for job in self.jobs if job.state == "pending"]
+            for job in pending:
+                if worker not in job.failed_workers:
+                    break
+            else:
+                # ทุกงานที่เหลือเคยล้มเหลวบน worker นี้ ให้ทำได้ก็ต่อเมื่อไม่มี worker อื่นที่ยังไม่เคยลอง
+                job = next((job for job in pending
+                            if not (self.workers - job.failed_workers - {worker})), None)
+                if job is None:
+                    return None
+
+            job.state = "running"
+            job.worker = worker
+            job.attempts += 1
+            job.progress = 0
+        self._report(job, f"เริ่มงานบน {worker} (ครั้งที่ {job.attempts})")
+        return job
+
+    def _finish_job(self, job, worker, success, output, error):
+        with self.condition:
+            if success:
+                job.state = "done"
+                job.output = output
+                job.progress = 100
+            else:
+                job.failed_workers.add(worker)
+                job.error = error or "render failed"
+                job.state = "failed" if job.attempts >= self.max_attempts else "pending"
+            job.worker = None
+            self.condition.notify_all()
+
+        if success:
+            self._report(job, f"เสร็จสิ้น: {output}")
+        else:
+            retry = "จะลองใหม่บน worker อื่น" if job.state == "pending" else "ล้มเหลว"
+            self._report(job, f"{worker}: {job.error} ({retry})")
+
+    def _fail_unfinished(self, error):
+        """ตั้งงานที่ยังไม่เสร็จทั้งหมดเป็นล้มเหลว (ไม่มี worker เหลือให้ทำ)"""
+        with self.condition:
+            unfinished = [job for job in self.jobs if job.state not in ("done", "failed")]
+            for job in unfinished:
+                job.state = "failed"
+                job.error = error
+                job.worker = None
+            self.condition.notify_all()
+        for job in unfinished:
+            self._report(job, f"{error} (ล้มเหลว)")
+
+    def _report(self, job, message):
+        if self.progress_callback:
+            self.progress_callback(job, message)
+
+
+class RenderWorker:
+    """คลาสสำหรับ worker ที่รับงานจาก coordinator มาทำ
+
+    slots: จำนวนงานที่รับพร้อมกัน (แต่ละ slot เป็น connection แยก) งานเริ่มจริงเมื่อ
+    AdmissionScheduler ที่ใช้ร่วมกันเห็นว่าหน่วยความจำและ CPU ของเครื่องยังพอ
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, name=None, slots=1):
+        self.host = host
+        self.port = port
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.slots = max(int(slots), 1)
+        self.scheduler = AdmissionScheduler()
+        self.current_loopers = set()
+        self.stopped = False
+        self._lock = threading.Lock()
+
+    def stop(self):
+        """หยุดรับงานใหม่และยกเลิกงานที่ทำอยู่"""
+        self.stopped = True
+        with self._lock:
+            loopers = list(self.current_loopers)
+        for looper in loopers:
+            looper.cancel()
+
+    def run(self):
+        """ขอ ทำ และรายงานงานจนกว่า coordinator จะสั่งหยุด ส่งคืนจำนวนงานที่ทำสำเร็จ"""
+        if self.slots == 1:
+            return self._run_slot(self.name)
+
+        completed = []
+        threads = [threading.Thread(target=lambda slot=slot: completed.append(self._run_slot(f"{self.name}/{slot}")),
+                                    daemon=True) for slot in range(1, self.slots + 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(completed)
+
+    def _run_slot(self, name):
+        """connection หนึ่งเส้นที่ทำงานทีละงาน"""
+        completed = 0
+        send_lock = threading.Lock()
+        with socket.create_connection((self.host, self.port)) as connection:
+            reader = connection.makefile('r', encoding='utf-8')
+            writer = connection.makefile('wb')
+
+            def send(message):
+                with send_lock:
+                    writer.write((json.dumps(message) + "\n").encode())
+                    writer.flush()
+
+            send({'type': "hello", 'worker': name})
+            while not self.stopped:
+                send({'type': "request"})
+                line = reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+
+                if message['type'] == "shutdown":
+                    break
+                if message['type'] == "wait":
+                    time.sleep(message.get('seconds', WAIT_SECONDS))
+                    continue
+
+                success, output, error, trace = self._run_job(message['spec'], message.get('cache_dir'), send)
+                send({'type': "result", 'job': message['job'], 'success': success,
+                      'output': output, 'error': error, 'trace': trace})
+                completed += 1 if success else 0
+        return completed
+
+    def _run_job(self, spec, cache_dir, send):
+        """ทำงานหนึ่งงาน ส่งคืน (สำเร็จหรือไม่, ไฟล์ผลลัพธ์, ข้อความข้อผิดพลาด, trace)"""
+        from looper_engine import CustomImageMusicLooper
+
+        if cache_dir:
+            os.environ[CACHE_DIR_ENV] = cache_dir
+
+        def report(value, message=""):
+            send({'type': "progress", 'value': value, 'message': message})
+
+        trace = []
+        looper = None
+        try:
+            os.makedirs(spec['output_folder'], exist_ok=True)
+            looper = CustomImageMusicLooper(progress_callback=report, scheduler=self.scheduler, **spec)
+            with self._lock:
+                self.current_loopers.add(looper)
+            if self.stopped:
+                looper.cancel()
+            trace = looper.trace
+            success = looper.process()
+            return bool(success), looper.output_video, None if success else "render failed", trace
+        except Exception as e:
+            return False, None, str(e), trace
+        finally:
+            with self._lock:
+                self.current_loopers.discard(looper)
+
+
+def _run_local_worker(host, port, name):
+    """(ทำงานใน process แยก) worker บนเครื่องเดียวกับ coordinator"""
+    try:
+        RenderWorker(host, port, name).run()
+    except KeyboardInterrupt:
+        pass
+
+
+def parse_args(argv=None):
+    """อ่าน argument จาก command line"""
+    parser = argparse.ArgumentParser(description="Distribute Image Music Looper renders over several workers")
+    modes = parser.add_subparsers(dest='mode', required=True)
+
+    coordinator = modes.add_parser('coordinator', help="hand out jobs and collect results")
+    coordinator.add_argument('--jobs', required=True, help="JSON file with a list of job specs")
+    coordinator.add_argument('--host', default="0.0.0.0")
+    coordinator.add_argument('--port', type=int, default=DEFAULT_PORT)
+    coordinator.add_argument('--cache-dir', help=f"shared cache folder passed to workers as {CACHE_DIR_ENV}")
+    coordinator.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+    coordinator.add_argument('--worker-timeout', type=float, default=DEFAULT_WORKER_TIMEOUT,
+                             help="fail the remaining jobs when no worker has been connected for this many seconds")
+    coordinator.add_argument('--local-workers', type=int, default=0,
+                             help="also start this many worker processes on this machine")
+
+    worker = modes.add_parser('worker', help="pull jobs from a coordinator")
+    worker.add_argument('--host', required=True)
+    worker.add_argument('--port', type=int, default=DEFAULT_PORT)
+    worker.add_argument('--name', help="worker name shown in the coordinator log")
+    worker.add_argument('--slots', type=int, default=1,
+                        help="jobs to take at once (started only while memory and CPU allow)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ฟังก์ชันหลัก"""
+    args = parse_args(argv)
+
+    if args.mode == "worker":
+        worker = RenderWorker(args.host, args.port, args.name, args.slots)
+        try:
+            print(f"Completed {worker.run()} jobs")
+        except KeyboardInterrupt:
+            worker.stop()
+            return 1
+        return 0
+
+    with open(args.jobs, 'r', encoding='utf-8') as f:
+        specs = json.load(f)
+
+    def report(job, message):
+        print(f"[job {job.job_id} {job.progress:3.0f}%] {message}")
+
+    coordinator = RenderCoordinator(specs, args.host, args.port, cache_dir=args.cache_dir,
+                                    max_attempts=args.max_attempts, progress_callback=report,
+                                    worker_timeout=args.worker_timeout)
+    host = "127.0.0.1" if args.host in ("0.0.0.0", "") else args.host
+    local_workers = [multiprocessing.Process(target=_run_local_worker,
+                                             args=(host, coordinator.address[1], f"local{index}"))
+                     for index in range(args.local_workers)]
+    for process in local_workers:
+        process.start()
+
+    try:
+        jobs = coordinator.run()
+    finally:
+        for process in local_workers:
+            process.join(timeout=WAIT_SECONDS * 5)
+            if process.is_alive():
+                process.terminate()
+
+    failed = [job for job in jobs if job.state != "done"]
+    for job in jobs:
+        print(f"job {job.job_id}: {job.state} {job.output or job.error}")
+        for stage, detail in job.trace:
+            print(f"    {stage}: {detail}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
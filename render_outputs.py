@@ -0,0 +1,138 @@
+"""
+Output naming and reuse for Image Music Looper
+ทุกงานมี fingerprint (render_extend.render_fingerprint) จากเนื้อหาภาพ/เพลงและการตั้งค่าที่มีผลต่อวิดีโอทั้งหมด
+fingerprint ถูกเขียนลง metadata ของไฟล์และบันทึกใน render manifest เดียวกับที่ใช้ต่อความยาว
+งานที่เหมือนกันทุกอย่างจะได้ไฟล์เดิมทันที (hardlink หรืออ้างถึงไฟล์เดิม) ไม่ต้อง render ใหม่
+
+ไฟล์ผลลัพธ์ถูกเขียนในโฟลเดอร์ชั่วคราวข้างไฟล์ปลายทางก่อน แล้วย้ายเข้าที่ด้วย link/rename ครั้งเดียว
+ชื่อปกติ (<เพลง>_music_loop.mp4) ใช้ได้ถ้าว่างหรือเป็นไฟล์ของงานเดียวกัน
+ไม่เช่นนั้น (รวมงานที่ต่างกันแค่ความยาว) จะเติม 8 ตัวแรกของ fingerprint ต่อท้ายชื่อ
+และใช้ fingerprint เต็มถ้าชื่อนั้นก็ถูกใช้แล้ว ไฟล์ของงานอื่นจึงไม่ถูกเขียนทับ
+"""
+
+import os
+import shutil
+
+from cache_utils import make_temp_path
+from render_extend import load_render_manifest, save_render_manifest, find_render_manifests
+
+# จำนวนตัวอักษรของ fingerprint ที่ต่อท้ายชื่อไฟล์เมื่อชื่อปกติถูกงานอื่นใช้อยู่
+NAME_SUFFIX_LENGTH = 8
+
+# ค่า comment ใน metadata ของไฟล์ผลลัพธ์: "<prefix><fingerprint>"
+METADATA_PREFIX = "image-music-looper job "
+
+
+def suffixed_path(path, fingerprint, length=NAME_SUFFIX_LENGTH):
+    """ชื่อไฟล์ที่เติม fingerprint ต่อท้าย เช่น song_music_loop_1a2b3c4d.mp4"""
+    stem, extension = os.path.splitext(path)
+    return f"{stem}_{fingerprint[:length]}{extension}"
+
+
+def metadata_comment(fingerprint):
+    return f"{METADATA_PREFIX}{fingerprint}"
+
+
+def find_identical_output(fingerprint):
+    """path ของไฟล์ที่สร้างจากงานเดียวกันและยังไม่ถูกแก้ไข หรือ None"""
+    manifests = find_render_manifests(fingerprint=fingerprint)
+    return manifests[0]['path'] if manifests else None
+
+
+def choose_output_path(preferred_path, fingerprint):
+    """ชื่อที่งานนี้ควรใช้: ชื่อแรกที่ว่างหรือเป็นไฟล์ของงานเดียวกัน"""
+    candidates = _candidate_paths(preferred_path, fingerprint)
+    for path in candidates:
+        if not os.path.exists(path) or _owned_by(path, fingerprint):
+            return path
+    return candidates[-1]
+
+
+def publish_output(temp_path, preferred_path, fingerprint, exclusive=True):
+    """ย้ายไฟล์ที่เขียนเสร็จแล้วเข้าที่ด้วยการ link/rename ครั้งเดียว ส่งคืน path สุดท้าย
+
+    temp_path ต้องอยู่ในระบบไฟล์เดียวกับ preferred_path (rename ข้าม drive ไม่ได้)
+    exclusive=False: ผู้ใช้ระบุชื่อไฟล์เอง เขียนทับไฟล์เดิมเสมอ
+    ไม่เช่นนั้นจะไม่ทับไฟล์ของงานอื่น แม้งานอื่นสร้างชื่อนั้นระหว่างที่งานนี้ render อยู่
+    """
+    if not exclusive:
+        os.replace(temp_path, preferred_path)
+        return preferred_path
+
+    candidates = _candidate_paths(preferred_path, fingerprint)
+    for path in candidates[:-1]:
+        if os.path.exists(path) and _owned_by(path, fingerprint):
+            os.replace(temp_path, path)
+            return path
+        try:
+            _move_exclusive(temp_path, path)
+            return path
+        except FileExistsError:
+            continue
+    # ชื่อที่มี fingerprint เต็มเป็นของงานนี้เท่านั้น
+    os.replace(temp_path, candidates[-1])
+    return candidates[-1]
+
+
+def link_output(existing_path, target_path, copy=False):
+    """ให้ target_path เป็นไฟล์เดียวกับ existing_path ด้วย hardlink (พร้อม manifest สำหรับต่อความยาว)
+
+    ถ้า link ไม่ได้ (ต่าง drive หรือระบบไฟล์ไม่รองรับ) คัดลอกไฟล์เมื่อ copy=True
+    ไม่เช่นนั้นส่งคืน existing_path แทน target_path
+    """
+    if os.path.abspath(existing_path) == os.path.abspath(target_path):
+        return existing_path
+    # link ไว้แล้วจากครั้งก่อน (rename ทับไฟล์เดียวกันจะไม่ทำอะไรเลย)
+    if not (os.path.exists(target_path) and os.path.samefile(existing_path, target_path)):
+        temp_path = make_temp_path(target_path, ".link")
+        try:
+            try:
+                # link สร้างชื่อใหม่เท่านั้น ลบไฟล์เปล่าที่จองชื่อไว้ก่อน
+                os.remove(temp_path)
+                os.link(existing_path, temp_path)
+            except OSError:
+                if not copy:
+                    raise
+                shutil.copyfile(existing_path, temp_path)
+            os.replace(temp_path, target_path)
+        except OSError:
+            _remove_quietly(temp_path)
+            return existing_path
+
+    manifest = load_render_manifest(existing_path)
+    if manifest:
+        save_render_manifest(target_path, manifest['settings_key'], manifest['fingerprint'],
+                             manifest['duration_seconds'], manifest['loop_samples'], manifest['sample_rate'])
+    return target_path
+
+
+def _candidate_paths(preferred_path, fingerprint):
+    return [preferred_path, suffixed_path(preferred_path, fingerprint), suffixed_path(preferred_path, fingerprint, None)]
+
+
+def _owned_by(path, fingerprint):
+    """ไฟล์ที่ path สร้างจากงานนี้ (ไฟล์ที่ไม่รู้ที่มาถือว่าเป็นของงานอื่น)"""
+    manifest = load_render_manifest(path)
+    return manifest is not None and manifest.get('fingerprint') == fingerprint
+
+
+def _move_exclusive(temp_path, path):
+    """ย้ายไฟล์ไปที่ path เฉพาะเมื่อยังไม่มีไฟล์ชื่อนั้น (โยน FileExistsError ถ้ามีแล้ว)"""
+    try:
+        # link สร้างชื่อใหม่แบบ atomic และล้มเหลวถ้าชื่อนั้นมีอยู่แล้ว
+        os.link(temp_path, path)
+    except FileExistsError:
+        raise
+    except OSError:
+        # ระบบไฟล์ไม่รองรับ hardlink: จองชื่อด้วยไฟล์เปล่าก่อน แล้ว rename ทับ
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        os.replace(temp_path, path)
+        return
+    os.remove(temp_path)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,26 @@
+"""
+Shared fixtures for the Image Music Looper tests
+รันจากโฟลเดอร์หลักของโปรเจกต์: python -m pytest -q
+"""
+
+import os
+import sys
+import shutil
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from cache_utils import CACHE_DIR_ENV
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="FFmpeg is not on PATH")
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """cache แยกต่อ test (ส่งต่อให้ process ลูกผ่าน IML_CACHE_DIR)"""
+    path = tmp_path / "cache"
+    monkeypatch.setenv(CACHE_DIR_ENV, str(path))
+    return str(path)
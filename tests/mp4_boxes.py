@@ -0,0 +1,30 @@
+"""สร้าง box ของ MP4 เป็น bytes สำหรับไฟล์ทดสอบ"""
+
+import struct
+
+
+def box(box_type, *children):
+    payload = b"".join(children)
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, version, flags, *children):
+    return box(box_type, struct.pack('>I', (version << 24) | flags), *children)
+
+
+def track(track_id, handler, codec, timescale, duration, samples=((1, 0),)):
+    stts = struct.pack('>I', len(samples)) + b"".join(struct.pack('>II', count, delta) for count, delta in samples)
+    return box(b'trak',
+               full_box(b'tkhd', 0, 3, struct.pack('>III', 0, 0, track_id), bytes(72)),
+               box(b'mdia',
+                   full_box(b'mdhd', 0, 0, struct.pack('>IIII', 0, 0, timescale, duration), bytes(4)),
+                   full_box(b'hdlr', 0, 0, bytes(4), handler, bytes(13)),
+                   box(b'minf', box(b'stbl',
+                                    full_box(b'stsd', 0, 0, struct.pack('>I', 1), struct.pack('>I', 16), codec,
+                                             bytes(8)),
+                                    full_box(b'stts', 0, 0, stts)))))
+
+
+def movie(timescale, duration, tracks, extra=b""):
+    return box(b'moov', full_box(b'mvhd', 0, 0, struct.pack('>IIII', 0, 0, timescale, duration), bytes(80)),
+               *tracks, extra)
@@ -0,0 +1,183 @@
+"""ทดสอบ model ประมาณทรัพยากร การรับงานตามขีดจำกัดที่กำหนดเอง และตัวคูณที่ปรับจากผลวัดจริง"""
+
+import json
+import importlib.util
+import subprocess
+import threading
+
+import pytest
+
+import admission
+from conftest import requires_ffmpeg
+from admission import (AdmissionScheduler, AdmissionCancelled, JobFootprint, estimate_footprint,
+                       record_peak_rss, load_corrections, MEMORY_BUDGET_FRACTION)
+
+IMAGE = (4000, 3000)    # 12 ล้านพิกเซล
+TARGET = (1920, 1080)
+
+
+@pytest.fixture(autouse=True)
+def machine(monkeypatch, cache_dir):
+    """เครื่องสมมติ: หน่วยความจำ 8000 MB ว่าง 3000 MB, 4 CPU (ตัวคูณเริ่มจาก cache ว่าง)"""
+    limits = {'total_mb': 8000, 'available_mb': 3000, 'cpus': 4}
+    monkeypatch.setattr(admission, 'machine_limits',
+                        lambda: (limits['total_mb'], limits['available_mb'], limits['cpus']))
+    return limits
+
+
+def expected_encoder_mb():
+    return admission.ENCODER_BASE_MB + admission.ENCODER_MB_PER_MEGAPIXEL * TARGET[0] * TARGET[1] / 1e6
+
+
+def test_estimate_per_backend():
+    decode_mb = admission.DECODED_MB_PER_MEGAPIXEL * 12
+
+    ffmpeg = estimate_footprint("ffmpeg", IMAGE, TARGET)
+    assert (ffmpeg.memory_mb, ffmpeg.cpus) == (pytest.approx(decode_mb + expected_encoder_mb()), 1)
+
+    moviepy = estimate_footprint("moviepy", IMAGE, TARGET)
+    assert moviepy.memory_mb == pytest.approx(admission.MOVIEPY_BASE_MB + admission.MOVIEPY_MB_PER_SOURCE_MEGAPIXEL * 12
+                                              + expected_encoder_mb())
+    assert moviepy.memory_mb > ffmpeg.memory_mb
+
+    visualizer = estimate_footprint("visualizer", IMAGE, TARGET, audio_seconds=100, workers=3)
+    per_worker = admission.VISUALIZER_WORKER_MB + decode_mb + expected_encoder_mb() * admission.VISUALIZER_ENCODER_FACTOR
+    assert visualizer.cpus == 3
+    assert visualizer.memory_mb == pytest.approx(decode_mb + admission.VISUALIZER_STFT_MB
+                                                 + 100 * admission.VISUALIZER_BYTES_PER_SECOND / 1e6 + 3 * per_worker)
+    # ความยาวเพลงมีผลเฉพาะ visualizer (เก็บเสียงหนึ่งรอบไว้วาด)
+    assert estimate_footprint("visualizer", IMAGE, TARGET, 1000, workers=3).memory_mb > visualizer.memory_mb
+    assert estimate_footprint("ffmpeg", IMAGE, TARGET, 1000).memory_mb == ffmpeg.memory_mb
+
+
+def test_corrections_follow_measured_peaks(monkeypatch):
+    footprint = estimate_footprint("ffmpeg", IMAGE, TARGET)
+    raw = footprint.raw_memory_mb
+
+    record_peak_rss(footprint, raw * 2, {'aspect_ratio': "16:9"})
+    assert load_corrections() == {'ffmpeg': pytest.approx(2.0)}
+    corrected = estimate_footprint("ffmpeg", IMAGE, TARGET)
+    assert (corrected.memory_mb, corrected.raw_memory_mb) == (pytest.approx(raw * 2), pytest.approx(raw))
+    # backend อื่นไม่ได้รับผล
+    assert estimate_footprint("moviepy", IMAGE, TARGET).memory_mb == estimate_footprint("moviepy", IMAGE, TARGET).raw_memory_mb
+
+    # ค่าใหม่ถูกถ่วงด้วย moving average (คำนวณจากค่า model ไม่ใช่ค่าที่คูณตัวปรับแล้ว)
+    record_peak_rss(corrected, raw)
+    assert load_corrections()['ffmpeg'] == pytest.approx(2.0 + admission.CORRECTION_SMOOTHING * (1.0 - 2.0))
+
+    # วัดไม่ได้: ไม่เปลี่ยนอะไร
+    record_peak_rss(corrected, None)
+    assert load_corrections()['ffmpeg'] == pytest.approx(1.7)
+
+
+def test_recorded_jobs_are_capped(monkeypatch):
+    monkeypatch.setattr(admission, 'MAX_RECORDED_JOBS', 3)
+    footprint = JobFootprint("ffmpeg", 100, 1)
+    for peak in (110, 120, 130, 140, 150):
+        record_peak_rss(footprint, peak, {'job': peak})
+
+    with open(admission._footprints_path(), 'r', encoding='utf-8') as f:
+        jobs = json.load(f)['jobs']
+    assert [job['job'] for job in jobs] == [130, 140, 150]
+    assert jobs[-1]['estimated_mb'] == 100 and jobs[-1]['peak_mb'] == 150
+
+
+def test_scheduler_limits_come_from_the_machine(machine):
+    scheduler = AdmissionScheduler()
+    assert (scheduler.memory_mb, scheduler.cpus) == (8000 * MEMORY_BUDGET_FRACTION, 4)
+    # หน่วยความจำที่ว่างจริงน้อยกว่างบประมาณ
+    assert scheduler.free_memory_mb() == pytest.approx(3000 * MEMORY_BUDGET_FRACTION)
+
+    machine['available_mb'] = 8000
+    with scheduler.reserve(JobFootprint("ffmpeg", 1000, 1)):
+        assert scheduler.free_memory_mb() == pytest.approx(8000 * MEMORY_BUDGET_FRACTION - 1000)
+
+
+def start_reserving(scheduler, footprint, entered, release, should_stop=None):
+    """จองทรัพยากรใน thread แยก ส่งคืน (thread, dict ผลลัพธ์)"""
+    result = {}
+
+    def run():
+        try:
+            with scheduler.reserve(footprint, should_stop=should_stop):
+                entered.set()
+                release.wait(5)
+        except AdmissionCancelled:
+            result['cancelled'] = True
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, result
+
+
+def test_reserve_waits_for_memory():
+    scheduler = AdmissionScheduler(memory_mb=1000, cpus=8)
+    big = JobFootprint("ffmpeg", 1500, 1)
+    small = JobFootprint("ffmpeg", 400, 1)
+
+    # งานแรกเริ่มได้เสมอ แม้ใหญ่กว่าขีดจำกัด
+    with scheduler.reserve(big):
+        assert (scheduler.running, scheduler.reserved_memory_mb) == (1, 1500)
+        assert not scheduler.fits(small)
+        entered, release = threading.Event(), threading.Event()
+        thread, _result = start_reserving(scheduler, small, entered, release)
+        assert not entered.wait(0.3)
+    assert entered.wait(5)
+    release.set()
+    thread.join(5)
+    assert (scheduler.running, scheduler.reserved_memory_mb, scheduler.reserved_cpus) == (0, 0, 0)
+
+
+def test_reserve_waits_for_cpus():
+    scheduler = AdmissionScheduler(memory_mb=10000, cpus=2)
+    job = JobFootprint("ffmpeg", 100, 1)
+
+    with scheduler.reserve(job), scheduler.reserve(job):
+        assert scheduler.reserved_cpus == 2
+        assert not scheduler.fits(job)
+        assert scheduler.fits(JobFootprint("ffmpeg", 100, 0))
+    assert scheduler.fits(JobFootprint("visualizer", 100, 2))
+
+
+def test_waiting_job_can_be_cancelled():
+    scheduler = AdmissionScheduler(memory_mb=1000, cpus=1)
+    stop = threading.Event()
+    with scheduler.reserve(JobFootprint("ffmpeg", 800, 1)):
+        entered, release = threading.Event(), threading.Event()
+        thread, result = start_reserving(scheduler, JobFootprint("ffmpeg", 800, 1), entered, release,
+                                         should_stop=stop.is_set)
+        stop.set()
+        thread.join(5)
+        assert result == {'cancelled': True}
+        assert not entered.is_set()
+        assert scheduler.running == 1
+
+
+@requires_ffmpeg
+def test_fingerprint_does_not_depend_on_free_memory(tmp_path, monkeypatch, machine):
+    pytest.importorskip("numpy")
+    from PIL import Image
+    from looper_engine import CustomImageMusicLooper
+
+    image = tmp_path / "cover.jpg"
+    Image.new('RGB', (1600, 900), (40, 80, 120)).save(image)
+    audio = tmp_path / "tone.wav"
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=2',
+                    '-ac', '2', str(audio)], check=True)
+
+    # ถือว่ามี MoviePy เพื่อให้ admission เปลี่ยน backend เมื่อหน่วยความจำไม่พอ
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, 'find_spec',
+                        lambda name, *args: object() if name == "moviepy" else find_spec(name, *args))
+
+    def settings_key(available_mb):
+        machine['available_mb'] = available_mb
+        looper = CustomImageMusicLooper(str(image), str(audio), str(tmp_path / "out"), 1, "16:9", 0, False, True,
+                                        scheduler=AdmissionScheduler())
+        footprint = looper._plan_footprint(str(image), str(audio), None)
+        return footprint.backend, looper._render_settings_key(str(audio), None)
+
+    roomy_backend, roomy_key = settings_key(8000)
+    tight_backend, tight_key = settings_key(100)
+    assert (roomy_backend, tight_backend) == ("moviepy", "ffmpeg")
+    assert roomy_key == tight_key
@@ -0,0 +1,152 @@
+"""ทดสอบการอ่านข้อมูล gapless (LAME/Xing, iTunSMPB) จาก bytes ของ header และการหาช่วงเงียบ"""
+
+import struct
+import subprocess
+
+import pytest
+
+from conftest import requires_ffmpeg
+from mp4_boxes import box, full_box, track, movie
+from audio_trim import AudioTrimmer, read_gapless_info
+from pcm_cache import PcmAudio
+
+# ค่าตัวอย่างแบบที่ iTunes เขียน: delay 2112, padding 524, sample จริง 705600 (16 วินาทีที่ 44.1 kHz)
+ITUNSMPB = " 00000000 00000840 0000020C 00000000000AC440 00000000 00000000"
+ITUNSMPB_INFO = {'sample_rate': 44100, 'delay': 2112, 'padding': 524, 'valid_samples': 705600}
+
+
+def id3_tag(*frames):
+    body = b"".join(frames)
+    size = len(body)
+    syncsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b'ID3\x03\x00\x00' + syncsafe + body
+
+
+def id3_frame(frame_id, body):
+    return frame_id + struct.pack('>I', len(body)) + b'\x00\x00' + body
+
+
+def mp3_frame(header=b'\xff\xfb\x90\x00', side_info=32, xing=None, lame=None):
+    """frame แรกของ MP3 (ค่าเริ่มต้น MPEG1 Layer III 44.1 kHz stereo) พร้อม Xing/Info และ LAME tag"""
+    data = header + bytes(side_info)
+    if xing is not None:
+        frames, flags = xing
+        data += b'Info' + struct.pack('>II', flags, frames)
+        data += bytes((4 if flags & 0x02 else 0) + (100 if flags & 0x04 else 0) + (4 if flags & 0x08 else 0))
+    if lame is not None:
+        delay, padding = lame
+        data += b'LAME3.100' + bytes(12) + bytes([delay >> 4, ((delay & 0x0F) << 4) | (padding >> 8), padding & 0xFF])
+    return data + bytes(417 - len(data) % 417)
+
+
+@pytest.fixture
+def write(tmp_path):
+    def write(name, data):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+    return write
+
+
+@pytest.mark.parametrize("flags", [0x01, 0x0F, 0x05])
+def test_lame_tag(write, flags):
+    path = write("song.mp3", mp3_frame(xing=(1000, flags), lame=(576, 1300)))
+    assert read_gapless_info(path) == {'sample_rate': 44100, 'delay': 576, 'padding': 1300,
+                                       'valid_samples': 1000 * 1152 - 576 - 1300}
+
+
+def test_lame_tag_after_id3(write):
+    tag = id3_tag(id3_frame(b'TIT2', b'\x00title'))
+    path = write("song.mp3", tag + mp3_frame(xing=(200, 0x0F), lame=(1105, 0)))
+    assert read_gapless_info(path)['valid_samples'] == 200 * 1152 - 1105
+
+
+def test_lame_tag_mpeg2_mono(write):
+    # MPEG2 22.05 kHz mono: Xing อยู่หลัง side info 9 ไบต์ และ 576 sample ต่อ frame
+    path = write("song.mp3", mp3_frame(header=b'\xff\xf3\x90\xc0', side_info=9, xing=(500, 0x01), lame=(529, 47)))
+    assert read_gapless_info(path) == {'sample_rate': 22050, 'delay': 529, 'padding': 47,
+                                       'valid_samples': 500 * 576 - 529 - 47}
+
+
+def test_xing_without_frame_count_is_ignored(write):
+    assert read_gapless_info(write("song.mp3", mp3_frame(xing=(0, 0x00), lame=(576, 100)))) is None
+
+
+@pytest.mark.parametrize("encoding, text", [
+    (0, b'iTunSMPB\x00' + ITUNSMPB.encode('latin-1')),
+    (1, 'iTunSMPB'.encode('utf-16') + b'\x00\x00' + ITUNSMPB.encode('utf-16')),
+])
+def test_itunsmpb_in_id3_comment(write, encoding, text):
+    comment = id3_frame(b'COMM', bytes([encoding]) + b'eng' + text)
+    path = write("song.mp3", id3_tag(id3_frame(b'TIT2', b'\x00title'), comment) + mp3_frame())
+    assert read_gapless_info(path) == ITUNSMPB_INFO
+
+
+def test_plain_mp3_and_garbage_have_no_info(write):
+    assert read_gapless_info(write("plain.mp3", mp3_frame())) is None
+    assert read_gapless_info(write("garbage.mp3", b"\x00" * 100)) is None
+    assert read_gapless_info(write("short.mp3", b"\xff\xfb")) is None
+    assert read_gapless_info(write("short.m4a", b"\x00\x00\x00\x20moov")) is None
+
+
+def m4a(ilst_entry, keys=None):
+    sound = track(1, b'soun', b'mp4a', 44100, 706560)
+    meta = [full_box(b'hdlr', 0, 0, bytes(4), b'mdir', bytes(12))]
+    if keys:
+        meta.append(full_box(b'keys', 0, 0, struct.pack('>I', len(keys)),
+                             *(struct.pack('>I', 8 + len(key)) + b'mdta' + key for key in keys)))
+    meta.append(box(b'ilst', ilst_entry))
+    return box(b'ftyp', b'M4A ', bytes(4)) + movie(44100, 706560, [sound], box(b'udta', full_box(b'meta', 0, 0, *meta)))
+
+
+def test_itunsmpb_in_itunes_freeform_atom(write):
+    entry = box(b'----', full_box(b'mean', 0, 0, b'com.apple.iTunes'), full_box(b'name', 0, 0, b'iTunSMPB'),
+                box(b'data', struct.pack('>II', 1, 0), ITUNSMPB.encode()))
+    assert read_gapless_info(write("song.m4a", m4a(entry))) == ITUNSMPB_INFO
+
+
+def test_itunsmpb_in_mdta_keys(write):
+    entry = box(struct.pack('>I', 2), box(b'data', struct.pack('>II', 1, 0), ITUNSMPB.encode()))
+    path = write("song.m4a", m4a(entry, keys=[b'com.apple.quicktime.title', b'iTunSMPB']))
+    assert read_gapless_info(path) == ITUNSMPB_INFO
+
+
+def test_content_range_is_sample_accurate():
+    np = pytest.importorskip("numpy")
+    samples = np.zeros((1000, 2), dtype=np.float32)
+    samples[123:457, 0] = 0.5
+
+    start, end = AudioTrimmer()._find_content_range(samples, 1000)
+    assert (start, end) == (0.123, 0.457)
+    assert AudioTrimmer()._find_content_range(np.zeros((1000, 2), dtype=np.float32), 1000) == (0.0, 1.0)
+
+
+@requires_ffmpeg
+def test_gapless_mp3_uses_metadata_without_full_decode(tmp_path, cache_dir):
+    pytest.importorskip("numpy")
+    path = str(tmp_path / "tone.mp3")
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=2',
+                    '-af', 'adelay=500|500,apad=pad_dur=0.3', '-c:a', 'libmp3lame', path], check=True)
+
+    bounds = AudioTrimmer().find_loop_bounds(path)
+
+    assert bounds['source'] == 'metadata'
+    assert bounds['duration'] == pytest.approx(2.8, abs=0.001)
+    assert bounds['start'] == pytest.approx(0.5, abs=0.005)
+    assert bounds['end'] == pytest.approx(2.5, abs=0.005)
+    # decode เฉพาะหัวและท้าย ไม่ได้เก็บ PCM ทั้งเพลงไว้ใน cache
+    assert PcmAudio.load_cached(path) is None
+
+
+@requires_ffmpeg
+def test_file_without_metadata_is_decoded(tmp_path, cache_dir):
+    pytest.importorskip("numpy")
+    path = str(tmp_path / "tone.wav")
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=1',
+                    '-af', 'adelay=250|250,apad=pad_dur=0.5', path], check=True)
+
+    bounds = AudioTrimmer().find_loop_bounds(path)
+
+    assert bounds['source'] == 'decode'
+    assert bounds['start'] == pytest.approx(0.25, abs=0.001)
+    assert bounds['end'] == pytest.approx(1.25, abs=0.001)
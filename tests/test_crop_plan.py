@@ -0,0 +1,107 @@
+"""ทดสอบการหาจุดสนใจของภาพและการเก็บจุดที่ผู้ใช้เลือกเองใน cache"""
+
+import pytest
+
+pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+import crop_plan
+from crop_plan import CropPlan, _find_focus
+
+PORTRAIT = (1080, 1920)
+LANDSCAPE = (1920, 1080)
+
+
+def picture(size, square=None, background=(90, 110, 100)):
+    """ภาพพื้นเรียบ มีสี่เหลี่ยมสีแดงขนาด 160 พิกเซลที่จุดกึ่งกลาง square (x, y)"""
+    image = Image.new('RGB', size, background)
+    if square:
+        x, y = square
+        image.paste((230, 30, 40), (x - 80, y - 80, x + 80, y + 80))
+    return image
+
+
+def analysis_focus(image, target_size):
+    small = image.copy()
+    small.thumbnail((crop_plan.ANALYSIS_SIZE, crop_plan.ANALYSIS_SIZE), Image.Resampling.BILINEAR)
+    return _find_focus(small, image.size, target_size)
+
+
+def contains(box, point):
+    left, top, right, bottom = box
+    return left <= point[0] - 80 and point[0] + 80 <= right and top <= point[1] - 80 and point[1] + 80 <= bottom
+
+
+def test_wide_image_follows_subject():
+    image = picture((1600, 900), square=(1320, 450))
+    focus = analysis_focus(image, PORTRAIT)
+
+    assert focus[1] == 0.5
+    assert focus[0] > 0.7
+    plan = CropPlan(image.size, PORTRAIT, focus)
+    assert contains(plan.box, (1320, 450))
+    # กรอบกลางภาพจะตัดวัตถุทิ้ง
+    assert not contains(CropPlan(image.size, PORTRAIT, (0.5, 0.5)).box, (1320, 450))
+
+
+def test_tall_image_follows_subject():
+    image = picture((900, 1600), square=(450, 260))
+    focus = analysis_focus(image, LANDSCAPE)
+
+    assert focus[0] == 0.5
+    assert focus[1] < 0.3
+    assert contains(CropPlan(image.size, LANDSCAPE, focus).box, (450, 260))
+
+
+@pytest.mark.parametrize("size, target", [((1600, 900), PORTRAIT), ((900, 1600), LANDSCAPE)])
+def test_flat_image_stays_centered(size, target):
+    assert analysis_focus(picture(size), target) == pytest.approx((0.5, 0.5), abs=0.01)
+
+
+def test_same_ratio_uses_whole_image():
+    image = picture((1920, 1080), square=(1700, 900))
+    assert analysis_focus(image, LANDSCAPE) == (0.5, 0.5)
+    assert CropPlan(image.size, LANDSCAPE, (0.9, 0.9)).box == (0, 0, 1920, 1080)
+
+
+def test_box_is_clamped_to_image():
+    plan = CropPlan((1600, 900), PORTRAIT, (1.0, 0.5))
+    assert plan.box == (1600 - 506, 0, 1600, 900)
+    assert CropPlan((1600, 900), PORTRAIT, (0.0, 0.5)).box == (0, 0, 506, 900)
+    assert plan.scaled_box((800, 450)) == (547, 0, 800, 450)
+
+
+@pytest.fixture
+def image_path(tmp_path, cache_dir):
+    path = tmp_path / "cover.png"
+    picture((1600, 900), square=(1320, 450)).save(path)
+    return str(path)
+
+
+def test_auto_focus_is_cached(image_path, monkeypatch):
+    plan = CropPlan.for_image(image_path, PORTRAIT)
+    assert plan.source == "auto"
+
+    def fail(cls, path, target_size):
+        raise AssertionError("crop plan was computed again")
+
+    monkeypatch.setattr(CropPlan, 'compute', classmethod(fail))
+    assert CropPlan.for_image(image_path, PORTRAIT).focus == plan.focus
+
+
+def test_manual_focus_persists_until_cleared(image_path, monkeypatch):
+    auto = CropPlan.for_image(image_path, PORTRAIT)
+
+    manual = CropPlan.set_manual_focus(image_path, PORTRAIT, (0.2, 1.7))
+    assert (manual.source, manual.focus) == ("manual", (0.2, 1.0))
+    assert CropPlan.for_image(image_path, PORTRAIT).focus == (0.2, 1.0)
+    # อัตราส่วนอื่นของภาพเดียวกันไม่ได้รับผล
+    assert CropPlan.for_image(image_path, LANDSCAPE).source == "auto"
+
+    # จุดที่เลือกเองยังอยู่แม้วิธีหาจุดสนใจเปลี่ยนเวอร์ชัน
+    monkeypatch.setattr(crop_plan, 'CROP_PLAN_VERSION', crop_plan.CROP_PLAN_VERSION + 1)
+    assert CropPlan.for_image(image_path, PORTRAIT).source == "manual"
+
+    cleared = CropPlan.clear_manual_focus(image_path, PORTRAIT)
+    assert (cleared.source, cleared.focus) == ("auto", auto.focus)
+    assert CropPlan.for_image(image_path, PORTRAIT).source == "auto"
@@ -0,0 +1,44 @@
+"""ทดสอบว่า engine import ได้เร็วและไม่ดึง GUI หรือ library หนักๆ มาด้วย (worker เริ่มงานได้ทันที)"""
+
+import sys
+import json
+import subprocess
+
+import pytest
+
+from conftest import ROOT
+
+# เวลา import สูงสุดที่ยอมรับ (วินาที) ปกติใช้ราว 30-40 ms เผื่อไว้สำหรับเครื่องที่ช้า
+IMPORT_BUDGET_SECONDS = 0.5
+
+# module ที่ต้อง import เมื่อใช้งานจริงเท่านั้น
+HEAVY_MODULES = ("tkinter", "PIL", "numpy", "moviepy")
+
+MEASURE_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'modules': sorted(sys.modules)}}))
+"""
+
+
+def measure_import(module):
+    """import module ใน interpreter ใหม่ ส่งคืน (เวลาที่ดีที่สุดจาก 3 ครั้ง, module ที่ถูกโหลด)"""
+    best = None
+    for _ in range(3):
+        result = subprocess.run([sys.executable, "-c", MEASURE_SCRIPT.format(module=module)],
+                                cwd=ROOT, capture_output=True, text=True, check=True)
+        measured = json.loads(result.stdout)
+        if best is None or measured['seconds'] < best['seconds']:
+            best = measured
+    return best['seconds'], set(best['modules'])
+
+
+@pytest.mark.parametrize("module", ["looper_engine", "render_farm", "render_cli"])
+def test_worker_modules_import_quickly_without_gui(module):
+    seconds, modules = measure_import(module)
+
+    loaded = sorted(name for name in HEAVY_MODULES if name in modules)
+    assert not loaded, f"{module} imports {', '.join(loaded)} at load time"
+    assert seconds < IMPORT_BUDGET_SECONDS, f"import {module} took {seconds * 1000:.0f} ms"
@@ -0,0 +1,189 @@
+"""ทดสอบ HLS แบบ rolling window ผ่าน HTTP server ในเครื่อง (แบบเดียวกับที่ player ดึงจริง)"""
+
+import os
+import threading
+import urllib.error
+import urllib.request
+import functools
+import http.server
+
+import pytest
+
+from hls_stream import RollingHlsPublisher, SOURCE_PLAYLIST_NAME, LIVE_PLAYLIST_NAME
+
+SEGMENT_DURATIONS = (4.0, 4.0, 2.5)
+WINDOW_SIZE = 4
+
+
+class FakeClock:
+    """นาฬิกาที่เดินเฉพาะเมื่อ publisher รอ (test ไม่ต้องรอเวลาจริง)"""
+
+    def __init__(self, on_sleep=None):
+        self.now = 0.0
+        self.on_sleep = on_sleep
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        if self.on_sleep:
+            self.on_sleep()
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    """segment ของลูปหนึ่งรอบแบบที่ FFmpeg สร้าง (เนื้อหาเป็นชื่อ segment เพื่อตรวจลำดับ)"""
+    path = tmp_path / "source"
+    path.mkdir()
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-PLAYLIST-TYPE:VOD"]
+    for index, duration in enumerate(SEGMENT_DURATIONS):
+        name = f"loop_{index:05d}.ts"
+        (path / name).write_bytes(name.encode())
+        lines += [f"#EXTINF:{duration:.6f},", name]
+    lines.append("#EXT-X-ENDLIST")
+    (path / SOURCE_PLAYLIST_NAME).write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def http_base(tmp_path):
+    """HTTP server ในเครื่องที่เสิร์ฟโฟลเดอร์ผลลัพธ์ ส่งคืน (โฟลเดอร์, URL)"""
+    output_dir = tmp_path / "live"
+    output_dir.mkdir()
+    handler = functools.partial(QuietHandler, directory=str(output_dir))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield str(output_dir), f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.read()
+
+
+def parse_playlist(text):
+    """อ่าน live playlist เป็น (tags, [(ชื่อ, ความยาว, discontinuity)])"""
+    tags = {}
+    entries = []
+    duration = None
+    discontinuity = False
+    for line in text.splitlines():
+        if line == "#EXT-X-DISCONTINUITY":
+            discontinuity = True
+        elif line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:"):].split(",")[0])
+        elif line.startswith("#"):
+            key, _, value = line[1:].partition(":")
+            tags[key] = value
+        elif line:
+            entries.append((line, duration, discontinuity))
+            discontinuity = False
+    return tags, entries
+
+
+def test_window_sequence_and_discontinuities_over_http(source_dir, http_base):
+    output_dir, base_url = http_base
+    snapshots = []
+
+    def poll():
+        # เหมือน player: โหลด playlist แล้วโหลดทุก segment ที่อยู่ในนั้น
+        tags, entries = parse_playlist(fetch(f"{base_url}/{LIVE_PLAYLIST_NAME}").decode())
+        bodies = [fetch(f"{base_url}/{name}") for name, _duration, _discontinuity in entries]
+        snapshots.append((tags, entries, bodies))
+
+    clock = FakeClock(on_sleep=poll)
+    publisher = RollingHlsPublisher(source_dir, output_dir, WINDOW_SIZE, clock=clock, sleep=clock.sleep)
+    published = publisher.run(max_segments=20)
+    poll()
+
+    assert published == 20
+    assert snapshots
+    for tags, entries, bodies in snapshots:
+        assert 0 < len(entries) <= WINDOW_SIZE
+        assert tags["EXT-X-TARGETDURATION"] == "4"
+        # media sequence คือลำดับของ segment แรกใน playlist
+        first = int(entries[0][0][len("live_"):-len(".ts")])
+        assert int(tags["EXT-X-MEDIA-SEQUENCE"]) == first
+        for offset, ((name, duration, discontinuity), body) in enumerate(zip(entries, bodies)):
+            number = first + offset
+            loop_index = number % len(SEGMENT_DURATIONS)
+            assert name == f"live_{number:09d}.ts"
+            assert body == f"loop_{loop_index:05d}.ts".encode()
+            assert duration == SEGMENT_DURATIONS[loop_index]
+            # timestamp เริ่มใหม่ทุกครั้งที่วนกลับไป segment แรกของลูป
+            assert discontinuity == (loop_index == 0 and number > 0)
+        # discontinuity sequence นับ discontinuity ที่ออกจาก playlist ไปแล้ว
+        removed_restarts = sum(1 for number in range(1, first) if number % len(SEGMENT_DURATIONS) == 0)
+        assert int(tags["EXT-X-DISCONTINUITY-SEQUENCE"]) == removed_restarts
+
+    final_tags, final_entries, _bodies = snapshots[-1]
+    assert int(final_tags["EXT-X-MEDIA-SEQUENCE"]) == 20 - WINDOW_SIZE
+    assert [name for name, _duration, _discontinuity in final_entries] == \
+        [f"live_{number:09d}.ts" for number in range(20 - WINDOW_SIZE, 20)]
+
+
+def test_old_segments_are_deleted(source_dir, http_base):
+    output_dir, base_url = http_base
+    clock = FakeClock()
+    publisher = RollingHlsPublisher(source_dir, output_dir, WINDOW_SIZE, clock=clock, sleep=clock.sleep)
+    publisher.run(max_segments=30)
+
+    # เก็บ segment ที่เพิ่งออกจาก playlist ไว้อีกหนึ่ง window ให้ client ที่ยังโหลดอยู่ ที่เหลือถูกลบ
+    segments = sorted(name for name in os.listdir(output_dir) if name.endswith(".ts"))
+    assert segments == [f"live_{number:09d}.ts" for number in range(30 - 2 * WINDOW_SIZE, 30)]
+    with pytest.raises(urllib.error.HTTPError) as error:
+        fetch(f"{base_url}/live_{0:09d}.ts")
+    assert error.value.code == 404
+
+    publisher.cleanup()
+    assert os.listdir(output_dir) == []
+
+
+def test_segments_are_released_in_real_time(source_dir, tmp_path):
+    clock = FakeClock()
+    publisher = RollingHlsPublisher(source_dir, str(tmp_path / "live"), WINDOW_SIZE,
+                                    clock=clock, sleep=clock.sleep)
+    publisher.run(max_segments=WINDOW_SIZE + 6)
+
+    # window แรกเผยแพร่ทันที หลังจากนั้นรอตามความยาวของ segment ก่อนหน้า
+    loop = SEGMENT_DURATIONS * 4
+    assert clock.now == pytest.approx(sum(loop[WINDOW_SIZE:WINDOW_SIZE + 5]))
+
+
+def test_stop_request_ends_the_stream(source_dir, tmp_path):
+    clock = FakeClock()
+    stop_after = 7
+    publisher = RollingHlsPublisher(source_dir, str(tmp_path / "live"), WINDOW_SIZE,
+                                    should_stop=lambda: publisher.published >= stop_after,
+                                    clock=clock, sleep=clock.sleep)
+    assert publisher.run() == stop_after
+
+
+def test_files_from_previous_run_are_removed(source_dir, tmp_path):
+    output_dir = tmp_path / "live"
+    output_dir.mkdir()
+    # ไฟล์ที่ค้างจากครั้งก่อนที่ปิดโปรแกรมกลางคัน
+    for name in ("live_000000003.ts", "live_000000250.ts", "live_000000251.ts.tmp",
+                 LIVE_PLAYLIST_NAME, LIVE_PLAYLIST_NAME + ".tmp"):
+        (output_dir / name).write_bytes(b"stale")
+    (output_dir / "notes.txt").write_bytes(b"keep")
+
+    clock = FakeClock()
+    publisher = RollingHlsPublisher(source_dir, str(output_dir), WINDOW_SIZE, clock=clock, sleep=clock.sleep)
+    publisher.run(max_segments=2)
+
+    assert sorted(os.listdir(output_dir)) == [LIVE_PLAYLIST_NAME, "live_000000000.ts", "live_000000001.ts", "notes.txt"]
+    assert (output_dir / "live_000000000.ts").read_bytes() == b"loop_00000.ts"
+    _tags, entries = parse_playlist((output_dir / LIVE_PLAYLIST_NAME).read_text())
+    assert [name for name, _duration, _discontinuity in entries] == ["live_000000000.ts", "live_000000001.ts"]
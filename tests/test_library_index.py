@@ -0,0 +1,144 @@
+"""ทดสอบการสแกนโฟลเดอร์เพลงและผลวิเคราะห์ใน index"""
+
+import os
+import math
+import shutil
+import sqlite3
+import subprocess
+
+import pytest
+
+from conftest import requires_ffmpeg
+from library_index import LibraryIndex, analyze_track
+from pcm_cache import PcmAudio, decode_range
+
+pytestmark = requires_ffmpeg
+np = pytest.importorskip("numpy")
+
+# ความดัง RMS ของ sine จาก lavfi (amplitude 1/8)
+SINE_LOUDNESS_DB = 20 * math.log10(0.125 / math.sqrt(2))
+
+
+def tone(path, frequency, seconds=1.5, codec_args=()):
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', f"sine=frequency={frequency}:duration={seconds}",
+                    '-af', 'adelay=200|200,apad=pad_dur=0.3', *codec_args, str(path)], check=True)
+    return str(path)
+
+
+@pytest.fixture
+def library(tmp_path, cache_dir):
+    folder = tmp_path / "music"
+    (folder / "sub").mkdir(parents=True)
+    tone(folder / "a.wav", 440)
+    shutil.copyfile(folder / "a.wav", folder / "sub" / "copy of a.wav")
+    tone(folder / "sub" / "b.wav", 660)
+    (folder / "broken.mp3").write_bytes(b"not audio" * 100)
+    return str(folder)
+
+
+def test_scan_analyzes_each_content_once(library, tmp_path, monkeypatch):
+    import library_index
+
+    # นับจำนวนครั้งที่วิเคราะห์ผ่านไฟล์ log (analyze_track ทำงานใน process ของ pool)
+    log = tmp_path / "analyzed.log"
+    probe_codec = library_index.probe_codec
+
+    def logged_probe(path):
+        with open(log, 'a', encoding='utf-8') as f:
+            f.write(os.path.basename(path) + "\n")
+        return probe_codec(path)
+
+    monkeypatch.setattr(library_index, 'probe_codec', logged_probe)
+    progress = []
+    index = LibraryIndex(str(tmp_path / "tracks.sqlite"))
+
+    counts = index.scan(library, workers=1, progress_callback=lambda *args: progress.append(args))
+
+    assert counts == {'analyzed': 2, 'reused': 1, 'unchanged': 0, 'removed': 0, 'failed': 1}
+    assert sorted(log.read_text().split("\n")[:-1]) == ["a.wav", "b.wav"]
+    # ไฟล์ที่ล้มเหลวก็รายงานความคืบหน้า
+    assert [(done, total) for done, total, _path in progress] == [(1, 4), (2, 4), (3, 4), (4, 4)]
+    assert sorted(os.path.relpath(path, library) for _done, _total, path in progress) == \
+        sorted(["a.wav", os.path.join("sub", "copy of a.wav"), os.path.join("sub", "b.wav"), "broken.mp3"])
+
+    original_analysis = index.lookup(os.path.join(library, "a.wav"))
+    copy_analysis = index.lookup(os.path.join(library, "sub", "copy of a.wav"))
+    assert copy_analysis['path'] == os.path.join(library, "sub", "copy of a.wav")
+    assert copy_analysis['loudness_db'] == original_analysis['loudness_db']
+    assert copy_analysis['content_hash'] == original_analysis['content_hash']
+
+
+def test_rescan_and_removed_files(library, tmp_path):
+    index = LibraryIndex(str(tmp_path / "tracks.sqlite"))
+    index.scan(library, workers=1)
+
+    assert index.scan(library, workers=1) == {'analyzed': 0, 'reused': 0, 'unchanged': 3, 'removed': 0, 'failed': 1}
+
+    os.remove(os.path.join(library, "sub", "b.wav"))
+    shutil.copyfile(os.path.join(library, "a.wav"), os.path.join(library, "moved.wav"))
+    assert index.scan(library, workers=1) == {'analyzed': 0, 'reused': 1, 'unchanged': 2, 'removed': 1, 'failed': 1}
+
+
+def test_missing_row_for_known_hash_is_analyzed(library, tmp_path, monkeypatch):
+    index = LibraryIndex(str(tmp_path / "tracks.sqlite"))
+    index.scan(library, workers=1)
+    shutil.copyfile(os.path.join(library, "a.wav"), os.path.join(library, "again.wav"))
+
+    # ผลของเนื้อหานั้นถูกลบไประหว่างสแกน (เช่น process อื่น)
+    monkeypatch.setattr(index, '_analysis_by_hash', lambda content_hash: None)
+    counts = index.scan(library, workers=1)
+    assert (counts['analyzed'], counts['reused'], counts['failed']) == (1, 0, 1)
+    assert index.lookup(os.path.join(library, "again.wav"))['loop_source'] == 'decode'
+
+
+def test_connections_are_closed(library, tmp_path, monkeypatch):
+    opened = []
+    closed = []
+
+    class TrackedConnection(sqlite3.Connection):
+        def close(self):
+            closed.append(self)
+            super().close()
+
+    connect = sqlite3.connect
+
+    def tracked_connect(*args, **kwargs):
+        opened.append(connect(*args, factory=TrackedConnection, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(sqlite3, 'connect', tracked_connect)
+    index = LibraryIndex(str(tmp_path / "tracks.sqlite"))
+    index.scan(library, workers=1)
+    index.loop_bounds(os.path.join(library, "a.wav"))
+
+    assert len(opened) > 5
+    assert len(closed) == len(opened)
+
+
+def test_gapless_track_is_not_fully_decoded(tmp_path, cache_dir):
+    audio = tone(tmp_path / "a.mp3", 440, seconds=3, codec_args=('-c:a', 'libmp3lame'))
+    analysis = analyze_track(audio)
+
+    assert analysis['loop_source'] == 'metadata'
+    assert analysis['codec'] == 'mp3'
+    assert (analysis['sample_rate'], analysis['channels']) == (44100, 1)
+    assert analysis['duration'] == pytest.approx(3.5, abs=0.001)
+    assert PcmAudio.load_cached(audio) is None
+
+    # เท่ากับความดังของช่วงเดียวกันจากการ decode ทั้งเพลง
+    samples, sample_rate = decode_range(audio)
+    loop = samples[round(analysis['loop_start'] * sample_rate):round(analysis['loop_end'] * sample_rate)]
+    expected = 10 * np.log10(np.square(loop, dtype=np.float64).mean())
+    assert analysis['loudness_db'] == pytest.approx(expected, abs=0.01)
+
+
+def test_loudness_uses_the_cached_decode(tmp_path, cache_dir):
+    audio = tone(tmp_path / "a.wav", 440)
+    analysis = analyze_track(audio)
+
+    assert analysis['loop_source'] == 'decode'
+    assert PcmAudio.load_cached(audio) is not None
+    assert analysis['duration'] == pytest.approx(2.0, abs=0.001)
+    assert (analysis['loop_start'], analysis['loop_end']) == (pytest.approx(0.2, abs=0.001),
+                                                              pytest.approx(1.7, abs=0.001))
+    assert analysis['loudness_db'] == pytest.approx(SINE_LOUDNESS_DB, abs=0.1)
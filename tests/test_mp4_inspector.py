@@ -0,0 +1,163 @@
+"""ทดสอบตัวอ่าน box ของ MP4 ด้วยไฟล์ที่สร้างจาก box โดยตรง (ไม่ต้องมี FFmpeg) และไฟล์จริงจาก FFmpeg"""
+
+import struct
+import subprocess
+
+import pytest
+
+import mp4_boxes
+from conftest import requires_ffmpeg
+from mp4_boxes import box, full_box, track
+from mp4_inspector import Mp4Inspector, verify_library
+
+TIMESCALE = 1000
+VIDEO_SECONDS = 12.0
+
+
+def movie(duration_ms, tracks, extra=b""):
+    return mp4_boxes.movie(TIMESCALE, duration_ms, tracks, extra)
+
+
+def regular_mp4(moov_first=True, audio_seconds=VIDEO_SECONDS):
+    ftyp = box(b'ftyp', b'isom', bytes(4), b'isom')
+    moov = movie(int(VIDEO_SECONDS * TIMESCALE), [
+        track(1, b'vide', b'avc1', 12800, int(VIDEO_SECONDS * 12800), samples=((300, 512),)),
+        track(2, b'soun', b'mp4a', 44100, int(audio_seconds * 44100), samples=((517, 1024),)),
+    ])
+    mdat = box(b'mdat', bytes(64))
+    return ftyp + (moov + mdat if moov_first else mdat + moov)
+
+
+def fragmented_mp4(fragments=3, fragment_seconds=4):
+    """fMP4 แบบที่ FFmpeg เขียน: moov ไม่มีความยาว ความยาวจริงอยู่ใน moof แต่ละอัน"""
+    mvex = box(b'mvex', full_box(b'trex', 0, 0, struct.pack('>IIIII', 1, 1, 512, 0, 0)),
+               full_box(b'trex', 0, 0, struct.pack('>IIIII', 2, 1, 1024, 0, 0)))
+    data = box(b'ftyp', b'iso5', bytes(4), b'iso5') + movie(0, [
+        track(1, b'vide', b'avc1', 12800, 0), track(2, b'soun', b'mp4a', 48000, 0)], mvex)
+    for index in range(fragments):
+        video_samples = fragment_seconds * 25
+        audio_frames = fragment_seconds * 48000 // 1024
+        # video ใช้ default duration จาก trex, audio ระบุ duration ทีละ sample ใน trun
+        video = box(b'traf', full_box(b'tfhd', 0, 0x020000, struct.pack('>I', 1)),
+                    full_box(b'tfdt', 1, 0, struct.pack('>Q', index * video_samples * 512)),
+                    full_box(b'trun', 0, 0x01, struct.pack('>Ii', video_samples, 0)))
+        audio = box(b'traf', full_box(b'tfhd', 0, 0x08, struct.pack('>II', 2, 1024)),
+                    full_box(b'tfdt', 0, 0, struct.pack('>I', index * audio_frames * 1024)),
+                    full_box(b'trun', 0, 0x100, struct.pack('>I', audio_frames),
+                             b"".join(struct.pack('>I', 1024) for _ in range(audio_frames))))
+        data += box(b'moof', full_box(b'mfhd', 0, 0, struct.pack('>I', index + 1)), video, audio)
+        data += box(b'mdat', bytes(32))
+    return data
+
+
+@pytest.fixture
+def write(tmp_path):
+    def write(name, data):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+    return write
+
+
+def test_regular_file(write):
+    info = Mp4Inspector(write("ok.mp4", regular_mp4())).inspect()
+
+    assert info['duration'] == VIDEO_SECONDS
+    assert info['moov_position'] == 'start'
+    assert not info['fragmented'] and not info['truncated']
+    assert [(t['id'], t['type'], t['codec']) for t in info['tracks']] == [(1, 'vide', 'avc1'), (2, 'soun', 'mp4a')]
+    assert [t['sample_count'] for t in info['tracks']] == [300, 517]
+    assert info['tracks'][1]['duration'] == pytest.approx(VIDEO_SECONDS)
+
+
+def test_moov_at_end(write):
+    assert Mp4Inspector(write("end.mp4", regular_mp4(moov_first=False))).inspect()['moov_position'] == 'end'
+
+
+def test_verify_reports_short_track(write):
+    ok, problems, _info = Mp4Inspector(write("short.mp4", regular_mp4(audio_seconds=9.0))).verify(VIDEO_SECONDS)
+
+    assert not ok
+    assert len(problems) == 1 and "track 2" in problems[0]
+
+
+def test_verify_reports_wrong_duration(write):
+    ok, problems, _info = Mp4Inspector(write("ok.mp4", regular_mp4())).verify(expected_duration=60)
+    assert not ok and problems
+
+
+def test_fragmented_durations_come_from_fragments(write):
+    info = Mp4Inspector(write("frag.mp4", fragmented_mp4())).inspect()
+
+    assert info['fragmented']
+    video, audio = info['tracks']
+    assert video['duration'] == pytest.approx(12.0)
+    assert audio['duration'] == pytest.approx(3 * (4 * 48000 // 1024) * 1024 / 48000)
+    assert info['duration'] == max(video['duration'], audio['duration'])
+
+
+@pytest.mark.parametrize("cut", [20, 40, 100, 150, 300, 500])
+def test_truncated_file_is_reported_not_raised(write, cut):
+    data = regular_mp4()
+    ok, problems, _info = Mp4Inspector(write("cut.mp4", data[:cut])).verify(VIDEO_SECONDS)
+    assert not ok and problems
+
+
+@pytest.mark.parametrize("box_type", [b'mvhd', b'tkhd', b'mdhd', b'hdlr', b'stsd', b'stts'])
+def test_file_cut_right_after_a_box_header(write, box_type):
+    data = regular_mp4()
+    cut = data.index(box_type) + 4
+    ok, problems, _info = Mp4Inspector(write("cut.mp4", data[:cut])).verify(VIDEO_SECONDS)
+    assert not ok and problems
+
+
+@pytest.mark.parametrize("box_type", [b'trex', b'tfhd', b'tfdt', b'trun'])
+def test_fragmented_file_cut_right_after_a_box_header(write, box_type):
+    data = fragmented_mp4()
+    cut = data.index(box_type) + 4
+    ok, problems, _info = Mp4Inspector(write("cut.mp4", data[:cut])).verify()
+    assert not ok and problems
+
+
+@pytest.mark.parametrize("cut", [700, 900, 1300])
+def test_truncated_fragmented_file_is_reported_not_raised(write, cut):
+    data = fragmented_mp4()
+    assert cut < len(data)
+    ok, problems, _info = Mp4Inspector(write("cut.mp4", data[:cut])).verify()
+    assert not ok and problems
+
+
+def test_corrupt_box_sizes_are_reported(write):
+    data = bytearray(regular_mp4())
+    # box ขนาด 4 (เล็กกว่า header) กลาง moov
+    moov = data.index(b'moov') - 4
+    struct.pack_into('>I', data, moov + 8, 4)
+    ok, problems, info = Mp4Inspector(write("bad.mp4", bytes(data))).verify()
+    assert not ok and problems and info is None
+
+    garbage = write("garbage.mp4", b"not an mp4 file at all")
+    assert not Mp4Inspector(garbage).verify()[0]
+
+
+def test_verify_library(tmp_path, write):
+    write("good.mp4", regular_mp4())
+    write("bad.mp4", regular_mp4()[:200])
+    write("notes.txt", b"ignored")
+
+    results = {name.rsplit("/", 1)[-1]: ok for name, ok, _problems in verify_library(str(tmp_path))}
+    assert results == {"bad.mp4": False, "good.mp4": True}
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize("movflags", [["-movflags", "+faststart"],
+                                      ["-movflags", "+frag_keyframe+empty_moov+default_base_moof"]])
+def test_files_written_by_ffmpeg(tmp_path, movflags):
+    path = str(tmp_path / "real.mp4")
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', 'color=size=64x64:rate=10',
+                    '-f', 'lavfi', '-i', 'sine=sample_rate=44100', '-t', '5', '-c:v', 'libx264', '-g', '10',
+                    '-c:a', 'aac', *movflags, path], check=True)
+
+    ok, problems, info = Mp4Inspector(path).verify(expected_duration=5)
+    assert ok, problems
+    assert info['moov_position'] == 'start'
+    assert info['fragmented'] == ("+faststart" not in movflags[1])
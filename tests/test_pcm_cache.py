@@ -0,0 +1,55 @@
+"""ทดสอบ PCM cache เมื่อหลาย thread decode เพลงเดียวกันพร้อมกัน"""
+
+import os
+import stat
+import subprocess
+import threading
+
+import pytest
+
+from conftest import requires_ffmpeg
+from cache_utils import make_temp_path
+from pcm_cache import PcmAudio, _cache_path
+
+
+def test_temp_paths_are_unique_and_readable(tmp_path):
+    target = str(tmp_path / "data.json")
+    paths = {make_temp_path(target) for _ in range(20)}
+
+    assert len(paths) == 20
+    for path in paths:
+        assert os.path.dirname(path) == str(tmp_path)
+        assert os.path.basename(path).startswith("data.json.") and path.endswith(".tmp")
+    if os.name == "posix":
+        umask = os.umask(0)
+        os.umask(umask)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o666 & ~umask
+
+
+@requires_ffmpeg
+def test_concurrent_decodes_of_the_same_file(tmp_path, cache_dir):
+    pytest.importorskip("numpy")
+    audio = str(tmp_path / "tone.wav")
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=2',
+                    '-ar', '48000', audio], check=True)
+
+    errors = []
+    barrier = threading.Barrier(4)
+
+    def decode():
+        try:
+            barrier.wait()
+            PcmAudio.decode(audio, _cache_path(audio))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=decode) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(os.path.dirname(_cache_path(audio))) == [os.path.basename(_cache_path(audio))]
+    pcm = PcmAudio.load_or_decode(audio)
+    assert (pcm.sample_rate, pcm.frame_count) == (48000, 96000)
@@ -0,0 +1,169 @@
+"""ทดสอบการต่อความยาววิดีโอเดิมด้วย stream copy: การเลือกช่วงที่วน, การอ่าน/เขียน ADTS และเสียงที่ได้"""
+
+import os
+import subprocess
+
+import pytest
+
+from conftest import requires_ffmpeg
+from cache_utils import CACHE_DIR_ENV
+from render_extend import (AAC_FRAME_SAMPLES, AAC_PRIMING_SAMPLES, SPLICE_START_FRAME, MAX_SPLICE_SLIP_SECONDS,
+                           choose_splice_units, splice_plan, read_adts_frames, write_spliced_adts, aac_frames_for)
+
+SAMPLE_RATE = 44100
+MAX_SLIP = MAX_SPLICE_SLIP_SECONDS * SAMPLE_RATE
+
+# ลูปที่ไม่มีช่วงยาวเท่าหลายรอบพอดีภายใน 30 วินาที แต่มีช่วงที่ slip เป็นลบและบวก
+LOOP_SAMPLES = 49074
+
+
+def adts_frame(payload, sample_rate=SAMPLE_RATE, raw_blocks=0):
+    """frame ADTS (AAC-LC stereo ไม่มี CRC) ที่มีข้อมูลเป็น payload"""
+    length = 7 + len(payload)
+    rate_index = (96000, 88200, 64000, 48000, 44100, 32000, 24000).index(sample_rate)
+    header = bytes([0xFF, 0xF1, (1 << 6) | (rate_index << 2), (2 << 6) | (length >> 11),
+                    (length >> 3) & 0xFF, ((length & 0x07) << 5) | 0x1F, 0xFC | raw_blocks])
+    return header + payload
+
+
+def numbered_adts(path, count):
+    """ไฟล์ ADTS ที่แต่ละ frame เก็บลำดับของตัวเอง (ความยาวไม่เท่ากัน)"""
+    with open(path, 'wb') as f:
+        for index in range(count):
+            f.write(adts_frame(index.to_bytes(2, 'big') * (1 + index % 3)))
+    return str(path)
+
+
+def frame_numbers(path):
+    """ลำดับของ frame ในไฟล์ที่สร้างจาก numbered_adts"""
+    _rate, offsets = read_adts_frames(path)
+    data = open(path, 'rb').read()
+    return [int.from_bytes(data[start + 7:start + 9], 'big') for start in offsets[:-1]]
+
+
+def test_loop_that_fits_whole_frames_needs_one_unit():
+    assert choose_splice_units(3 * AAC_FRAME_SAMPLES, SAMPLE_RATE, 10) == [(3, 0)]
+    assert choose_splice_units(1536, SAMPLE_RATE, 10) == [(3, 0)]
+
+
+def test_units_slip_both_ways_within_the_limit():
+    units = choose_splice_units(LOOP_SAMPLES, SAMPLE_RATE, 30)
+    assert [slip > 0 for _unit_frames, slip in units] == [False, True]
+    for unit_frames, slip in units:
+        assert (unit_frames * AAC_FRAME_SAMPLES - slip) % LOOP_SAMPLES == 0
+        assert 0 < abs(slip) <= MAX_SLIP
+        assert (SPLICE_START_FRAME + unit_frames + 1) * AAC_FRAME_SAMPLES <= 30 * SAMPLE_RATE
+
+
+def test_no_unit_for_a_short_render_or_an_empty_loop():
+    assert choose_splice_units(LOOP_SAMPLES, SAMPLE_RATE, 1) is None
+    assert choose_splice_units(0, SAMPLE_RATE, 30) is None
+
+
+def test_plan_alternates_units_to_keep_the_slip_bounded():
+    units = choose_splice_units(LOOP_SAMPLES, SAMPLE_RATE, 30)
+    total_frames = 3 * 3600 * SAMPLE_RATE // AAC_FRAME_SAMPLES
+    plan, max_lag = splice_plan(units, total_frames)
+
+    assert plan[0][0] == 0
+    assert all(start == SPLICE_START_FRAME for start, _end in plan[1:])
+    assert sum(end - start for start, end in plan) == total_frames
+    assert max_lag <= max(abs(slip) for _unit_frames, slip in units)
+
+
+def test_plan_with_one_unit_accumulates_the_slip():
+    plan, max_lag = splice_plan([(10, -3)], 50)
+    assert plan == [(0, 12), (2, 12), (2, 12), (2, 12), (2, 10)]
+    assert max_lag == 12
+
+
+def test_plan_uses_the_head_when_the_source_is_long_enough():
+    assert splice_plan([(10, -3)], 40, frame_count=40) == ([(0, 40)], 0)
+
+
+def test_read_adts_frames(tmp_path):
+    path = numbered_adts(tmp_path / "audio.aac", 5)
+    sample_rate, offsets = read_adts_frames(path)
+
+    assert sample_rate == SAMPLE_RATE
+    assert list(offsets) == [0, 9, 20, 33, 42, 53]
+    assert offsets[-1] == os.path.getsize(path)
+
+
+def test_read_adts_frames_rejects_lost_sync_and_multiple_blocks(tmp_path):
+    broken = tmp_path / "broken.aac"
+    broken.write_bytes(adts_frame(b"ok") + b"\x00" * 16)
+    with pytest.raises(ValueError, match="sync lost at byte 9"):
+        read_adts_frames(str(broken))
+
+    blocks = tmp_path / "blocks.aac"
+    blocks.write_bytes(adts_frame(b"ok", raw_blocks=1))
+    with pytest.raises(ValueError, match="several raw data blocks"):
+        read_adts_frames(str(blocks))
+
+
+def test_write_spliced_adts_follows_the_plan(tmp_path):
+    source = numbered_adts(tmp_path / "source.aac", 8)
+    _rate, offsets = read_adts_frames(source)
+    target = str(tmp_path / "spliced.aac")
+
+    # ช่วงแรกใช้ slip -5 ต่อด้วย +7 (สะสมเหลือ 2) แล้วกลับไปใช้ -5
+    write_spliced_adts(source, offsets, [(3, -5), (4, 7)], 12, target)
+    assert frame_numbers(target) == [0, 1, 2, 3, 4, 2, 3, 4, 5, 2, 3, 4]
+
+    write_spliced_adts(source, offsets, [(3, -5), (4, 7)], 4, target)
+    assert frame_numbers(target) == [0, 1, 2, 3]
+
+
+@requires_ffmpeg
+def test_extended_render_matches_a_full_render(tmp_path, cache_dir, monkeypatch, capsys):
+    np = pytest.importorskip("numpy")
+    from PIL import Image
+    from looper_engine import CustomImageMusicLooper
+
+    image = tmp_path / "cover.jpg"
+    Image.new('RGB', (640, 360), (40, 80, 120)).save(image)
+    audio = tmp_path / "noise.wav"
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', f"anoisesrc=d=2:c=pink:r={SAMPLE_RATE}:a=0.3",
+                    '-af', f"atrim=end_sample={LOOP_SAMPLES}", '-ac', '2', str(audio)], check=True)
+
+    def render(folder, seconds):
+        looper = CustomImageMusicLooper(str(image), str(audio), str(tmp_path / folder), seconds / 3600, "16:9",
+                                        0, False, True)
+        assert looper.process()
+        return looper
+
+    def decode(path):
+        output = subprocess.run(['ffmpeg', '-v', 'error', '-i', path, '-map', '0:a:0', '-f', 'f32le', '-'],
+                                capture_output=True, check=True).stdout
+        return np.frombuffer(output, dtype='<f4').reshape(-1, 2)
+
+    render("extended", 30)
+    extended = render("extended", 60)
+    assert any(stage == "render" and detail.startswith("extended") for stage, detail in extended.trace)
+    assert "Extended" in capsys.readouterr().out
+
+    # render ใหม่ทั้งไฟล์ด้วย cache แยก (ไม่มีไฟล์เดิมให้ต่อ)
+    monkeypatch.setenv(CACHE_DIR_ENV, os.path.join(cache_dir, "full"))
+    full = render("full", 60)
+
+    expected = decode(full.output_video)
+    actual = decode(extended.output_video)
+    assert len(actual) == len(expected)
+
+    # เหมือนกันทุก sample จนถึงจุดต่อแรก (priming ถูกข้ามเหมือนไฟล์ที่ render ใหม่)
+    units = choose_splice_units(LOOP_SAMPLES, SAMPLE_RATE, 30)
+    plan, max_lag = splice_plan(units, aac_frames_for(60, SAMPLE_RATE))
+    first_splice = plan[0][1] * AAC_FRAME_SAMPLES - AAC_PRIMING_SAMPLES
+    assert np.array_equal(actual[:first_splice], expected[:first_splice])
+    assert not np.array_equal(actual[first_splice:first_splice + AAC_FRAME_SAMPLES],
+                              expected[first_splice:first_splice + AAC_FRAME_SAMPLES])
+
+    # หลังจุดต่อ เสียงเลื่อนไปจากการ render ใหม่ไม่เกิน max_lag (ไม่สะสมตามจำนวนจุดต่อ)
+    window = 4096
+    for start in range(first_splice + SAMPLE_RATE, len(expected) - SAMPLE_RATE, 5 * SAMPLE_RATE):
+        reference = expected[start:start + window]
+        errors = [np.sum((actual[start + lag:start + lag + window] - reference) ** 2)
+                  for lag in range(-AAC_FRAME_SAMPLES, AAC_FRAME_SAMPLES + 1)]
+        lag = int(np.argmin(errors)) - AAC_FRAME_SAMPLES
+        assert abs(lag) <= max_lag <= MAX_SLIP
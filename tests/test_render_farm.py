@@ -0,0 +1,198 @@
+"""ทดสอบ coordinator/worker ด้วย worker หลาย process บนเครื่องเดียวกัน (แทนหลายเครื่อง)"""
+
+import os
+import json
+import time
+import socket
+import threading
+import subprocess
+import multiprocessing
+
+import pytest
+
+from conftest import requires_ffmpeg
+from render_farm import RenderCoordinator, _run_local_worker
+
+# ความยาววิดีโอของแต่ละงาน (สั้นพอให้ test เร็ว แต่ยัง encode จริง)
+JOB_HOURS = 0.002
+
+
+@pytest.fixture
+def media(tmp_path):
+    """ภาพหนึ่งภาพ และเพลงสั้นๆ ความถี่ต่างกันหลายเพลง (งานจึงไม่ซ้ำกัน)"""
+    from PIL import Image
+
+    image = tmp_path / "cover.jpg"
+    Image.new('RGB', (320, 240), (40, 80, 120)).save(image)
+
+    def audio(frequency):
+        path = tmp_path / f"tone_{frequency}.wav"
+        subprocess.run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i',
+                        f"sine=frequency={frequency}:duration=3", str(path)], check=True)
+        return str(path)
+
+    return str(image), audio
+
+
+def make_specs(media, output_folder, frequencies):
+    image, audio = media
+    return [{'image_file': image, 'audio_file': audio(frequency), 'output_folder': output_folder,
+             'duration_hours': JOB_HOURS} for frequency in frequencies]
+
+
+def run_farm(specs, cache_dir, worker_count):
+    """รัน coordinator กับ worker process ในเครื่อง
+
+    ส่งคืน (jobs, worker ที่ได้งานแต่ละครั้ง, เหตุการณ์ ("start"/"end", job_id) เรียงตามลำดับที่เกิด)
+    """
+    started_on = []
+    events = []
+    lock = threading.Lock()
+
+    def report(job, message):
+        with lock:
+            if job.worker and message.startswith("เริ่มงานบน"):
+                started_on.append(job.worker)
+                events.append(("start", job.job_id))
+            elif job.state == "done":
+                events.append(("end", job.job_id))
+
+    coordinator = RenderCoordinator(specs, "127.0.0.1", 0, cache_dir=cache_dir, progress_callback=report)
+    workers = start_workers(coordinator, worker_count)
+    try:
+        jobs = coordinator.run()
+    finally:
+        stop_workers(workers)
+    return jobs, started_on, events
+
+
+def max_concurrency(events):
+    """จำนวนงานที่ทำพร้อมกันมากที่สุด จากลำดับเหตุการณ์เริ่ม/จบของงาน"""
+    running = peak = 0
+    for kind, _job_id in events:
+        running += 1 if kind == "start" else -1
+        peak = max(peak, running)
+    return peak
+
+
+def start_workers(coordinator, count, prefix="local"):
+    workers = [multiprocessing.Process(target=_run_local_worker, args=("127.0.0.1", coordinator.address[1],
+                                                                       f"{prefix}{index}"))
+               for index in range(count)]
+    for process in workers:
+        process.start()
+    return workers
+
+
+def run_in_thread(coordinator):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault('jobs', coordinator.run()), daemon=True)
+    thread.start()
+    return thread, result
+
+
+def stop_workers(workers):
+    for process in workers:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+
+
+@requires_ffmpeg
+def test_local_workers_render_every_job(media, tmp_path, cache_dir):
+    output_folder = str(tmp_path / "out")
+    specs = make_specs(media, output_folder, (220, 330, 440, 550))
+
+    jobs, started_on, _events = run_farm(specs, cache_dir, worker_count=2)
+
+    assert [job.state for job in jobs] == ["done"] * len(specs)
+    outputs = [job.output for job in jobs]
+    assert len(set(outputs)) == len(specs)
+    for output in outputs:
+        assert os.path.dirname(output) == output_folder
+        assert os.path.getsize(output) > 0
+    assert all(job.trace for job in jobs)
+    # งานกระจายไปทุก worker
+    assert {worker.split("@")[0] for worker in started_on} == {"local0", "local1"}
+    # worker ใช้ cache ที่ coordinator กำหนด (manifest ของไฟล์ผลลัพธ์อยู่ใน cache เดียวกัน)
+    manifests = [json.load(open(os.path.join(cache_dir, "renders", name), encoding='utf-8'))
+                 for name in os.listdir(os.path.join(cache_dir, "renders"))]
+    assert sorted(manifest['path'] for manifest in manifests) == sorted(outputs)
+
+
+@requires_ffmpeg
+def test_job_is_retried_on_another_worker_after_a_disconnect(media, tmp_path, cache_dir):
+    specs = make_specs(media, str(tmp_path / "out"), (440,))
+    coordinator = RenderCoordinator(specs, "127.0.0.1", 0, cache_dir=cache_dir)
+    thread, result = run_in_thread(coordinator)
+
+    # worker ที่รับงานแล้วหลุดไปก่อนส่งผล
+    with socket.create_connection(coordinator.address) as connection:
+        connection.sendall(b'{"type": "hello", "worker": "flaky"}\n{"type": "request"}\n')
+        reply = json.loads(connection.makefile('r', encoding='utf-8').readline())
+    assert reply['type'] == "job"
+
+    workers = start_workers(coordinator, 1, prefix="steady")
+    try:
+        thread.join(timeout=120)
+    finally:
+        stop_workers(workers)
+
+    assert not thread.is_alive()
+    job = result['jobs'][0]
+    assert job.state == "done"
+    assert job.attempts == 2
+    assert any(worker.startswith("flaky@") for worker in job.failed_workers)
+    assert os.path.isfile(job.output)
+
+
+@requires_ffmpeg
+def test_workers_render_jobs_concurrently(media, tmp_path, cache_dir):
+    # วัดจำนวนงานที่ทำพร้อมกันแทนเวลารวม จึงไม่ขึ้นกับจำนวน CPU ของเครื่องที่รัน test
+    frequencies = (220, 275, 330, 385, 440, 495)
+    jobs, _started, events = run_farm(make_specs(media, str(tmp_path / "one"), frequencies),
+                                      os.path.join(cache_dir, "one"), worker_count=1)
+    assert all(job.state == "done" for job in jobs)
+    assert max_concurrency(events) == 1
+
+    jobs, started_on, events = run_farm(make_specs(media, str(tmp_path / "two"), frequencies),
+                                        os.path.join(cache_dir, "two"), worker_count=2)
+    assert all(job.state == "done" for job in jobs)
+    assert sorted(kind for kind, _job_id in events) == ["end"] * 6 + ["start"] * 6
+    assert max_concurrency(events) == 2
+    assert {worker.split("@")[0] for worker in started_on} == {"local0", "local1"}
+
+
+def test_jobs_fail_when_no_worker_connects(tmp_path):
+    specs = [{'image_file': "cover.jpg", 'audio_file': f"song{index}.mp3", 'output_folder': str(tmp_path)}
+             for index in range(2)]
+    messages = []
+    coordinator = RenderCoordinator(specs, "127.0.0.1", 0, worker_timeout=0.3,
+                                    progress_callback=lambda job, message: messages.append((job.job_id, message)))
+    start = time.monotonic()
+    jobs = coordinator.run()
+
+    assert time.monotonic() - start < 5
+    assert [(job.state, job.attempts) for job in jobs] == [("failed", 0)] * 2
+    assert all("no worker connected" in job.error for job in jobs)
+    assert sorted(job_id for job_id, _message in messages) == [0, 1]
+
+
+def test_jobs_fail_after_the_last_worker_disconnects(tmp_path):
+    specs = [{'image_file': "cover.jpg", 'audio_file': "song.mp3", 'output_folder': str(tmp_path)}]
+    coordinator = RenderCoordinator(specs, "127.0.0.1", 0, worker_timeout=0.5)
+    thread, result = run_in_thread(coordinator)
+
+    # worker เชื่อมต่ออยู่นานกว่า timeout ได้ (ไม่ล้มเหลวระหว่างที่ยังมี worker) แล้วหลุดไประหว่างทำงาน
+    with socket.create_connection(coordinator.address) as connection:
+        connection.sendall(b'{"type": "hello", "worker": "flaky"}\n{"type": "request"}\n')
+        reply = json.loads(connection.makefile('r', encoding='utf-8').readline())
+        assert reply['type'] == "job"
+        time.sleep(1.0)
+        assert thread.is_alive()
+
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    job = result['jobs'][0]
+    assert (job.state, job.attempts) == ("failed", 1)
+    assert "no worker connected" in job.error
@@ -0,0 +1,150 @@
+"""ทดสอบการตั้งชื่อและย้ายไฟล์ผลลัพธ์เข้าที่ โดยไม่เขียนทับไฟล์ของงานอื่น"""
+
+import os
+
+import pytest
+
+import render_outputs
+from render_extend import save_render_manifest, load_render_manifest
+from render_outputs import choose_output_path, publish_output, link_output, find_identical_output, suffixed_path
+
+FINGERPRINT = "1a2b3c4d" + "e" * 32
+OTHER_FINGERPRINT = "99887766" + "f" * 32
+
+
+@pytest.fixture
+def out(tmp_path, cache_dir):
+    folder = tmp_path / "out"
+    (folder / ".render").mkdir(parents=True)
+    return folder
+
+
+def write(path, data, fingerprint=None):
+    """สร้างไฟล์ (และ manifest ถ้าระบุ fingerprint) ส่งคืน path เป็น str"""
+    path.write_bytes(data)
+    if fingerprint:
+        save_render_manifest(str(path), "settings", fingerprint, 3600)
+    return str(path)
+
+
+def rendered(out, data=b"new render"):
+    """ไฟล์ที่ render เสร็จแล้วในโฟลเดอร์ชั่วคราวข้างปลายทาง"""
+    return write(out / ".render" / "song_music_loop.mp4", data)
+
+
+def test_free_name_is_used(out):
+    preferred = str(out / "song_music_loop.mp4")
+    assert choose_output_path(preferred, FINGERPRINT) == preferred
+    assert publish_output(rendered(out), preferred, FINGERPRINT) == preferred
+    assert open(preferred, 'rb').read() == b"new render"
+    assert os.listdir(out / ".render") == []
+
+
+def test_name_taken_by_a_foreign_file(out):
+    preferred = write(out / "song_music_loop.mp4", b"someone else's video")
+    expected = str(out / "song_music_loop_1a2b3c4d.mp4")
+
+    assert choose_output_path(preferred, FINGERPRINT) == expected
+    assert publish_output(rendered(out), preferred, FINGERPRINT) == expected
+    assert open(expected, 'rb').read() == b"new render"
+    assert open(preferred, 'rb').read() == b"someone else's video"
+
+
+def test_name_taken_by_another_job(out):
+    preferred = write(out / "song_music_loop.mp4", b"other job", OTHER_FINGERPRINT)
+
+    path = publish_output(rendered(out), preferred, FINGERPRINT)
+    assert path == suffixed_path(preferred, FINGERPRINT)
+    assert open(preferred, 'rb').read() == b"other job"
+    assert load_render_manifest(preferred)['fingerprint'] == OTHER_FINGERPRINT
+
+
+def test_name_taken_by_the_same_job_is_replaced(out):
+    preferred = write(out / "song_music_loop.mp4", b"old render of this job", FINGERPRINT)
+    other = write(out / "song_music_loop_99887766.mp4", b"other job", OTHER_FINGERPRINT)
+
+    assert choose_output_path(preferred, FINGERPRINT) == preferred
+    assert publish_output(rendered(out), preferred, FINGERPRINT) == preferred
+    assert open(preferred, 'rb').read() == b"new render"
+    assert open(other, 'rb').read() == b"other job"
+
+
+def test_suffixed_name_taken_too(out):
+    preferred = write(out / "song_music_loop.mp4", b"foreign")
+    short = write(out / "song_music_loop_1a2b3c4d.mp4", b"other job, same prefix", "1a2b3c4d" + "0" * 32)
+    full = str(out / f"song_music_loop_{FINGERPRINT}.mp4")
+
+    assert choose_output_path(preferred, FINGERPRINT) == full
+    assert publish_output(rendered(out), preferred, FINGERPRINT) == full
+    assert open(full, 'rb').read() == b"new render"
+    assert open(preferred, 'rb').read() == b"foreign"
+    assert open(short, 'rb').read() == b"other job, same prefix"
+
+
+def test_name_taken_while_rendering(out):
+    preferred = str(out / "song_music_loop.mp4")
+    assert choose_output_path(preferred, FINGERPRINT) == preferred
+    # อีกงานหนึ่งเขียนชื่อนี้เสร็จก่อน ระหว่างที่งานนี้ render อยู่
+    write(out / "song_music_loop.mp4", b"finished first", OTHER_FINGERPRINT)
+
+    assert publish_output(rendered(out), preferred, FINGERPRINT) == suffixed_path(preferred, FINGERPRINT)
+    assert open(preferred, 'rb').read() == b"finished first"
+
+
+def test_user_chosen_name_is_overwritten(out):
+    preferred = write(out / "my video.mp4", b"old", OTHER_FINGERPRINT)
+    assert publish_output(rendered(out), preferred, FINGERPRINT, exclusive=False) == preferred
+    assert open(preferred, 'rb').read() == b"new render"
+
+
+@pytest.fixture
+def no_hardlinks(monkeypatch):
+    """ระบบไฟล์ที่ไม่รองรับ hardlink (เช่น FAT32 หรือ network drive บางแบบ)"""
+    def link(source, target):
+        raise OSError("hard links are not supported")
+
+    monkeypatch.setattr(render_outputs.os, 'link', link)
+
+
+def test_publish_without_hardlinks(out, no_hardlinks):
+    preferred = write(out / "song_music_loop.mp4", b"foreign")
+    short = write(out / "song_music_loop_1a2b3c4d.mp4", b"other job", "1a2b3c4d" + "0" * 32)
+
+    path = publish_output(rendered(out), preferred, FINGERPRINT)
+    assert path == str(out / f"song_music_loop_{FINGERPRINT}.mp4")
+    assert open(path, 'rb').read() == b"new render"
+    assert open(preferred, 'rb').read() == b"foreign"
+    assert open(short, 'rb').read() == b"other job"
+    assert os.listdir(out / ".render") == []
+
+
+def test_link_identical_output(out):
+    existing = write(out / "song_music_loop.mp4", b"finished render", FINGERPRINT)
+    target = str(out / "copy" / "song_music_loop.mp4")
+    os.mkdir(out / "copy")
+
+    assert find_identical_output(FINGERPRINT) == existing
+    assert link_output(existing, target) == target
+    assert os.path.samefile(existing, target)
+    # ไฟล์ใหม่ก็ใช้ซ้ำ/ต่อความยาวได้เหมือนไฟล์เดิม
+    assert load_render_manifest(target)['fingerprint'] == FINGERPRINT
+    assert link_output(existing, target) == target
+    assert sorted(os.listdir(out / "copy")) == ["song_music_loop.mp4"]
+
+
+def test_link_fallback_without_hardlinks(out, no_hardlinks):
+    existing = write(out / "song_music_loop.mp4", b"finished render", FINGERPRINT)
+    other = write(out / "other.mp4", b"other job", OTHER_FINGERPRINT)
+    target = str(out / "wanted.mp4")
+
+    # ไม่ให้คัดลอก: อ้างถึงไฟล์เดิมแทน
+    assert link_output(existing, target) == existing
+    assert not os.path.exists(target)
+
+    # ผู้ใช้ระบุชื่อเอง: คัดลอกไฟล์
+    assert link_output(existing, target, copy=True) == target
+    assert open(target, 'rb').read() == b"finished render"
+    assert not os.path.samefile(existing, target)
+    assert load_render_manifest(target)['fingerprint'] == FINGERPRINT
+    assert open(other, 'rb').read() == b"other job"
+    assert sorted(os.listdir(out)) == [".render", "other.mp4", "song_music_loop.mp4", "wanted.mp4"]
@@ -0,0 +1,118 @@
+"""ทดสอบ peaks ของรูปคลื่นกับ PCM ที่เขียนลง cache โดยตรง (ไม่ต้องมี FFmpeg)"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import pcm_cache
+import waveform
+from waveform import WaveformPeaks, BASE_BUCKET_SAMPLES, MIN_LEVEL_BUCKETS
+
+SAMPLE_RATE = 8000
+TOTAL_SAMPLES = 60 * SAMPLE_RATE + 100      # ไม่ลงตัวกับ bucket เพื่อให้มี bucket สุดท้ายที่สั้นกว่า
+SPIKE_SAMPLE = 123457
+SPIKE = 0.9
+
+
+@pytest.fixture
+def song(tmp_path, cache_dir):
+    """ไฟล์เพลงปลอมที่มี PCM อยู่ใน cache แล้ว: sine 3 Hz สองช่องกับ spike หนึ่ง sample"""
+    path = tmp_path / "song.mp3"
+    path.write_bytes(b"not really audio")
+
+    t = np.arange(TOTAL_SAMPLES) / SAMPLE_RATE
+    wave = np.sin(2 * np.pi * 3 * t)
+    samples = np.stack((0.5 * wave, 0.3 * wave), axis=1).astype(np.float32)
+    samples[SPIKE_SAMPLE] = SPIKE
+    with open(pcm_cache._cache_path(str(path)), 'wb') as f:
+        f.write(pcm_cache._wav_header(SAMPLE_RATE, 2, samples.nbytes))
+        f.write(samples.astype('<f4').tobytes())
+    return str(path), samples.mean(axis=1, dtype=np.float32)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # หลาย chunk ต่อไฟล์ เพื่อทดสอบรอยต่อระหว่าง chunk
+    monkeypatch.setattr(waveform, 'DECODE_CHUNK_SAMPLES', BASE_BUCKET_SAMPLES * 50)
+
+
+def test_levels_match_brute_force(song):
+    path, mono = song
+    peaks = WaveformPeaks.compute(path)
+
+    assert (peaks.sample_rate, peaks.total_samples) == (SAMPLE_RATE, TOTAL_SAMPLES)
+    assert peaks.duration == pytest.approx(TOTAL_SAMPLES / SAMPLE_RATE)
+    for index, (samples_per_bucket, data) in enumerate(peaks.levels):
+        assert samples_per_bucket == BASE_BUCKET_SAMPLES * 2 ** index
+        expected = [(mono[i:i + samples_per_bucket].min(), mono[i:i + samples_per_bucket].max())
+                    for i in range(0, TOTAL_SAMPLES, samples_per_bucket)]
+        assert np.array_equal(data, waveform._to_int16(np.array(expected)))
+    assert len(peaks.levels[-1][1]) <= MIN_LEVEL_BUCKETS < len(peaks.levels[-2][1])
+
+
+@pytest.mark.parametrize("start, end, width", [
+    (0.0, 60.0, 800),           # ทั้งเพลง (ระดับหยาบที่สุด)
+    (10.0, 20.0, 640),          # ซูมปานกลาง
+    (15.3, 15.7, 300),          # ซูมมาก: 1 คอลัมน์เล็กกว่า bucket ที่ละเอียดที่สุด
+    (14.0, 100.0, 513),         # ช่วงเกินท้ายเพลง
+])
+def test_columns_at_zoom_levels(song, start, end, width):
+    path, mono = song
+    peaks = WaveformPeaks.compute(path)
+    mins, maxs = peaks.columns(start, end, width)
+
+    first = int(start * SAMPLE_RATE)
+    last = min(int(end * SAMPLE_RATE), TOTAL_SAMPLES)
+    samples_per_column = (last - first) / width
+    slack = int(max(samples_per_column, BASE_BUCKET_SAMPLES))
+    tolerance = 1 / 32767
+    assert len(mins) == len(maxs) == width
+
+    # ทุกคอลัมน์อยู่ในช่วงของ sample รอบคอลัมน์นั้น (ไม่มี peak ที่ไม่มีอยู่จริง)
+    edges = np.linspace(first, last, width + 1)
+    for column in range(width):
+        around = mono[max(int(edges[column]) - slack, 0):int(edges[column + 1]) + slack]
+        assert around.min() - tolerance <= mins[column] <= maxs[column] <= around.max() + tolerance
+
+    # spike ต้องเห็นเสมอไม่ว่าจะซูมระดับไหน (bucket ที่คร่อมขอบคอลัมน์นับเป็นของคอลัมน์ถัดไป)
+    if first <= SPIKE_SAMPLE < last:
+        column = int((SPIKE_SAMPLE - first) / samples_per_column)
+        assert maxs[column:column + 2].max() == pytest.approx(SPIKE, abs=tolerance)
+    else:
+        assert maxs.max() < 0.5
+
+
+def test_columns_of_empty_range(song):
+    path, _mono = song
+    mins, maxs = WaveformPeaks.compute(path).columns(70.0, 80.0, 50)
+    assert not mins.any() and not maxs.any()
+
+
+def test_save_and_load_round_trip(song, tmp_path):
+    path, _mono = song
+    peaks = WaveformPeaks.compute(path)
+    sidecar = str(tmp_path / "song.peaks")
+    peaks.save(sidecar)
+
+    loaded = WaveformPeaks.load(sidecar)
+    assert (loaded.sample_rate, loaded.total_samples) == (peaks.sample_rate, peaks.total_samples)
+    assert [bucket for bucket, _ in loaded.levels] == [bucket for bucket, _ in peaks.levels]
+    for (_, expected), (_, actual) in zip(peaks.levels, loaded.levels):
+        assert np.array_equal(expected, actual)
+
+    with open(sidecar, 'r+b') as f:
+        f.truncate(200)
+    with pytest.raises(ValueError):
+        WaveformPeaks.load(sidecar)
+
+
+def test_load_or_compute_uses_sidecar(song, monkeypatch):
+    path, _mono = song
+    computed = WaveformPeaks.load_or_compute(path)
+
+    def fail(cls, audio_path):
+        raise AssertionError("peaks were computed again")
+
+    monkeypatch.setattr(WaveformPeaks, 'compute', classmethod(fail))
+    cached = WaveformPeaks.load_or_compute(path)
+    assert np.array_equal(cached.columns(0, 60, 100)[1], computed.columns(0, 60, 100)[1])
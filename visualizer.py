@@ -0,0 +1,216 @@
+"""
+Audio visualizer overlay for Image Music Looper
+คำนวณสเปกตรัมของเพลงหนึ่งรอบด้วย STFT แบบ vectorized (NumPy) ที่ frame rate ต่ำ
+วาดแถบสเปกตรัมหรือวงแหวนความคืบหน้าลงบนภาพ แล้ว encode เป็นช่วงๆ แบบขนานหลาย process
+วิดีโอที่ได้ยาวเท่าเพลงหนึ่งรอบพอดี นำไปวนซ้ำด้วย stream copy ได้ตลอดความยาววิดีโอ
+"""
+
+import os
+import shutil
+import tempfile
+import subprocess
+
+VISUALIZER_STYLES = ("bars", "ring")
+
+# frame rate ของ overlay (ต่ำพอให้ encode เร็ว แต่ยังดูต่อเนื่อง)
+VISUALIZER_FPS = 10
+
+# จำนวนแถบสเปกตรัมและช่วงความถี่ที่แสดง (Hz)
+BAR_COUNT = 48
+MIN_FREQUENCY = 40.0
+MAX_FREQUENCY = 16000.0
+
+# ขนาด FFT และช่วง dB ที่แปลงเป็นความสูง 0..1
+FFT_SIZE = 2048
+DYNAMIC_RANGE_DB = 60.0
+
+# ความสูงสูงสุดของแถบ (สัดส่วนของความสูงภาพ) และความทึบของ overlay (0-255)
+BAR_HEIGHT_RATIO = 0.18
+OVERLAY_ALPHA = 170
+
+# จำนวน frame ที่คำนวณ STFT พร้อมกันต่อชุด (จำกัดหน่วยความจำ)
+STFT_BATCH_FRAMES = 512
+
+# จำนวน frame ต่อช่วงที่ส่งให้แต่ละ process encode
+SEGMENT_FRAMES = 300
+
+# ความถี่ในการตรวจว่าถูกสั่งหยุดระหว่างรอ worker (วินาที)
+STOP_POLL_SECONDS = 0.2
+
+# Event ที่ process หลักตั้งเมื่อถูกสั่งหยุด (ตั้งค่าใน worker ผ่าน _init_worker)
+_stop_event = None
+
+
+def compute_levels(pcm, start=None, end=None, fps=VISUALIZER_FPS, bars=BAR_COUNT):
+    """คำนวณความดังของแต่ละแถบสำหรับทุก frame ในเพลงหนึ่งรอบ
+
+    ส่งคืน (levels [frames, bars] ค่า 0..1, loudness [frames] ค่า 0..1, frame_rate แบบ Fraction)
+    frame_rate ถูกปรับให้จำนวน frame คูณเวลาต่อ frame เท่ากับความยาวลูปพอดี (ไม่เลื่อนเมื่อวนซ้ำ)
+    """
+    import numpy as np
+    from fractions import Fraction
+
+    first = pcm.frame_at(start or 0.0)
+    last = pcm.frame_count if end is None else pcm.frame_at(end)
+    loop_samples = max(last - first, 1)
+    mono = pcm.samples[first:first + loop_samples].mean(axis=1, dtype=np.float32)
+
+    frame_count = max(int(round(loop_samples / pcm.sample_rate * fps)), 1)
+    frame_rate = Fraction(frame_count * pcm.sample_rate, loop_samples)
+
+    # แบ่ง bin เป็นแถบตามสเกล log ของความถี่ (อย่างน้อย 1 bin ต่อแถบ)
+    max_frequency = min(MAX_FREQUENCY, pcm.sample_rate / 2)
+    edges = np.geomspace(MIN_FREQUENCY, max_frequency, bars + 1) * FFT_SIZE / pcm.sample_rate
+    edges = np.maximum(np.round(edges).astype(np.int64), 1)
+    edges = np.minimum(np.maximum(edges, edges[0] + np.arange(bars + 1)), FFT_SIZE // 2)
+    bins_per_band = np.maximum(np.diff(edges), 1)
+
+    # STFT ทีละชุดของ frame ตำแหน่งหน้าต่างวนรอบลูปเพื่อให้รอยต่อของลูปต่อเนื่อง
+    centers = (np.arange(frame_count) * loop_samples // frame_count).astype(np.int64)
+    window_shape = np.hanning(FFT_SIZE).astype(np.float32)
+    band_power = np.empty((frame_count, bars), dtype=np.float64)
+    rms = np.empty(frame_count, dtype=np.float64)
+    for batch in range(0, frame_count, STFT_BATCH_FRAMES):
+        indices = (centers[batch:batch + STFT_BATCH_FRAMES, None] - FFT_SIZE // 2 + np.arange(FFT_SIZE)) % loop_samples
+        windows = mono[indices]
+        rms[batch:batch + len(windows)] = np.sqrt(np.mean(np.square(windows, dtype=np.float64), axis=1))
+        power = np.square(np.abs(np.fft.rfft(windows * window_shape, axis=1)) / (FFT_SIZE / 4))
+        band_power[batch:batch + len(windows)] = np.add.reduceat(power[:, :edges[-1]], edges[:-1], axis=1) / bins_per_band
+
+    decibels = 10 * np.log10(band_power + 1e-12)
+    levels = np.clip((decibels - decibels.max() + DYNAMIC_RANGE_DB) / DYNAMIC_RANGE_DB, 0.0, 1.0)
+    # ทำให้นุ่มนวลตามเวลา (วนรอบเหมือนกัน)
+    levels = (np.roll(levels, 1, axis=0) + 2 * levels + np.roll(levels, -1, axis=0)) / 4
+
+    loudness = np.clip(rms / (rms.max() or 1.0), 0.0, 1.0)
+    return levels.astype(np.float32), loudness.astype(np.float32), frame_rate
+
+
+def render_period_video(base_image_path, levels, loudness, frame_rate, output_path, style="bars",
+                        timescale=None, workers=None, should_stop=None):
+    """วาด overlay และ encode วิดีโอหนึ่งรอบ (ไม่มีเสียง) แบ่งเป็นช่วงให้หลาย process ทำพร้อมกัน
+
+    ส่งคืน True ถ้าสำเร็จ, False ถ้าถูกสั่งหยุดระหว่างทำงาน
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+
+    frame_count = len(levels)
+    work_dir = tempfile.mkdtemp(prefix="iml_visualizer_")
+    jobs = []
+    for index, first in enumerate(range(0, frame_count, SEGMENT_FRAMES)):
+        segment_path = os.path.join(work_dir, f"segment_{index:05d}.mp4")
+        jobs.append((base_image_path, levels[first:first + SEGMENT_FRAMES], loudness[first:first + SEGMENT_FRAMES],
+                     first, frame_count, str(frame_rate), style, timescale, segment_path))
+
+    stop_event = multiprocessing.Event()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(stop_event,)) as executor:
+            futures = [executor.submit(_encode_segment, job) for job in jobs]
+            pending = futures
+            while pending:
+                if should_stop and should_stop():
+                    # worker ที่กำลัง encode หยุดภายใน frame ถัดไป งานที่ยังไม่เริ่มถูกยกเลิกทันที
+                    stop_event.set()
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return False
+                done, pending = wait(pending, timeout=STOP_POLL_SECONDS, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    future.result()
+
+        # ต่อทุกช่วงเป็นไฟล์เดียวด้วย stream copy
+        list_path = os.path.join(work_dir, "segments.txt")
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for job in jobs:
+                f.write(f"file '{os.path.basename(job[-1])}'\n")
+
+        temp_output = f"{output_path}.{os.getpid()}.tmp.mp4"
+        cmd = ['ffmpeg', '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy']
+        if timescale:
+            cmd += ['-video_track_timescale', str(timescale)]
+        result = subprocess.run(cmd + [temp_output], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"FFmpeg concat failed: {result.stderr[-500:]}")
+        os.replace(temp_output, output_path)
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _init_worker(stop_event):
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _encode_segment(job):
+    """(ทำงานใน process แยก) วาด frame ของช่วงหนึ่งและส่งให้ FFmpeg encode
+
+    ส่งคืน None ถ้าถูกสั่งหยุดระหว่างทำงาน
+    """
+    from PIL import Image, ImageDraw
+
+    (base_image_path, levels, loudness, first_frame, total_frames,
+     frame_rate, style, timescale, segment_path) = job
+
+    base = Image.open(base_image_path).convert('RGBA')
+    width, height = base.size
+    cmd = ['ffmpeg', '-y', '-v', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+           '-s', f"{width}x{height}", '-framerate', frame_rate, '-i', '-',
+           '-c:v', 'libx264', '-bf', '0', '-pix_fmt', 'yuv420p']
+    if timescale:
+        cmd += ['-video_track_timescale', str(timescale)]
+    cmd += ['-f', 'mp4', segment_path]
+
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for offset in range(len(levels)):
+            if _stop_event is not None and _stop_event.is_set():
+                process.kill()
+                return None
+            overlay = Image.new('RGBA', base.size, (0, 0, 0, 0))
+            draw = ImageDraw.Draw(overlay)
+            if style == "ring":
+                _draw_progress_ring(draw, width, height, (first_frame + offset) / total_frames, loudness[offset])
+            else:
+                _draw_spectrum_bars(draw, width, height, levels[offset])
+            frame = Image.alpha_composite(base, overlay).convert('RGB')
+            process.stdin.write(frame.tobytes())
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            # FFmpeg ถูกหยุดไปแล้ว
+            pass
+        stderr = process.stderr.read().decode(errors='replace')
+        process.wait()
+
+    if process.returncode != 0:
+        raise RuntimeError(f"FFmpeg segment encode failed: {stderr[-500:]}")
+    return segment_path
+
+
+def _draw_spectrum_bars(draw, width, height, levels):
+    """วาดแถบสเปกตรัมโปร่งแสงที่ขอบล่างของภาพ"""
+    bar_count = len(levels)
+    margin = width * 0.05
+    slot = (width - 2 * margin) / bar_count
+    max_height = height * BAR_HEIGHT_RATIO
+    bottom = height - height * 0.04
+
+    for index, level in enumerate(levels):
+        left = margin + index * slot + slot * 0.15
+        right = margin + (index + 1) * slot - slot * 0.15
+        top = bottom - max(float(level) * max_height, 2)
+        draw.rectangle((left, top, right, bottom), fill=(255, 255, 255, OVERLAY_ALPHA))
+
+
+def _draw_progress_ring(draw, width, height, progress, loudness):
+    """วาดวงแหวนแสดงตำแหน่งในเพลง (หนาขึ้นตามความดัง) ที่มุมขวาล่าง"""
+    radius = min(width, height) * 0.06
+    center_x = width - radius * 2
+    center_y = height - radius * 2
+    box = (center_x - radius, center_y - radius, center_x + radius, center_y + radius)
+    thickness = max(int(radius * (0.12 + 0.12 * float(loudness))), 2)
+
+    draw.ellipse(box, outline=(255, 255, 255, OVERLAY_ALPHA // 3), width=thickness)
+    draw.arc(box, start=-90, end=-90 + 360 * progress, fill=(255, 255, 255, OVERLAY_ALPHA), width=thickness)
@@ -0,0 +1,154 @@
+"""
+Waveform peaks for Image Music Looper
+คำนวณค่า min/max ของเสียงหลายระดับการซูม และเก็บเป็นไฟล์ sidecar
+เพื่อให้เปิดเพลงเดิมซ้ำแล้วแสดงรูปคลื่นได้ทันที
+"""
+
+import os
+import struct
+
+from cache_utils import get_cache_dir, file_content_hash, make_temp_path
+from pcm_cache import PcmAudio
+
+PEAKS_MAGIC = b'IMLPEAK1'
+PEAKS_HEADER = struct.Struct('<8sIII')     # magic, sample_rate, total_samples, level_count
+PEAKS_LEVEL_HEADER = struct.Struct('<II')  # samples_per_bucket, bucket_count
+
+# จำนวน sample ต่อ bucket ของระดับที่ละเอียดที่สุด
+BASE_BUCKET_SAMPLES = 256
+
+# หยุดลดระดับเมื่อจำนวน bucket น้อยกว่าค่านี้
+MIN_LEVEL_BUCKETS = 512
+
+# ขนาดข้อมูลที่อ่านจาก cache ต่อครั้ง (จำนวน sample)
+DECODE_CHUNK_SAMPLES = BASE_BUCKET_SAMPLES * 4096
+
+
+class WaveformPeaks:
+    """คลาสสำหรับเก็บ peaks ของเสียง (min/max ต่อ bucket หลายระดับ)"""
+
+    def __init__(self, sample_rate, total_samples, levels):
+        self.sample_rate = sample_rate
+        self.total_samples = total_samples
+        # รายการ (samples_per_bucket, array int16 ขนาด [n, 2]) เรียงจากละเอียดไปหยาบ
+        self.levels = levels
+
+    @property
+    def duration(self):
+        return self.total_samples / self.sample_rate if self.sample_rate else 0.0
+
+    @classmethod
+    def load_or_compute(cls, audio_path):
+        """โหลด peaks จาก sidecar ถ้ามี ไม่เช่นนั้นคำนวณและบันทึกไว้"""
+        sidecar = os.path.join(get_cache_dir("peaks"), f"{file_content_hash(audio_path)}.peaks")
+        if os.path.exists(sidecar):
+            try:
+                return cls.load(sidecar)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"Invalid peaks file {sidecar}, recomputing: {e}")
+
+        peaks = cls.compute(audio_path)
+        peaks.save(sidecar)
+        return peaks
+
+    @classmethod
+    def compute(cls, audio_path):
+        """คำนวณ peaks ทุกระดับจาก PCM ที่ decode เก็บไว้ใน cache (อ่านทีละส่วนจาก memmap)"""
+        import numpy as np
+
+        pcm = PcmAudio.load_or_decode(audio_path)
+        total_samples = pcm.frame_count
+        base_parts = []
+        for index in range(0, total_samples, DECODE_CHUNK_SAMPLES):
+            # รวมทุก channel เป็น mono เฉพาะส่วนที่กำลังคำนวณ
+            samples = pcm.samples[index:index + DECODE_CHUNK_SAMPLES].mean(axis=1, dtype=np.float32)
+            usable = len(samples) // BASE_BUCKET_SAMPLES * BASE_BUCKET_SAMPLES
+            base_parts.append(_bucket_min_max(samples[:usable], BASE_BUCKET_SAMPLES))
+            if usable < len(samples):
+                leftover = samples[usable:]
+                base_parts.append(np.array([[leftover.min(), leftover.max()]], dtype=np.float32))
+
+        base = np.concatenate(base_parts) if base_parts else np.zeros((0, 2), dtype=np.float32)
+        levels = [(BASE_BUCKET_SAMPLES, _to_int16(base))]
+
+        # ระดับถัดไปรวม bucket ทีละคู่
+        while len(levels[-1][1]) > MIN_LEVEL_BUCKETS:
+            samples_per_bucket, previous = levels[-1]
+            count = len(previous) // 2 * 2
+            pairs = previous[:count].reshape(-1, 2, 2)
+            reduced = np.stack((pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)), axis=1)
+            if len(previous) % 2:
+                reduced = np.concatenate((reduced, previous[-1:]))
+            levels.append((samples_per_bucket * 2, reduced))
+
+        return cls(pcm.sample_rate, total_samples, levels)
+
+    @classmethod
+    def load(cls, path):
+        """อ่านไฟล์ peaks"""
+        import numpy as np
+
+        with open(path, 'rb') as f:
+            magic, sample_rate, total_samples, level_count = PEAKS_HEADER.unpack(f.read(PEAKS_HEADER.size))
+            if magic != PEAKS_MAGIC:
+                raise ValueError("not a peaks file")
+            levels = []
+            for _ in range(level_count):
+                samples_per_bucket, count = PEAKS_LEVEL_HEADER.unpack(f.read(PEAKS_LEVEL_HEADER.size))
+                data = np.frombuffer(f.read(count * 4), dtype='<i2')
+                if len(data) != count * 2:
+                    raise ValueError("truncated peaks file")
+                levels.append((samples_per_bucket, data.reshape(count, 2)))
+        return cls(sample_rate, total_samples, levels)
+
+    def save(self, path):
+        """บันทึก peaks เป็นไฟล์ binary (เขียนไฟล์ชั่วคราวก่อนแล้ว rename)"""
+        temp_path = make_temp_path(path)
+        with open(temp_path, 'wb') as f:
+            f.write(PEAKS_HEADER.pack(PEAKS_MAGIC, self.sample_rate, self.total_samples, len(self.levels)))
+            for samples_per_bucket, data in self.levels:
+                f.write(PEAKS_LEVEL_HEADER.pack(samples_per_bucket, len(data)))
+                f.write(data.astype('<i2').tobytes())
+        os.replace(temp_path, path)
+
+    def columns(self, start, end, width):
+        """ส่งคืน (mins, maxs) ค่า -1..1 สำหรับช่วงเวลา [start, end) แบ่งเป็น width คอลัมน์"""
+        import numpy as np
+
+        start_sample = max(int(start * self.sample_rate), 0)
+        end_sample = min(int(end * self.sample_rate), self.total_samples)
+        samples_per_column = max((end_sample - start_sample) / max(width, 1), 1)
+
+        # ใช้ระดับที่หยาบที่สุดที่ 1 bucket ยังไม่กว้างเกิน 1 คอลัมน์
+        samples_per_bucket, data = self.levels[0]
+        for level_bucket, level_data in self.levels:
+            if level_bucket <= samples_per_column:
+                samples_per_bucket, data = level_bucket, level_data
+
+        if not len(data) or end_sample <= start_sample:
+            return np.zeros(width, dtype=np.float32), np.zeros(width, dtype=np.float32)
+
+        edges = np.linspace(start_sample, end_sample, width + 1) / samples_per_bucket
+        first = np.clip(edges[:-1].astype(np.int64), 0, len(data) - 1)
+        stop = int(min(max(np.ceil(edges[-1]), first[-1] + 1), len(data)))
+        window = data[first[0]:stop]
+        offsets = first - first[0]
+
+        mins = np.minimum.reduceat(window[:, 0], offsets) / 32767.0
+        maxs = np.maximum.reduceat(window[:, 1], offsets) / 32767.0
+        return mins, maxs
+
+
+def _bucket_min_max(samples, bucket):
+    """min/max ต่อ bucket แบบ vectorized"""
+    import numpy as np
+
+    frames = samples.reshape(-1, bucket)
+    return np.stack((frames.min(axis=1), frames.max(axis=1)), axis=1) if len(frames) else frames[:, :2]
+
+
+def _to_int16(values):
+    """แปลง float -1..1 เป็น int16 เพื่อให้ไฟล์เล็ก"""
+    import numpy as np
+
+    return (np.clip(values, -1.0, 1.0) * 32767).astype(np.int16)